@@ -45,7 +45,11 @@ from ac2.plugins.metadata.lastfm import LastFMScrobbler
 from ac2.alsavolume import ALSAVolume
 from ac2.metadata import Metadata
 import ac2.metadata
+import ac2.data.coverarthandler
 from ac2.data.mpd import MpdMetadataProcessor
+from ac2 import simple_http
+from ac2.data.cache import PersistentCache, DEFAULT_PATH as DEFAULT_CACHE_PATH
+import ac2.data.artworkstore as artworkstore
 from ac2.players.mpdcontrol import MPDControl
 from ac2.players.vollibrespot import VollibspotifyControl
 from ac2.players.vollibrespot import MYNAME as SPOTIFYNAME
@@ -124,6 +128,26 @@ def parse_config(debugmode=False):
 
         mpris.ignore_players = ignore_players
 
+        poll_threads = config.getint("mpris", "poll_threads", fallback=4)
+        poll_timeout = config.getfloat("mpris", "poll_timeout", fallback=2)
+        mpris.set_poll_parameters(poll_threads, poll_timeout)
+
+        min_delay = config.getfloat("mpris", "min_delay", fallback=0.2)
+        max_delay = config.getfloat("mpris", "max_delay", fallback=5)
+        idle_after = config.getint("mpris", "idle_after", fallback=60)
+        mpris.set_interval_parameters(min_delay, max_delay, idle_after)
+
+        mpris.metadata_refresh = config.getint("mpris", "metadata_refresh",
+                                               fallback=600)
+
+        # Players are always tracked with NameOwnerChanged, properties are
+        # only pushed by the players with use_signals
+        use_signals = config.getboolean("mpris", "use_signals",
+                                        fallback=False)
+        max_cache_age = config.getint("mpris", "signal_refresh",
+                                      fallback=30)
+        mpris.enable_mpris_signals(max_cache_age, properties=use_signals)
+
     logging.debug("setting auto_pause for MPRIS players to %s",
                   auto_pause)
     mpris.auto_pause = auto_pause
@@ -137,6 +161,7 @@ def parse_config(debugmode=False):
         token = config.get("webserver", "authtoken", fallback=None)
         server = AudioControlWebserver(port=port, authtoken=token, debug=debugmode)
         mpris.register_metadata_display(server)
+        mpris.register_state_display(server)
         server.set_player_control(mpris)
         server.add_updater(mpris)
         if config.getboolean("webserver", "socketio_enabled", fallback=False):
@@ -346,6 +371,43 @@ def parse_config(debugmode=False):
 
     logging.debug("ac2.md.extmd %s", ac2.metadata.external_metadata)
 
+    # Persistent cache for external metadata
+    if "cache" in config.sections() and \
+            config.getboolean("cache", "enable", fallback=True):
+        path = config.get("cache", "path", fallback=DEFAULT_CACHE_PATH)
+        size = config.getint("cache", "size", fallback=10)
+        try:
+            ac2.metadata.persistent_cache = \
+                PersistentCache(path, size * 1024 * 1024)
+            ac2.data.coverarthandler.persistent_cache = \
+                ac2.metadata.persistent_cache
+            logging.info("using persistent metadata cache %s", path)
+        except Exception as e:
+            logging.warning("can't open persistent cache %s: %s", path, e)
+
+    # In-memory cache for HTTP responses
+    if "cache" in config.sections():
+        http_size = config.getint("cache", "http_size", fallback=4)
+        http_ttl = config.getint("cache", "http_ttl", fallback=600)
+        http_negative_ttl = config.getint("cache", "http_negative_ttl",
+                                          fallback=600)
+        simple_http.set_cache_parameters(http_size * 1024 * 1024,
+                                         http_ttl,
+                                         http_negative_ttl)
+
+    # Local copies of covers for web clients
+    if "artwork" in config.sections() and \
+            config.getboolean("artwork", "enable", fallback=True):
+        path = config.get("artwork", "path",
+                          fallback=artworkstore.DEFAULT_PATH)
+        size = config.getint("artwork", "size", fallback=50)
+        try:
+            artworkstore.artwork_store = \
+                artworkstore.ArtworkStore(path, size * 1024 * 1024)
+            logging.info("using artwork store %s", path)
+        except Exception as e:
+            logging.warning("can't open artwork store %s: %s", path, e)
+
     # Web server has to rewrite artwork URLs
     if server is not None:
         mpris.register_metadata_processor(server)
@@ -20,11 +20,9 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
-import time
 import logging
 import datetime
 import copy
-from random import randint
 import threading
 
 from ac2.constants import CMD_NEXT, CMD_PAUSE, CMD_PLAY, CMD_PLAYPAUSE, \
@@ -32,7 +30,9 @@ from ac2.constants import CMD_NEXT, CMD_PAUSE, CMD_PLAY, CMD_PLAYPAUSE, \
 
 from ac2.players.mpdcontrol import MPDControl
 from ac2.players.mpris import MPRIS, MPRIS_PREFIX
-from ac2.metadata import Metadata, enrich_metadata_bg
+from ac2.metadata import Metadata, enrich_metadata_bg, update_web_snapshot
+from ac2.poller import PlayerPoller, PollInterval
+from ac2.scheduler import Scheduler
 # from ac2.controller import PlayerController
 from ac2 import watchdog
 
@@ -83,9 +83,51 @@ class AudioController():
         self.metadata_processors = []
         self.state_displays = []
         self.players = {}
+        # MPRIS player snapshots of the current loop iteration
+        self.snapshots = {}
+        # Players that should return metadata even if not playing
+        self.metadata_wanted = set()
+        self.poller = PlayerPoller(self.poll_player, blocking=self.uses_dbus)
+        self.wakeup = threading.Event()
+        self.interval = PollInterval(loop_delay)
+        self.scheduler = Scheduler()
+        # Metadata of players that are not playing are refreshed every
+        # metadata_refresh seconds
+        self.metadata_refresh = 600
+        self.metadata_refresh_jitter = 0.1
         self.mpris = MPRIS()
         self.mpris.connect_dbus()
 
+    def enable_mpris_signals(self, max_cache_age=30, properties=True):
+        """
+        Track MPRIS players that appear and disappear with NameOwnerChanged
+        signals instead of listing all bus names on every poll.
+
+        With properties=True, PropertiesChanged signals are used as well.
+        The main loop will be woken up immediately when a player reports a
+        change and MPRIS properties will only be polled if no update has
+        been received for max_cache_age seconds
+        """
+        self.mpris.max_cache_age = max_cache_age
+        if self.mpris.start_listener(properties):
+            self.mpris.add_listener(self.signal_received)
+
+    def signal_received(self):
+        self.interval.wakeup("signal")
+        self.wakeup.set()
+
+    def set_interval_parameters(self, min_delay=0.2, max_delay=5,
+                                idle_after=60):
+        """
+        The main loop polls every min_delay seconds after a change or
+        when the track is about to end and every max_delay seconds if
+        nothing has been playing for idle_after seconds
+        """
+        self.interval = PollInterval(self.loop_delay,
+                                     min_delay=min_delay,
+                                     max_delay=max_delay,
+                                     idle_after=idle_after)
+
     """
     Register a non-mpris player controls
     """
@@ -110,6 +152,9 @@ class AudioController():
             logging.warning("Metadata without artist, album or title - what's wrong here? %s",
                           metadata)
 
+        # Serialized only once for all web clients
+        update_web_snapshot(metadata)
+
         for md in self.metadata_displays:
             try:
                 logging.debug("metadata_notify: %s %s", md, metadata)
@@ -138,11 +183,20 @@ class AudioController():
         if name in self.players.keys():
             return self.players[name].get_state()
         else:
-            return self.mpris.retrieve_state(name)
+            # Retrieves all properties at once, metadata and supported
+            # commands of this loop iteration are taken from the snapshot
+            snapshot = self.mpris.snapshot(name)
+            if snapshot is None:
+                self.snapshots.pop(name, None)
+                return None
+            self.snapshots[name] = snapshot
+            return snapshot.state
 
     def get_supported_commands(self, name):
         if name in self.players.keys():
             return self.players[name].get_supported_commands()
+        elif name in self.snapshots:
+            return self.snapshots[name].supported_commands
         else:
             return self.mpris.get_supported_commands(name)
 
@@ -191,6 +245,10 @@ class AudioController():
         res = self.send_command_to_player(playerName, command)
         logging.info("sent %s to %s", command, playerName)
 
+        # Poll immediately to pick up the new state
+        self.interval.wakeup("command")
+        self.wakeup.set()
+
         return res
 
     def activate_player(self, playername):
@@ -203,12 +261,47 @@ class AudioController():
 
         return res
 
-    def get_meta(self, name):
+    def set_poll_parameters(self, threads=4, timeout=2):
+        """
+        Players are polled in parallel, every player has to answer
+        within the timeout
+        """
+        self.poller.shutdown()
+        self.poller = PlayerPoller(self.poll_player,
+                                   max_workers=threads,
+                                   timeout=timeout,
+                                   blocking=self.uses_dbus)
+
+    def uses_dbus(self, name):
+        """
+        MPRIS players are queried with blocking D-Bus calls
+        """
+        return name not in self.players
+
+    def poll_player(self, name):
+        """
+        Retrieve state and unprocessed metadata of a player. Metadata are
+        only retrieved if the player is playing or metadata have been
+        requested explicitly. This is called from the poller threads.
+        """
+        state = self.get_player_state(name).lower()
+        md = None
+        if state == STATE_PLAYING or name in self.metadata_wanted:
+            md = self.retrieve_meta(name)
+        return (state, md)
+
+    def retrieve_meta(self, name):
         if name in self.players.keys():
-            md = self.players[name].get_meta()
+            return self.players[name].get_meta()
+        elif name in self.snapshots:
+            return copy.copy(self.snapshots[name].metadata)
         else:
-            md = self.mpris.get_meta(name)
+            return self.mpris.get_meta(name)
 
+    def get_meta(self, name):
+        return self.process_meta(self.retrieve_meta(name))
+
+    def process_meta(self, md):
         if md is None:
             return None
 
@@ -230,14 +323,19 @@ class AudioController():
             logging.debug("received update for previous song, ignoring")
             return
 
-        # TODO: Check if this is the same song!
-        # Otherwise it might be a delayed update
-
+        # Updates are sent incrementally, only notify if something
+        # has been changed
         with self.metadata_lock:
+            changed = False
             for attribute in updates:
-                self.metadata.__dict__[attribute] = updates[attribute]
+                if self.metadata.__dict__.get(attribute) != updates[attribute]:
+                    self.metadata.__dict__[attribute] = updates[attribute]
+                    changed = True
 
-        self.metadata_notify(self.metadata)
+        if changed:
+            self.metadata_notify(self.metadata)
+        else:
+            logging.debug("metadata update didn't change anything")
 
     def main_loop(self):
         """
@@ -257,6 +355,7 @@ class AudioController():
 
         # Workaround for squeezelite mute
         squeezelite_active = 0
+        SQUEEZELITE_UNMUTE = ("unmute", LMS_NAME)
 
         previous_state = ""
         ts = datetime.datetime.now()
@@ -271,26 +370,57 @@ class AudioController():
             last_ts = ts
             ts = datetime.datetime.now()
             duration = (ts - last_ts).total_seconds()
+            self.snapshots = {}
+
+            players = [p for p in self.all_players()
+                       if self.playername(p) not in self.ignore_players]
 
-            for p in self.all_players():
+            # Forget players that are gone
+            for p in list(self.state_table.keys()):
+                if p not in players:
+                    logging.info("player %s disappeared", self.playername(p))
+                    del self.state_table[p]
+                    self.scheduler.cancel(("metadata", p))
+                    if p in active_players:
+                        active_players.remove(p)
 
-                if self.playername(p) in self.ignore_players:
-                    continue
+            due = self.scheduler.due()
 
+            # Metadata of the active player are needed even if it's paused,
+            # other players will be updated from time to time
+            self.metadata_wanted = set()
+            if len(active_players) > 0:
+                self.metadata_wanted.add(active_players[0])
+            for (task, p) in due:
+                if task == "metadata":
+                    self.metadata_wanted.add(p)
+
+            # Poll all players in parallel, a player that hangs
+            # doesn't delay the others
+            results = self.poller.poll(players)
+            polled_meta = {}
+
+            for p in players:
+
+                new_player = False
                 if p not in self.state_table:
-                    ps = PlayerState()
-                    ps.supported_commands = self.get_supported_commands(p)
-                    logging.debug("Player %s supports %s",
-                                  p,
-                                  ps.supported_commands)
-                    self.state_table[p] = ps
+                    self.state_table[p] = PlayerState()
+                    new_player = True
+
+                if not self.scheduler.scheduled(("metadata", p)):
+                    self.scheduler.schedule(("metadata", p),
+                                            self.metadata_refresh,
+                                            self.metadata_refresh_jitter)
 
                 thisplayer_state = "unknown"
-                try:
-                    thisplayer_state = self.get_player_state(p).lower()
+                (result, error) = results[p]
+                if error is None:
+                    (thisplayer_state, raw_md) = result
+                    if raw_md is not None:
+                        polled_meta[p] = raw_md
                     self.state_table[p].failed = 0
-                except:
-                    logging.info("Got no state from " + p)
+                else:
+                    logging.info("Got no state from %s: %s", p, error)
                     state = "unknown"
                     self.state_table[p].failed = \
                         self.state_table[p].failed + 1
@@ -301,8 +431,20 @@ class AudioController():
                         watchdog.restart_service(playername)
                         self.state_table[p].failed = 0
 
+                if self.state_table[p].state != thisplayer_state:
+                    self.interval.activity()
                 self.state_table[p].state = thisplayer_state
 
+                # MPRIS capabilities are part of the snapshot and can
+                # be updated without additional D-Bus calls
+                if (new_player and error is None) or p in self.snapshots:
+                    self.state_table[p].supported_commands = \
+                        self.get_supported_commands(p)
+                    if new_player:
+                        logging.debug("Player %s supports %s",
+                                      p,
+                                      self.state_table[p].supported_commands)
+
                 # Check if playback started on a player that wasn't
                 # playing before
                 if thisplayer_state == STATE_PLAYING:
@@ -314,10 +456,11 @@ class AudioController():
 
                     if self.playername(p) == LMS_NAME:
                         squeezelite_active = 2
+                        self.scheduler.cancel(SQUEEZELITE_UNMUTE)
 
                     report_usage("audiocontrol_playing_{}".format(self.playername(p)), duration)
 
-                    md = self.get_meta(p)
+                    md = self.process_meta(polled_meta.pop(p, None))
 
                     if (p not in active_players):
                         new_player_started = p
@@ -356,6 +499,7 @@ class AudioController():
 
                     # Add metadata if this is a new song
                     if new_song:
+                        self.interval.activity()
                         enrich_metadata_bg(md, callback=self)
                         logging.debug("metadata updater thread started")
 
@@ -371,9 +515,8 @@ class AudioController():
                             active_players.remove(p)
 
                     # update metadata for stopped players from time to time
-                    i = randint(0, 600)
-                    if (i == 0):
-                        md = self.get_meta(p)
+                    if p in polled_meta:
+                        md = self.process_meta(polled_meta.pop(p, None))
                         md.playerState = thisplayer_state
                         self.state_table[p].metadata = md
 
@@ -401,24 +544,26 @@ class AudioController():
 #
 
             # Workaround for LMS muting the output after stopping the
-            # player
-            if self.volume_control is not None:
-                if self.playername(self.active_player) != LMS_NAME:
-                    if squeezelite_active > 0:
-                        squeezelite_active = squeezelite_active - 1
-                        logging.debug("squeezelite was active before, unmuting")
-                        self.volume_control.set_mute(False)
-
-                if not(playing) and squeezelite_active > 0:
+            # player: unmute twice, one loop_delay apart
+            if self.volume_control is not None and squeezelite_active > 0:
+                lms_playing = playing and \
+                    self.playername(self.active_player) == LMS_NAME
+                if not(lms_playing) and \
+                        (SQUEEZELITE_UNMUTE in due or
+                         not self.scheduler.scheduled(SQUEEZELITE_UNMUTE)):
                     squeezelite_active = squeezelite_active - 1
                     logging.debug("squeezelite was active before, unmuting")
                     self.volume_control.set_mute(False)
+                    if squeezelite_active > 0:
+                        self.scheduler.schedule(SQUEEZELITE_UNMUTE,
+                                                self.loop_delay)
 
             # There might be no active player, but one that is paused
             # or stopped
             if not(playing) and len(active_players) > 0:
                 p = active_players[0]
-                md = self.get_meta(p)
+                # metadata have been retrieved by the poller
+                md = copy.copy(self.state_table[p].metadata)
                 md.playerState = self.state_table[p].state
                 state = md.playerState
 
@@ -443,7 +588,30 @@ class AudioController():
 
             self.last_update = datetime.datetime.now()
 
-            time.sleep(self.loop_delay + additional_delay)
+            # Wait for the next poll, MPRIS signals and commands will wake
+            # up the loop earlier
+            remaining = None
+            if playing:
+                remaining = self.remaining_time(self.metadata)
+            delay = self.interval.next_interval(playing, remaining)
+            next_task = self.scheduler.next_deadline()
+            if next_task is not None:
+                delay = min(delay, next_task)
+            if not self.wakeup.wait(delay + additional_delay):
+                self.interval.wakeup("timer")
+            self.wakeup.clear()
+
+    def remaining_time(self, md):
+        """
+        Seconds until the end of the current track or None if unknown
+        """
+        try:
+            duration = float(md.duration)
+        except (TypeError, ValueError):
+            return None
+        if duration <= 0:
+            return None
+        return duration - md.get_position()
 
     # ##
     # ## controller functions
@@ -488,13 +656,14 @@ class AudioController():
 
     def states(self):
         players = []
-        for p in self.state_table:
+        # The main loop might add or remove players while iterating
+        for (p, ps) in list(self.state_table.items()):
             player = {}
             player["name"] = self.playername(p)
-            player["state"] = self.state_table[p].state
-            player["artist"] = self.state_table[p].metadata.artist
-            player["title"] = self.state_table[p].metadata.title
-            player["supported_commands"] = self.state_table[p].supported_commands;
+            player["state"] = ps.state
+            player["artist"] = ps.metadata.artist
+            player["title"] = ps.metadata.title
+            player["supported_commands"] = ps.supported_commands;
 
             players.append(player)
 
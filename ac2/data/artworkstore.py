@@ -0,0 +1,347 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import hashlib
+import io
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from time import time
+
+import gevent
+from gevent import monkey
+
+from ac2.simple_http import host_session
+from ac2.singleflight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+DEFAULT_PATH = "/var/lib/audiocontrol2/artwork"
+DEFAULT_SIZE = 50 * 1024 * 1024
+# Widths of downscaled variants
+VARIANTS = [300, 600, 1200]
+# Size used if the client doesn't ask for a specific one
+DEFAULT_VARIANT = 1200
+ORIGINAL = "original"
+# Covers larger than this aren't downloaded
+MAX_DOWNLOAD = 20 * 1024 * 1024
+DOWNLOAD_TIMEOUT = 20
+JPEG_QUALITY = 85
+# Don't write to the SD card on every access
+ACCESS_RESOLUTION = 3600
+
+EXTENSIONS = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+    "image/avif": "avif",
+}
+CONTENT_TYPES = {extension: content_type
+                 for (content_type, extension) in EXTENSIONS.items()}
+
+# ArtworkStore, configured in audiocontrol2.py
+artwork_store = None
+
+
+def artwork_key(url):
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:20]
+
+
+class ArtworkFile():
+
+    __slots__ = ["filename", "etag", "content_type", "length"]
+
+    def __init__(self, filename, etag, content_type, length):
+        self.filename = filename
+        self.etag = etag
+        self.content_type = content_type
+        self.length = length
+
+
+class ArtworkStore():
+    """
+    Keeps downloaded covers and downscaled copies of them on disk, so
+    clients don't have to load large images from the internet on every
+    track change.
+
+    Every cover has a directory named after the hash of its URL that
+    contains the original and the variants as
+    <width or "original">.<content hash>.<extension>. If the total size
+    grows beyond max_size bytes, least recently used covers are removed.
+    Pillow is needed to create the variants, without it only the
+    original is stored.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_size=DEFAULT_SIZE,
+                 variants=VARIANTS):
+        self.path = path
+        self.max_size = max_size
+        self.variants = sorted(variants)
+        self.lock = threading.Lock()
+        self.inflight = SingleFlight()
+        # key: {label: ArtworkFile}, least recently used first
+        self.entries = OrderedDict()
+        self.accessed = {}
+        self.size = 0
+        self.downloads = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+        os.makedirs(path, exist_ok=True)
+        if Image is None:
+            logging.info("Pillow not installed, artwork won't be resized")
+        self.load()
+
+    def load(self):
+        keys = []
+        for key in os.listdir(self.path):
+            directory = os.path.join(self.path, key)
+            if os.path.isdir(directory):
+                keys.append((os.path.getmtime(directory), key))
+
+        for (accessed, key) in sorted(keys):
+            files = {}
+            for filename in os.listdir(os.path.join(self.path, key)):
+                parts = filename.split(".")
+                if len(parts) != 3 or parts[2] not in CONTENT_TYPES:
+                    # incomplete write
+                    os.remove(os.path.join(self.path, key, filename))
+                    continue
+                (label, etag, extension) = parts
+                length = os.path.getsize(os.path.join(self.path, key,
+                                                      filename))
+                files[label] = ArtworkFile(key + "/" + filename, etag,
+                                           CONTENT_TYPES[extension], length)
+            if ORIGINAL not in files:
+                shutil.rmtree(os.path.join(self.path, key),
+                              ignore_errors=True)
+                continue
+            self.entries[key] = files
+            self.accessed[key] = accessed
+            self.size += sum(f.length for f in files.values())
+
+        logging.info("artwork store %s: %s covers, %s bytes",
+                     self.path, len(self.entries), self.size)
+
+    def stored(self, url):
+        """
+        Returns the key if the cover is stored already, None otherwise
+        """
+        key = artwork_key(url)
+        with self.lock:
+            if key in self.entries:
+                self.touch(key)
+                return key
+        return None
+
+    def add(self, url):
+        """
+        Download the cover and create its variants if it's not stored
+        yet. Returns the key or None if the image couldn't be retrieved.
+        """
+        key = artwork_key(url)
+        with self.lock:
+            if key in self.entries:
+                self.touch(key)
+                return key
+
+        return self.inflight.do(key, self.download, url, key)
+
+    def download(self, url, key):
+        with host_session(url).get(url, timeout=DOWNLOAD_TIMEOUT,
+                                   stream=True) as res:
+            if res.status_code != 200:
+                logging.info("can't download artwork %s: HTTP status %s",
+                             url, res.status_code)
+                return None
+
+            content_type = res.headers.get("Content-Type", "").split(";")[0]
+            if content_type not in EXTENSIONS:
+                logging.info("not storing artwork %s (%s)", url, content_type)
+                return None
+            data = read_limited(res, MAX_DOWNLOAD)
+            if data is None:
+                logging.info("not storing artwork %s, larger than %s bytes",
+                             url, MAX_DOWNLOAD)
+                return None
+
+        directory = os.path.join(self.path, key)
+        os.makedirs(directory, exist_ok=True)
+        files = {ORIGINAL: self.write(key, ORIGINAL, data, content_type)}
+        for (width, data) in run_native(self.resize, data):
+            files[str(width)] = self.write(key, str(width), data,
+                                           "image/jpeg")
+
+        with self.lock:
+            self.downloads += 1
+            self.entries[key] = files
+            self.accessed[key] = time()
+            self.size += sum(f.length for f in files.values())
+            self.evict()
+
+        logging.debug("stored artwork %s as %s", url, key)
+        return key
+
+    def write(self, key, label, data, content_type):
+        etag = hashlib.sha1(data).hexdigest()[:16]
+        filename = "{}/{}.{}.{}".format(key, label, etag,
+                                        EXTENSIONS[content_type])
+        temp = os.path.join(self.path, filename + ".tmp")
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, os.path.join(self.path, filename))
+        return ArtworkFile(filename, etag, content_type, len(data))
+
+    def resize(self, data):
+        """
+        JPEG variants for all widths smaller than the original
+        """
+        if Image is None:
+            return []
+
+        variants = []
+        try:
+            image = Image.open(io.BytesIO(data))
+            # JPEGs can be decoded at a fraction of their size
+            largest = max(self.variants)
+            if image.width > largest:
+                image.draft("RGB", (largest,
+                                    round(image.height * largest /
+                                          image.width)))
+            image.load()
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            for width in self.variants:
+                if width >= image.width:
+                    break
+                height = max(round(image.height * width / image.width), 1)
+                out = io.BytesIO()
+                # reducing_gap shrinks by whole factors before filtering
+                image.resize((width, height), Image.LANCZOS,
+                             reducing_gap=3.0).save(
+                    out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+                variants.append((width, out.getvalue()))
+        except Exception as e:
+            logging.warning("can't resize artwork: %s", e)
+
+        return variants
+
+    def touch(self, key):
+        self.entries.move_to_end(key)
+        now = time()
+        if now - self.accessed[key] > ACCESS_RESOLUTION:
+            self.accessed[key] = now
+            try:
+                os.utime(os.path.join(self.path, key))
+            except OSError:
+                pass
+
+    def evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            (key, files) = self.entries.popitem(last=False)
+            del self.accessed[key]
+            self.size -= sum(f.length for f in files.values())
+            self.evicted += 1
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+
+    def get(self, key, width=None):
+        """
+        Returns the smallest stored file that is at least width pixels
+        wide, the largest one if none is or None if key isn't stored.
+        """
+        with self.lock:
+            files = self.entries.get(key)
+            if files is None:
+                self.misses += 1
+                return None
+            self.touch(key)
+            self.hits += 1
+
+        if width is None:
+            width = DEFAULT_VARIANT
+        for variant in self.variants:
+            if variant >= width and str(variant) in files:
+                return files[str(variant)]
+        return files[ORIGINAL]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "covers": len(self.entries),
+                "size": self.size,
+                "max_size": self.max_size,
+                "downloads": self.downloads,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "resize": Image is not None,
+            }
+
+
+def read_limited(res, max_bytes):
+    """
+    Body of a streamed response, None if it's larger than max_bytes
+    """
+    length = res.headers.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        return None
+
+    blocks = []
+    size = 0
+    for block in res.iter_content(65536):
+        size += len(block)
+        if size > max_bytes:
+            return None
+        blocks.append(block)
+    return b"".join(blocks)
+
+
+def run_native(function, *args):
+    """
+    Runs CPU intensive code on a native thread if gevent's monkey patching
+    is active, it would block all greenlets otherwise. Pillow releases
+    the GIL while resizing.
+    """
+    if monkey.is_module_patched("threading"):
+        return gevent.get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+def local_url(key):
+    return "artwork/cache/" + key
+
+
+def use_local_artwork(metadata):
+    """
+    Point the external artwork of a metadata copy that is sent to web
+    clients to the local artwork store
+    """
+    if metadata.localArtUrl is not None:
+        metadata.externalArtUrl = metadata.localArtUrl
@@ -0,0 +1,175 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from time import time
+
+DAY = 86400
+
+DEFAULT_PATH = "/var/lib/audiocontrol2/cache.db"
+DEFAULT_SIZE = 10 * 1024 * 1024
+
+# Don't write to the SD card on every read, LRU order has a resolution
+# of an hour
+ACCESS_RESOLUTION = 3600
+
+
+class PersistentCache():
+    """
+    Size bounded key/value store in a SQLite database that survives
+    restarts. Values are stored as JSON with an individual TTL. If the
+    cache grows beyond max_size bytes, least recently used entries are
+    removed.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_size=DEFAULT_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "namespace TEXT NOT NULL, "
+                        "key TEXT NOT NULL, "
+                        "value TEXT NOT NULL, "
+                        "size INTEGER NOT NULL, "
+                        "expires REAL NOT NULL, "
+                        "accessed REAL NOT NULL, "
+                        "PRIMARY KEY (namespace, key))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed "
+                        "ON entries (accessed)")
+        self.db.commit()
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get(self, namespace, key, default=None):
+        now = time()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT value, expires, accessed FROM entries "
+                "WHERE namespace=? AND key=?", (namespace, key)).fetchone()
+            if row is None:
+                self.misses += 1
+                return default
+
+            (value, expires, accessed) = row
+            if expires < now:
+                self.delete_entry(namespace, key)
+                self.db.commit()
+                self.misses += 1
+                return default
+
+            if now - accessed > ACCESS_RESOLUTION:
+                self.db.execute(
+                    "UPDATE entries SET accessed=? "
+                    "WHERE namespace=? AND key=?",
+                    (now, namespace, key))
+                self.db.commit()
+            self.hits += 1
+
+        return json.loads(value)
+
+    def put(self, namespace, key, value, ttl):
+        data = json.dumps(value)
+        size = len(namespace) + len(key) + len(data)
+        now = time()
+        with self.lock:
+            self.delete_entry(namespace, key)
+            self.db.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, size, now + ttl, now))
+            self.size += size
+            self.evict()
+            self.db.commit()
+
+    def delete(self, namespace, key):
+        with self.lock:
+            self.delete_entry(namespace, key)
+            self.db.commit()
+
+    def delete_entry(self, namespace, key):
+        row = self.db.execute(
+            "SELECT size FROM entries WHERE namespace=? AND key=?",
+            (namespace, key)).fetchone()
+        if row is not None:
+            self.db.execute(
+                "DELETE FROM entries WHERE namespace=? AND key=?",
+                (namespace, key))
+            self.size -= row[0]
+
+    def evict(self):
+        if self.size <= self.max_size:
+            return
+
+        # Expired entries first, then least recently used ones
+        self.db.execute("DELETE FROM entries WHERE expires<?", (time(),))
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+        removed = 0
+        for (namespace, key, size) in self.db.execute(
+                "SELECT namespace, key, size FROM entries "
+                "ORDER BY accessed").fetchall():
+            if self.size <= self.max_size:
+                break
+            self.db.execute(
+                "DELETE FROM entries WHERE namespace=? AND key=?",
+                (namespace, key))
+            self.size -= size
+            removed += 1
+
+        logging.debug("removed %s entries from persistent cache", removed)
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "entries": entries,
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
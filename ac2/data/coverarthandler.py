@@ -21,34 +21,68 @@ SOFTWARE.
 '''
 
 import logging
+import threading
 from expiringdict import ExpiringDict
 
 covers = ExpiringDict(max_len=1000,
                       max_age_seconds=3600000)
+# Metadata sources run in parallel and compare their covers concurrently
+covers_lock = threading.Lock()
 
-import io
+import re
 import struct
-import urllib.request as urllib2
+
+from ac2.simple_http import host_session
+from ac2.data.cache import DAY
 
 GOOD_ENOUGH_WIDTH = 1000
 GOOD_ENOUGH_HEIGHT = 1000
 
+# Image headers are usually within the first few kB, but JPEGs can have
+# large EXIF, XMP or ICC segments in front of the frame header
+PROBE_BYTES = 4096
+MAX_PROBE_BYTES = 1024 * 1024
+PROBE_TIMEOUT = 10
+
+# PersistentCache for image sizes, configured in audiocontrol2.py
+persistent_cache = None
+# Images behind an URL don't change
+IMAGE_TTL = 180 * DAY
+
+# url: (width, height, content_type, length)
+image_sizes = ExpiringDict(max_len=1000,
+                           max_age_seconds=DAY)
+image_stats = {"cached": 0, "guessed": 0, "probed": 0}
+
+# Last.fm: /i/u/300x300/<id>.png, /i/u/770x0/<id>.jpg, /i/u/174s/<id>.png
+DIMENSIONS_PATTERN = re.compile(r"/(\d+)x(\d+)/")
+SQUARE_PATTERN = re.compile(r"/i/u/(\d+)s/")
+# Coverartarchive thumbnails: /release/<mbid>/<id>-500.jpg
+THUMBNAIL_PATTERN = re.compile(r"coverartarchive\.org/.*-(250|500|1200)\.\w+$")
+
+
+# JPEG start of frame markers, C4 (DHT), C8 (JPG) and CC (DAC) aren't
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01, 0xD8}
+AVIF_BRANDS = (b'avif', b'avis')
+
 
 def getImageInfo(data):
-    data = data
+    """
+    Returns (content_type, width, height) of an image in GIF, PNG, JPEG,
+    WebP or AVIF format. data can be the beginning of the file only,
+    width and height are -1 if they aren't included.
+    """
     size = len(data)
-    # print(size)
     height = -1
     width = -1
     content_type = ''
 
     # handle GIFs
     if (size >= 10) and data[:6] in (b'GIF87a', b'GIF89a'):
-        # Check to see if content_type is correct
         content_type = 'image/gif'
-        w, h = struct.unpack(b"<HH", data[6:10])
-        width = int(w)
-        height = int(h)
+        width, height = struct.unpack_from("<HH", data, 6)
 
     # See PNG 2. Edition spec (http://www.w3.org/TR/PNG/)
     # Bytes 0-7 are below, 4-byte chunk length, then 'IHDR'
@@ -56,47 +90,326 @@ def getImageInfo(data):
     elif ((size >= 24) and data.startswith(b'\211PNG\r\n\032\n')
           and (data[12:16] == b'IHDR')):
         content_type = 'image/png'
-        w, h = struct.unpack(b">LL", data[16:24])
-        width = int(w)
-        height = int(h)
+        width, height = struct.unpack_from(">LL", data, 16)
 
     # Maybe this is for an older PNG version.
     elif (size >= 16) and data.startswith(b'\211PNG\r\n\032\n'):
-        # Check to see if we have the right content type
         content_type = 'image/png'
-        w, h = struct.unpack(b">LL", data[8:16])
-        width = int(w)
-        height = int(h)
+        width, height = struct.unpack_from(">LL", data, 8)
 
     # handle JPEGs
     elif (size >= 2) and data.startswith(b'\377\330'):
         content_type = 'image/jpeg'
-        jpeg = io.BytesIO(data)
-        jpeg.read(2)
-        b = jpeg.read(1)
-        try:
-            while (b and ord(b) != 0xDA):
-                while (ord(b) != 0xFF): b = jpeg.read(1)
-                while (ord(b) == 0xFF): b = jpeg.read(1)
-                if (ord(b) >= 0xC0 and ord(b) <= 0xC3):
-                    jpeg.read(3)
-                    h, w = struct.unpack(b">HH", jpeg.read(4))
-                    break
-                else:
-                    jpeg.read(int(struct.unpack(b">H", jpeg.read(2))[0]) - 2)
-                b = jpeg.read(1)
-            width = int(w)
-            height = int(h)
-        except struct.error:
-            pass
-        except ValueError:
-            pass
+        width, height = jpeg_size(data)
+
+    elif (size >= 12) and data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        content_type = 'image/webp'
+        width, height = webp_size(data)
+
+    elif (size >= 12) and data[4:8] == b'ftyp' and avif_brand(data):
+        content_type = 'image/avif'
+        width, height = avif_size(data)
 
     logging.debug("parsed image")
 
     return content_type, width, height
 
 
+def jpeg_size(data):
+    """
+    Jumps from marker to marker using the segment lengths until a start
+    of frame segment has been found.
+    """
+    size = len(data)
+    pos = 2
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            # garbage between segments
+            pos = data.find(b'\xff', pos)
+            if pos < 0:
+                break
+            continue
+
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+        elif marker in JPEG_STANDALONE_MARKERS:
+            pos += 2
+        elif marker in (0xD9, 0xDA):
+            # end of image or start of scan, there's no frame header
+            break
+        elif marker in JPEG_SOF_MARKERS:
+            if pos + 9 > size:
+                break
+            height, width = struct.unpack_from(">HH", data, pos + 5)
+            return width, height
+        else:
+            (length,) = struct.unpack_from(">H", data, pos + 2)
+            pos += 2 + length
+
+    return -1, -1
+
+
+def webp_size(data):
+    """
+    Lossy (VP8), lossless (VP8L) and extended (VP8X) WebP
+    """
+    size = len(data)
+    chunk_type = data[12:16]
+    if chunk_type == b'VP8 ' and size >= 30 and \
+            data[23:26] == b'\x9d\x01\x2a':
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    elif chunk_type == b'VP8L' and size >= 25 and data[20] == 0x2F:
+        (bits,) = struct.unpack_from("<L", data, 21)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    elif chunk_type == b'VP8X' and size >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+
+    return -1, -1
+
+
+def avif_brand(data):
+    (length,) = struct.unpack_from(">L", data, 0)
+    brands = memoryview(data)[8:min(length, len(data))]
+    return any(brands[i:i + 4] in AVIF_BRANDS
+               for i in range(0, len(brands) - 3, 4))
+
+
+def iso_boxes(view, start, end):
+    """
+    Yields (type, payload start, payload end) of the ISO BMFF boxes
+    between start and end. Stops at incomplete boxes.
+    """
+    pos = start
+    while pos + 8 <= end:
+        length, box_type = struct.unpack_from(">L4s", view, pos)
+        header = 8
+        if length == 1 and pos + 16 <= end:
+            (length,) = struct.unpack_from(">Q", view, pos + 8)
+            header = 16
+        elif length == 0:
+            length = end - pos
+        if length < header or pos + length > end:
+            return
+        yield box_type, pos + header, pos + length
+        pos += length
+
+
+def avif_size(data):
+    """
+    Image spatial extents (ispe) property of the primary item. The file
+    has to include the complete meta box.
+    """
+    view = memoryview(data)
+    try:
+        for (box_type, start, end) in iso_boxes(view, 0, len(view)):
+            if box_type == b'meta':
+                # full box: version and flags
+                return avif_meta_size(view, start + 4, end)
+    except (struct.error, IndexError) as e:
+        logging.debug("can't parse AVIF header: %s", e)
+    return -1, -1
+
+
+def avif_meta_size(view, start, end):
+    primary = None
+    properties = []
+    associations = {}
+
+    for (box_type, box_start, box_end) in iso_boxes(view, start, end):
+        if box_type == b'pitm':
+            version = view[box_start]
+            if version == 0:
+                (primary,) = struct.unpack_from(">H", view, box_start + 4)
+            else:
+                (primary,) = struct.unpack_from(">L", view, box_start + 4)
+
+        elif box_type == b'iprp':
+            for (prop_type, prop_start, prop_end) in \
+                    iso_boxes(view, box_start, box_end):
+                if prop_type == b'ipco':
+                    for (item, item_start, _item_end) in \
+                            iso_boxes(view, prop_start, prop_end):
+                        if item == b'ispe':
+                            properties.append(struct.unpack_from(
+                                ">LL", view, item_start + 4))
+                        else:
+                            properties.append(None)
+                elif prop_type == b'ipma':
+                    associations.update(ipma_entries(view, prop_start))
+
+    for index in associations.get(primary, []):
+        if 0 < index <= len(properties) and properties[index - 1]:
+            return properties[index - 1]
+
+    # no associations, use the first image size
+    for extents in properties:
+        if extents is not None:
+            return extents
+
+    return -1, -1
+
+
+def ipma_entries(view, pos):
+    """
+    Item property associations: item id -> list of property indexes
+    """
+    version = view[pos]
+    flags = int.from_bytes(view[pos + 1:pos + 4], "big")
+    (count,) = struct.unpack_from(">L", view, pos + 4)
+    pos += 8
+    entries = {}
+    for _i in range(count):
+        if version < 1:
+            (item,) = struct.unpack_from(">H", view, pos)
+            pos += 2
+        else:
+            (item,) = struct.unpack_from(">L", view, pos)
+            pos += 4
+        num = view[pos]
+        pos += 1
+        indexes = []
+        for _j in range(num):
+            if flags & 1:
+                (value,) = struct.unpack_from(">H", view, pos)
+                indexes.append(value & 0x7FFF)
+                pos += 2
+            else:
+                indexes.append(view[pos] & 0x7F)
+                pos += 1
+        entries[item] = indexes
+    return entries
+
+
+def probe_image_size(url, timeout=PROBE_TIMEOUT):
+    """
+    Retrieve type, width, height and file length of an image without
+    downloading all of it.
+
+    Only the first PROBE_BYTES are requested. If the header isn't
+    complete, the next (twice as large) range is requested until the size
+    is known or MAX_PROBE_BYTES have been read. Servers that don't
+    support range requests send the whole image, it's read only until
+    the header has been found.
+    """
+    session = host_session(url)
+    data = b''
+    content_type, width, height = '', -1, -1
+    length = None
+
+    while len(data) < MAX_PROBE_BYTES:
+        start = len(data)
+        end = min(max(2 * start, PROBE_BYTES), MAX_PROBE_BYTES)
+        res = session.get(url,
+                          headers={"Range": "bytes={}-{}".format(start,
+                                                                 end - 1)},
+                          stream=True,
+                          timeout=timeout)
+        try:
+            if res.status_code == 206:
+                # Content-Range: bytes 0-4095/123456
+                total = res.headers.get("Content-Range", "").split("/")[-1]
+                if total.isdigit():
+                    length = int(total)
+                chunk = res.content
+                data += chunk
+                content_type, width, height = getImageInfo(data)
+                if width > 0 or len(chunk) < end - start:
+                    # found or end of file
+                    break
+            elif res.status_code == 200:
+                # Range not supported, read the full response until the
+                # header has been found
+                if res.headers.get("Content-Length", "").isdigit():
+                    length = int(res.headers["Content-Length"])
+                data = b''
+                for chunk in res.iter_content(PROBE_BYTES):
+                    data += chunk
+                    content_type, width, height = getImageInfo(data)
+                    if width > 0 or len(data) >= MAX_PROBE_BYTES:
+                        break
+                break
+            else:
+                logging.debug("can't probe %s: HTTP status %s",
+                              url, res.status_code)
+                break
+        finally:
+            # an incomplete response can't be reused and closes the
+            # connection
+            res.close()
+
+        if content_type == '' and len(data) >= PROBE_BYTES:
+            # not an image format we know
+            break
+
+    logging.debug("probed %s bytes of %s: %sx%s",
+                  len(data), url, width, height)
+    return content_type, width, height, length
+
+
+def guess_image_size(url):
+    """
+    Try to guess the size of an image based on the URL. This won't
+    be perfect, but it speeds up processing as no HTTP requests are
+    required. Album covers are assumed to be square.
+    """
+    match = DIMENSIONS_PATTERN.search(url)
+    if match is not None:
+        width, height = int(match.group(1)), int(match.group(2))
+        # 770x0: scaled to a width of 770
+        return width, height or width
+
+    match = SQUARE_PATTERN.search(url) or THUMBNAIL_PATTERN.search(url)
+    if match is not None:
+        return int(match.group(1)), int(match.group(1))
+
+    return 0, 0
+
+
+def image_size(url):
+    """
+    Returns (width, height, content_type, length) of the image at url.
+    content_type and length are None if the size has been guessed from
+    the URL. Probed sizes are cached, an image is only probed once.
+    """
+    width, height = guess_image_size(url)
+    if width * height > 0:
+        image_stats["guessed"] += 1
+        return (width, height, None, None)
+
+    info = image_sizes.get(url)
+    if info is None and persistent_cache is not None:
+        info = persistent_cache.get("image", url)
+        if info is not None:
+            info = tuple(info)
+            image_sizes[url] = info
+    if info is not None:
+        image_stats["cached"] += 1
+        return info
+
+    image_stats["probed"] += 1
+    content_type, width, height, length = probe_image_size(url)
+    if width <= 0 or height <= 0:
+        # might work next time
+        return (0, 0, None, None)
+
+    info = (width, height, content_type, length)
+    image_sizes[url] = info
+    if persistent_cache is not None:
+        persistent_cache.put("image", url, list(info), IMAGE_TTL)
+    return info
+
+
+def image_cache_info():
+    info = dict(image_stats)
+    info["entries"] = len(image_sizes)
+    return info
+
+
 class Coverart():
 
     def __init__(self, url, width=0, height=0):
@@ -105,34 +418,18 @@ class Coverart():
         self.height = height
         self.imagedata = None
 
-        if self.url is not None:
-            if self.size() == 0:
-                self.width, self.height = self.guess_size_from_url(url)
-
-            if self.size() == 0:
-                try:
-                    req = urllib2.Request(url, headers={"Range": "5000"})
-                    r = urllib2.urlopen(req)
-
-                    _type, self.width, self.height = getImageInfo(r.read())
-                except Exception as e:
-                    logging.warning("error while parsing image from %s: %s",
-                                    url, e)
+        if self.url is not None and self.size() == 0:
+            try:
+                self.width, self.height, _type, _length = image_size(url)
+            except Exception as e:
+                logging.warning("error while parsing image from %s: %s",
+                                url, e)
 
         logging.debug("initialized coverart %s: %sx%s",
                       url, self.width, self.height)
 
     def guess_size_from_url(self, url):
-        # Try to guess the size of an image based on the URL. This won't
-        # be perfect, but it speeds up processing as no HTTP requests are
-        # required
-        if "/300x300/" in url:
-            return 300, 300
-
-        if "/150x150/" in url:
-            return 300, 300
-
-        return 0, 0
+        return guess_image_size(url)
 
     def size(self):
         return self.width * self.height
@@ -144,28 +441,37 @@ class Coverart():
 def best_picture_url(key, url, width=0, height=0):
     
     logging.debug("looking up existing pictures for %s",key)
+    # Retrieving the image size might take a while, don't block others
     cover = Coverart(url, width, height)
-    existing_cover = covers.get(key)
-    if existing_cover is not None:
-        if existing_cover.size() < cover.size():
-            logging.debug("%sx%s > %sx%s - using new image",
-                          cover.width, cover.height,
-                          existing_cover.width, existing_cover.height)
+    with covers_lock:
+        existing_cover = covers.get(key)
+        if existing_cover is not None:
+            if existing_cover.size() < cover.size():
+                logging.debug("%sx%s > %sx%s - using new image",
+                              cover.width, cover.height,
+                              existing_cover.width, existing_cover.height)
+                covers[key] = cover
+                return cover.url
+            else:
+                logging.debug("%sx%s < %sx%s - using old image",
+                              cover.width, cover.height,
+                              existing_cover.width, existing_cover.height)
+
+                return existing_cover.url
+
+        else:
+            logging.debug("%sx%s, no existing image",
+                          cover.width, cover.height)
             covers[key] = cover
             return cover.url
-        else:
-            logging.debug("%sx%s < %sx%s - using old image",
-                          cover.width, cover.height,
-                          existing_cover.width, existing_cover.height)
 
-            return existing_cover.url
 
-    else:
-        logging.debug("%sx%s, no existing image",
-                      cover.width, cover.height)
-        covers[key] = cover
-        return cover.url
-    
+def current_picture_url(key):
+    existing_cover = covers.get(key)
+    if existing_cover is not None:
+        return existing_cover.url
+
+
 def best_picture_size(key):
     
     if key is None:
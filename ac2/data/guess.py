@@ -22,7 +22,7 @@ SOFTWARE.
 
 import logging
 
-from ac2.data.musicbrainz import track_data
+from ac2.data.musicbrainz import track_data, PRIORITY_BACKGROUND
 from ac2.data.hifiberry import cloud_url
 from ac2.simple_http import retrieve_url, post_data
 
@@ -118,12 +118,12 @@ def guess_order(field1, field2):
     Uses musicbrainz
     '''
     
-    data_at = track_data(field2, field1)
+    data_at = track_data(field2, field1, priority=PRIORITY_BACKGROUND)
     o_at = "{} / {}".format(field1, field2)
     v_at = "{} / {}".format(_artist(data_at),_title(data_at))
     d_at = Levenshtein.distance(o_at.lower(),v_at.lower())
     
-    data_ta = track_data(field1, field2)
+    data_ta = track_data(field1, field2, priority=PRIORITY_BACKGROUND)
     o_ta = "{} / {}".format(field2, field1)
     v_ta = "{} / {}".format(_artist(data_ta),_title(data_ta))
     d_ta = Levenshtein.distance(o_ta.lower(),v_ta.lower())
@@ -24,7 +24,11 @@ from datetime import date
 import logging
 
 import musicbrainzngs
+from expiringdict import ExpiringDict
+
 from ac2.data.identities import host_uuid, release
+from ac2.singleflight import SingleFlight
+from ac2.ratelimit import RateLimiter
 
 musicbrainzngs.set_useragent(
     "audiocontrol2",
@@ -32,10 +36,53 @@ musicbrainzngs.set_useragent(
     "https://github.com/hifiberry/audiocontrol2/" + release(),
 )
 
+# Lookups for the song that is playing go ahead of guesses
+PRIORITY_PLAYING = 0
+PRIORITY_BACKGROUND = 1
+
+# MusicBrainz allows 1 request/s, musicbrainzngs' own limiter is replaced
+# by one that knows about priorities
+musicbrainzngs.set_rate_limit(False)
+limiter = RateLimiter(rate=1.0, burst=1)
+
+# Identical searches that run at the same time are only sent once
+inflight = SingleFlight()
+
+results = ExpiringDict(max_len=500, max_age_seconds=86400)
+
+
+def normalize(value):
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return value
+
+
+def limited_search(key, function, priority, kwargs):
+    limiter.acquire(priority)
+    data = function(**kwargs)
+    results[key] = data
+    return data
+
+
+def search(function, priority=PRIORITY_PLAYING, **kwargs):
+    key = (function.__name__,
+           tuple(sorted((k, normalize(v)) for (k, v) in kwargs.items())))
+    data = results.get(key)
+    if data is not None:
+        logging.debug("musicbrainz result from cache: %s", key)
+        return data
+    return inflight.do(key, limited_search, key, function, priority, kwargs)
+
+
+def stats():
+    return {"limiter": limiter.stats(),
+            "cached": len(results)}
+
 
-def artist_data(artistname):
+def artist_data(artistname, priority=PRIORITY_PLAYING):
     try:
-        data = musicbrainzngs.search_artists(query=artistname, limit=1, strict=False)
+        data = search(musicbrainzngs.search_artists, priority,
+                      query=artistname, limit=1, strict=False)
         if len(data["artist-list"]) >= 1:
             return data["artist-list"][0]
     except Exception as e:
@@ -43,15 +90,15 @@ def artist_data(artistname):
                         artistname, e)
 
 
-def album_data(albumname, artistname=None):
+def album_data(albumname, artistname=None, priority=PRIORITY_PLAYING):
     try:
         if artistname is None:
-            data = musicbrainzngs.search_releases(query=albumname,
-                                                  limit=1, strict=False)
+            data = search(musicbrainzngs.search_releases, priority,
+                          query=albumname, limit=1, strict=False)
         else:
-            data = musicbrainzngs.search_releases(query=albumname,
-                                                  artistname=artistname,
-                                                  limit=1, strict=False)
+            data = search(musicbrainzngs.search_releases, priority,
+                          query=albumname, artistname=artistname,
+                          limit=1, strict=False)
         if len(data["release-list"]) >= 1:
             return data["release-list"][0]
     except Exception as e:
@@ -59,21 +106,22 @@ def album_data(albumname, artistname=None):
                         albumname, e)
 
 
-def track_data(trackname, artistname=None, releaseid=None):
+def track_data(trackname, artistname=None, releaseid=None,
+               priority=PRIORITY_PLAYING):
     try:
         query = "recording:\"{}\"".format(trackname)
 
         if releaseid is not None:
-            data = musicbrainzngs.search_recordings(query=query,
-                                                    reid=releaseid,
-                                                    limit=1, strict=False)
+            data = search(musicbrainzngs.search_recordings, priority,
+                          query=query, reid=releaseid,
+                          limit=1, strict=False)
         elif artistname is not None:
-            data = musicbrainzngs.search_recordings(query=query,
-                                                    artistname=artistname,
-                                                    limit=1, strict=False)
+            data = search(musicbrainzngs.search_recordings, priority,
+                          query=query, artistname=artistname,
+                          limit=1, strict=False)
         else:
-            data = musicbrainzngs.search_recordings(query=query,
-                                                    limit=1, strict=False)
+            data = search(musicbrainzngs.search_recordings, priority,
+                          query=query, limit=1, strict=False)
 
         if len(data["recording-list"]) >= 1:
             return data["recording-list"][0]
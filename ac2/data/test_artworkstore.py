@@ -0,0 +1,151 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import ac2.data.artworkstore as artworkstore
+from ac2.data.artworkstore import ArtworkStore, ORIGINAL, local_url
+from ac2.dev.imagestub import ImageServer, jpeg_image, png_image
+from ac2.metadata import Metadata, store_artwork
+import ac2.simple_http as simple_http
+
+IMAGES = {
+    "/cover.jpeg": jpeg_image(1500, 1500, 300000),
+    "/other.png": png_image(1000, 1000, 200000),
+    "/third.jpeg": jpeg_image(1000, 1000, 200000),
+    "/text.txt": b"not an image",
+}
+
+
+class TestArtworkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = ImageServer(IMAGES)
+
+    def tearDown(self):
+        self.server.stop()
+        simple_http.close_sessions()
+        shutil.rmtree(self.path)
+
+    def test_store(self):
+        store = ArtworkStore(self.path)
+        url = self.server.url("/cover.jpeg")
+
+        self.assertIsNone(store.stored(url))
+        key = store.add(url)
+        self.assertEqual(store.add(url), key)
+        self.assertEqual(store.stored(url), key)
+        self.assertEqual(self.server.requests, 1)
+
+        artwork = store.get(key)
+        self.assertEqual(artwork.content_type, "image/jpeg")
+        self.assertEqual(artwork.length, 300000)
+        with open(os.path.join(self.path, artwork.filename), "rb") as f:
+            self.assertEqual(f.read(), IMAGES["/cover.jpeg"])
+        self.assertIsNone(store.get("unknown"))
+
+        # restart
+        store = ArtworkStore(self.path)
+        self.assertEqual(store.add(url), key)
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(store.get(key, 300).etag, artwork.etag)
+
+        self.assertIsNone(store.add(self.server.url("/text.txt")))
+        self.assertIsNone(store.add(self.server.url("/missing.jpeg")))
+        self.assertEqual(store.stats()["covers"], 1)
+
+    def test_max_download(self):
+        store = ArtworkStore(self.path)
+        # slow enough that socket buffers don't take the whole image
+        server = ImageServer(IMAGES, bandwidth=1000000)
+        max_download = artworkstore.MAX_DOWNLOAD
+        artworkstore.MAX_DOWNLOAD = 100000
+        try:
+            self.assertIsNone(store.add(server.url("/cover.jpeg")))
+            # rejected based on Content-Length, the body isn't loaded
+            self.assertLess(server.bytes_sent, 100000)
+        finally:
+            artworkstore.MAX_DOWNLOAD = max_download
+            server.stop()
+        self.assertEqual(store.stats()["covers"], 0)
+
+    def test_eviction(self):
+        store = ArtworkStore(self.path, max_size=450000)
+        first = store.add(self.server.url("/cover.jpeg"))
+        second = store.add(self.server.url("/other.png"))
+        self.assertIsNone(store.get(first))
+        self.assertFalse(os.path.exists(os.path.join(self.path, first)))
+
+        third = store.add(self.server.url("/third.jpeg"))
+        self.assertIsNotNone(store.get(second))
+        self.assertIsNotNone(store.get(third))
+        self.assertEqual(store.stats()["size"], 400000)
+        self.assertEqual(store.stats()["evicted"], 1)
+
+    @unittest.skipIf(artworkstore.Image is None, "Pillow not installed")
+    def test_variants(self):
+        Image = artworkstore.Image
+        data = io.BytesIO()
+        Image.new("RGB", (1500, 1500), (200, 0, 0)).save(data, "PNG")
+        server = ImageServer({"/red.png": data.getvalue()})
+        try:
+            store = ArtworkStore(self.path)
+            key = store.add(server.url("/red.png"))
+            for (width, label) in [(100, "300"), (300, "300"),
+                                   (301, "600"), (1200, "1200"),
+                                   (None, "1200"), (2000, ORIGINAL)]:
+                artwork = store.get(key, width)
+                self.assertTrue(
+                    os.path.basename(artwork.filename).startswith(label))
+            image = Image.open(os.path.join(self.path,
+                                            store.get(key, 300).filename))
+            self.assertEqual(image.size, (300, 300))
+        finally:
+            server.stop()
+
+    def test_metadata(self):
+        artworkstore.artwork_store = ArtworkStore(self.path)
+        try:
+            md = Metadata("Artist", "Title")
+            store_artwork(md)
+            self.assertIsNone(md.localArtUrl)
+
+            md.externalArtUrl = self.server.url("/cover.jpeg")
+            store_artwork(md)
+            key = artworkstore.artwork_key(md.externalArtUrl)
+            self.assertEqual(md.localArtUrl, local_url(key))
+
+            web = md.copy()
+            artworkstore.use_local_artwork(web)
+            self.assertEqual(web.externalArtUrl, "artwork/cache/" + key)
+            self.assertEqual(md.externalArtUrl, self.server.url("/cover.jpeg"))
+        finally:
+            artworkstore.artwork_store = None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+
+from ac2.data.cache import PersistentCache
+import ac2.metadata
+from ac2.metadata import Metadata, enrich_metadata
+
+
+class TestPersistentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "cache.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testPersistence(self):
+        cache = PersistentCache(self.path)
+        cache.put("song", "a/b", {"mbid": "123"}, 100)
+        cache.close()
+
+        cache = PersistentCache(self.path)
+        self.assertEqual(cache.get("song", "a/b"), {"mbid": "123"})
+        self.assertIsNone(cache.get("song", "c/d"))
+        self.assertEqual(cache.get("order", "a/b", -1), -1)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def testTTL(self):
+        cache = PersistentCache(self.path)
+        cache.put("song", "a", 1, -1)
+        cache.put("song", "b", 2, 100)
+        self.assertIsNone(cache.get("song", "a"))
+        self.assertEqual(cache.get("song", "b"), 2)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def testEviction(self):
+        cache = PersistentCache(self.path, max_size=1000)
+        for i in range(100):
+            cache.put("song", "key{:03}".format(i), "x" * 90, 100)
+
+        stats = cache.stats()
+        self.assertLessEqual(stats["size"], 1000)
+        self.assertGreater(stats["entries"], 5)
+        # the oldest ones are gone
+        self.assertIsNone(cache.get("song", "key000"))
+        self.assertIsNotNone(cache.get("song", "key099"))
+
+    def testEnrichment(self):
+        requests = []
+
+        def source(md):
+            requests.append(md.songId())
+            md.mbid = "mbid"
+            md.add_tag("rock")
+
+        steps = [("source", source, [])]
+        try:
+            ac2.metadata.persistent_cache = PersistentCache(self.path)
+            enrich_metadata(Metadata("artist", "song"), steps=steps)
+
+            # simulate a restart
+            ac2.metadata.persistent_cache = PersistentCache(self.path)
+            md = Metadata("artist", "song")
+            enrich_metadata(md, steps=steps)
+        finally:
+            ac2.metadata.persistent_cache = None
+
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(md.mbid, "mbid")
+        self.assertEqual(md.tags, ["rock"])
+
+
+if __name__ == "__main__":
+    unittest.main()
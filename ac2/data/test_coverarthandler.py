@@ -0,0 +1,189 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import tempfile
+import unittest
+
+import ac2.data.coverarthandler as coverarthandler
+from ac2.data.coverarthandler import getImageInfo, probe_image_size, \
+    guess_image_size, image_size, best_picture_url, MAX_PROBE_BYTES
+from ac2.data.cache import PersistentCache
+from ac2.dev.imagestub import ImageServer, jpeg_image, png_image, \
+    gif_image, webp_image, avif_image
+import ac2.simple_http as simple_http
+
+SIZE = 2000000
+
+IMAGES = {
+    "/small.jpeg": jpeg_image(640, 480, 20000),
+    "/large.jpeg": jpeg_image(1500, 1400, SIZE),
+    "/exif.jpeg": jpeg_image(1200, 1100, SIZE, exif_size=150000),
+    "/large.png": png_image(1000, 1000, SIZE),
+    "/large.gif": gif_image(800, 600, SIZE),
+    "/tiny.png": png_image(16, 16, 100),
+    "/progressive.jpeg": jpeg_image(1000, 1000, 50000, sof=0xC2),
+    "/arithmetic.jpeg": jpeg_image(800, 800, 50000, sof=0xC9),
+    "/lossy.webp": webp_image(500, 400, 50000),
+    "/lossless.webp": webp_image(501, 401, 50000, kind="VP8L"),
+    "/extended.webp": webp_image(3000, 2000, 50000, kind="VP8X"),
+    "/large.avif": avif_image(1200, 1100, SIZE),
+    "/broken.jpeg": b'\xff\xd8' + b'\x00' * 1000,
+}
+
+EXPECTED = {
+    "/small.jpeg": ("image/jpeg", 640, 480),
+    "/large.jpeg": ("image/jpeg", 1500, 1400),
+    "/exif.jpeg": ("image/jpeg", 1200, 1100),
+    "/large.png": ("image/png", 1000, 1000),
+    "/large.gif": ("image/gif", 800, 600),
+    "/tiny.png": ("image/png", 16, 16),
+    "/progressive.jpeg": ("image/jpeg", 1000, 1000),
+    "/arithmetic.jpeg": ("image/jpeg", 800, 800),
+    "/lossy.webp": ("image/webp", 500, 400),
+    "/lossless.webp": ("image/webp", 501, 401),
+    "/extended.webp": ("image/webp", 3000, 2000),
+    "/large.avif": ("image/avif", 1200, 1100),
+}
+
+
+class TestCoverartHandler(unittest.TestCase):
+
+    def tearDown(self):
+        simple_http.close_sessions()
+
+    def test_image_info(self):
+        for path in EXPECTED:
+            self.assertEqual(getImageInfo(IMAGES[path]), EXPECTED[path])
+
+    def test_truncated(self):
+        data = IMAGES["/exif.jpeg"]
+        for length in [2, 3, 100, 70000, 150000]:
+            self.assertEqual(getImageInfo(data[:length]),
+                             ("image/jpeg", -1, -1))
+        self.assertEqual(getImageInfo(data[:160000]),
+                         ("image/jpeg", 1200, 1100))
+
+        data = IMAGES["/large.avif"]
+        self.assertEqual(getImageInfo(data[:100]), ("image/avif", -1, -1))
+        # JPEG without frame header, garbage
+        self.assertEqual(getImageInfo(b'\xff\xd8\xff\xda' + b'\xff' * 100),
+                         ("image/jpeg", -1, -1))
+        self.assertEqual(getImageInfo(b'RIFF\x00\x00\x00\x00WEBPVP8X'),
+                         ("image/webp", -1, -1))
+
+    def test_probe_range(self):
+        server = ImageServer(IMAGES)
+        try:
+            for path in EXPECTED:
+                server.reset_counters()
+                self.assertEqual(probe_image_size(server.url(path)),
+                                 EXPECTED[path] + (len(IMAGES[path]),))
+                if path == "/exif.jpeg":
+                    # header after 150kB: a few growing range requests
+                    self.assertLess(server.bytes_sent, 300000)
+                else:
+                    self.assertEqual(server.requests, 1)
+                    self.assertLessEqual(server.bytes_sent, 4096)
+
+            # stops at the end of file or after MAX_PROBE_BYTES
+            server.reset_counters()
+            self.assertEqual(probe_image_size(server.url("/broken.jpeg")),
+                             ("image/jpeg", -1, -1, 1002))
+            self.assertLessEqual(server.bytes_sent, 1002)
+            self.assertEqual(probe_image_size(server.url("/missing.png")),
+                             ('', -1, -1, None))
+        finally:
+            server.stop()
+
+    def test_probe_no_range(self):
+        server = ImageServer(IMAGES, ranges=False, bandwidth=20000000)
+        try:
+            for path in EXPECTED:
+                self.assertEqual(probe_image_size(server.url(path)),
+                                 EXPECTED[path] + (len(IMAGES[path]),))
+            # the connection is closed after the header, the rest of the
+            # image isn't sent
+            server.reset_counters()
+            probe_image_size(server.url("/large.png"))
+            self.assertLess(server.bytes_sent, MAX_PROBE_BYTES)
+        finally:
+            server.stop()
+
+    def test_guess(self):
+        for (url, size) in [
+                ("https://lastfm.freetls.fastly.net/i/u/300x300/a.png",
+                 (300, 300)),
+                ("https://lastfm.freetls.fastly.net/i/u/150x150/a.png",
+                 (150, 150)),
+                ("https://lastfm.freetls.fastly.net/i/u/770x0/a.jpg",
+                 (770, 770)),
+                ("https://lastfm.freetls.fastly.net/i/u/174s/a.png",
+                 (174, 174)),
+                ("http://coverartarchive.org/release/x/12-500.jpg",
+                 (500, 500)),
+                ("http://coverartarchive.org/release/x/12-1200.jpg",
+                 (1200, 1200)),
+                ("http://coverartarchive.org/release/x/12.jpg", (0, 0)),
+                ("http://example.com/cover-500.jpg", (0, 0))]:
+            self.assertEqual(guess_image_size(url), size)
+
+    def test_size_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache.db")
+        server = ImageServer(IMAGES)
+        urls = [server.url(p) for p in ["/small.jpeg", "/large.png"]]
+        try:
+            coverarthandler.persistent_cache = PersistentCache(path)
+            coverarthandler.image_sizes.clear()
+            for _i in range(3):
+                self.assertEqual(image_size(urls[0]),
+                                 (640, 480, "image/jpeg", 20000))
+                best_picture_url("song", urls[0])
+                best_picture_url("song", urls[1])
+            self.assertEqual(server.requests, 2)
+
+            # restart: nothing in memory, but no need to probe again
+            coverarthandler.persistent_cache.close()
+            coverarthandler.persistent_cache = PersistentCache(path)
+            coverarthandler.image_sizes.clear()
+            coverarthandler.covers.clear()
+            server.reset_counters()
+            self.assertEqual(best_picture_url("song", urls[0]), urls[0])
+            self.assertEqual(best_picture_url("song", urls[1]), urls[1])
+            self.assertEqual(server.requests, 0)
+
+            # failed probes aren't cached
+            self.assertEqual(image_size(server.url("/missing.png")),
+                             (0, 0, None, None))
+            self.assertEqual(image_size(server.url("/missing.png")),
+                             (0, 0, None, None))
+            self.assertEqual(server.requests, 0)
+        finally:
+            coverarthandler.persistent_cache.close()
+            coverarthandler.persistent_cache = None
+            coverarthandler.image_sizes.clear()
+            coverarthandler.covers.clear()
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+import unittest
+from unittest.mock import patch
+
+import ac2.data.musicbrainz as musicbrainz
+
+
+class TestMusicBrainz(unittest.TestCase):
+
+    def testMemo(self):
+        calls = []
+
+        def search_recordings(**kwargs):
+            calls.append(kwargs)
+            return {"recording-list": [{"id": "mbid"}]}
+
+        musicbrainz.results.clear()
+        with patch("musicbrainzngs.search_recordings", search_recordings):
+            d1 = musicbrainz.track_data("The River", "Bruce Springsteen")
+            d2 = musicbrainz.track_data("the  river", "BRUCE springsteen ")
+            d3 = musicbrainz.track_data("Born to Run", "Bruce Springsteen")
+        musicbrainz.results.clear()
+
+        self.assertEqual(d1, {"id": "mbid"})
+        self.assertEqual(d1, d2)
+        self.assertEqual(d1, d3)
+        # normalized queries are looked up only once
+        self.assertEqual(len(calls), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
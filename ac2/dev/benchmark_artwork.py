@@ -0,0 +1,177 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+'''
+Measures bytes transferred and latency of image size probing against a
+local server with a corpus of JPEG, PNG and GIF files. The server's
+bandwidth is limited to simulate a typical internet connection.
+
+Also measures header parsing throughput and correctness of getImageInfo
+against the previous byte-by-byte JPEG parser.
+
+Usage: python -m ac2.dev.benchmark_artwork [bandwidth in Mbit/s]
+'''
+
+import io
+import struct
+import sys
+import urllib.request
+from time import perf_counter
+
+import ac2.simple_http as simple_http
+from ac2.data.coverarthandler import getImageInfo, probe_image_size
+from ac2.dev.imagestub import ImageServer, jpeg_image, png_image, \
+    gif_image, webp_image, avif_image
+
+
+def corpus():
+    images = {}
+    for (width, size) in [(300, 40000), (600, 150000), (1000, 500000),
+                          (1500, 2000000), (3000, 6000000)]:
+        images["/{}.jpeg".format(width)] = jpeg_image(width, width, size)
+        images["/{}-exif.jpeg".format(width)] = \
+            jpeg_image(width, width, size, exif_size=60000)
+        images["/{}.png".format(width)] = png_image(width, width, size)
+        images["/{}.gif".format(width)] = gif_image(width, width, size)
+    return images
+
+
+def parser_corpus():
+    """
+    Headers of images with known dimensions: (data, width, height)
+    """
+    images = []
+    for width in [300, 600, 1000, 1500, 3000]:
+        height = width * 3 // 4
+        for exif_size in [0, 20000, 60000]:
+            for sof in [0xC0, 0xC1, 0xC2, 0xC9]:
+                data = jpeg_image(width, height, 0, exif_size, sof=sof)
+                images.append((data, width, height))
+        images.append((png_image(width, height, 0), width, height))
+        images.append((gif_image(width, height, 0), width, height))
+        for kind in ["VP8 ", "VP8L", "VP8X"]:
+            images.append((webp_image(width, height, 0, kind),
+                           width, height))
+        images.append((avif_image(width, height, 0), width, height))
+    return images
+
+
+def bytewise_image_info(data):
+    """
+    Previous implementation, JPEG only
+    """
+    width = height = -1
+    jpeg = io.BytesIO(data)
+    jpeg.read(2)
+    b = jpeg.read(1)
+    try:
+        while (b and ord(b) != 0xDA):
+            while (ord(b) != 0xFF): b = jpeg.read(1)
+            while (ord(b) == 0xFF): b = jpeg.read(1)
+            if (ord(b) >= 0xC0 and ord(b) <= 0xC3):
+                jpeg.read(3)
+                height, width = struct.unpack(b">HH", jpeg.read(4))
+                break
+            else:
+                jpeg.read(int(struct.unpack(b">H", jpeg.read(2))[0]) - 2)
+            b = jpeg.read(1)
+    except (struct.error, ValueError, TypeError):
+        pass
+    return 'image/jpeg', width, height
+
+
+def parse_throughput(parse, images, rounds=200):
+    correct = sum(1 for (data, width, height) in images
+                  if parse(data)[1:] == (width, height))
+    total = sum(len(data) for (data, _width, _height) in images)
+    start = perf_counter()
+    for _i in range(rounds):
+        for (data, _width, _height) in images:
+            parse(data)
+    elapsed = perf_counter() - start
+    return (total * rounds / elapsed / 1000000,
+            len(images) * rounds / elapsed,
+            correct)
+
+
+def full_download(url):
+    """
+    Previous implementation: the invalid Range header is ignored by
+    servers and the whole image is downloaded
+    """
+    req = urllib.request.Request(url, headers={"Range": "5000"})
+    return getImageInfo(urllib.request.urlopen(req).read())
+
+
+def run(probe, images, ranges, bandwidth):
+    server = ImageServer(images, ranges=ranges, bandwidth=bandwidth)
+    latencies = []
+    try:
+        for path in images:
+            start = perf_counter()
+            width = probe(server.url(path))[1]
+            latencies.append(perf_counter() - start)
+            assert width > 0
+        bytes_sent = server.bytes_sent
+    finally:
+        server.stop()
+        simple_http.close_sessions()
+
+    latencies.sort()
+    return (bytes_sent / len(images),
+            latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.95)])
+
+
+def main():
+    bandwidth = 20
+    if len(sys.argv) > 1:
+        bandwidth = float(sys.argv[1])
+    bandwidth = bandwidth * 1000000 / 8
+
+    headers = parser_corpus()
+    jpegs = [image for image in headers if image[0][:2] == b'\xff\xd8']
+    for (mode, parse, images) in [
+            ("bytewise JPEG", bytewise_image_info, jpegs),
+            ("marker jumps JPEG", getImageInfo, jpegs),
+            ("all formats", getImageInfo, headers)]:
+        (mbps, rate, correct) = parse_throughput(parse, images)
+        print("{:17} {:8.1f}MB/s {:9.0f} headers/s, {}/{} correct".format(
+            mode, mbps, rate, correct, len(images)))
+
+    images = corpus()
+    total = sum(len(data) for data in images.values())
+    print("{} images, {:.1f}MB".format(len(images), total / 1000000))
+
+    for (mode, probe, ranges) in [("full download", full_download, True),
+                                  ("range probe", probe_image_size, True),
+                                  ("no range support", probe_image_size,
+                                   False)]:
+        (transferred, median, p95) = run(probe, images, ranges, bandwidth)
+        print("{:17} {:9.0f} bytes/image, latency median {:7.1f}ms "
+              "p95 {:7.1f}ms".format(mode, transferred,
+                                     median * 1000, p95 * 1000))
+
+
+if __name__ == "__main__":
+    main()
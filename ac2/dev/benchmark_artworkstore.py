@@ -0,0 +1,166 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+'''
+Compares web clients loading covers directly from the internet with
+covers served from the local artwork store. A playlist with repeating
+albums is played, on every track change a client loads the cover.
+
+Internet and Wi-Fi bandwidth are simulated by two local servers. Time
+to first paint is the time from the track change until the client has
+received the cover, including the download to the artwork store.
+
+Usage: python -m ac2.dev.benchmark_artworkstore [track changes]
+       [internet Mbit/s] [Wi-Fi Mbit/s]
+'''
+
+import io
+import random
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+import requests
+
+import ac2.simple_http as simple_http
+from ac2.data.artworkstore import ArtworkStore, Image
+from ac2.dev.imagestub import ImageServer, jpeg_image
+
+CLIENT_WIDTH = 600
+
+
+def cover(width, size):
+    """
+    A real JPEG if Pillow is installed, otherwise just the header
+    """
+    if Image is None:
+        return jpeg_image(width, width, size)
+    data = io.BytesIO()
+    Image.effect_noise((width, width), 64).convert("RGB").save(
+        data, "JPEG", quality=95)
+    return data.getvalue()
+
+
+class StoreServer(ImageServer):
+    """
+    Serves /artwork/cache/<key>?size=<width> like the web server
+    """
+
+    def __init__(self, store, bandwidth):
+        super().__init__(StoreImages(store), bandwidth=bandwidth)
+
+
+class StoreImages():
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, path):
+        (key, _sep, query) = path.split("/")[-1].partition("?size=")
+        artwork = self.store.get(key, int(query) if query else None)
+        if artwork is None:
+            return None
+        with open("{}/{}".format(self.store.path, artwork.filename),
+                  "rb") as f:
+            return f.read()
+
+
+def run_direct(urls, playlist):
+    latencies = []
+    transferred = 0
+    for i in playlist:
+        start = perf_counter()
+        transferred += len(requests.get(urls[i]).content)
+        latencies.append(perf_counter() - start)
+    return latencies, transferred
+
+
+def run_store(urls, playlist, store, local):
+    latencies = []
+    transferred = 0
+    for i in playlist:
+        start = perf_counter()
+        # enrichment
+        key = store.add(urls[i])
+        # client
+        res = requests.get(local.url("/artwork/cache/{}?size={}".format(
+            key, CLIENT_WIDTH)))
+        transferred += len(res.content)
+        latencies.append(perf_counter() - start)
+    return latencies, transferred
+
+
+def main():
+    track_changes = 40
+    internet = 20
+    wifi = 50
+    if len(sys.argv) > 1:
+        track_changes = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        internet = float(sys.argv[2])
+    if len(sys.argv) > 3:
+        wifi = float(sys.argv[3])
+
+    images = {}
+    for (i, (width, size)) in enumerate([(500, 100000), (1000, 400000),
+                                         (1200, 800000), (1500, 1500000),
+                                         (3000, 4000000)] * 2):
+        images["/cover{}.jpeg".format(i)] = cover(width, size)
+    random.seed(1)
+    playlist = [random.randrange(len(images)) for _i in range(track_changes)]
+
+    remote = ImageServer(images, bandwidth=internet * 125000)
+    urls = [remote.url(path) for path in images]
+    path = tempfile.mkdtemp()
+    store = ArtworkStore(path)
+    local = StoreServer(store, bandwidth=wifi * 125000)
+
+    print("{} track changes, {} different covers, {:.1f}MB, resize: {}".format(
+        track_changes, len(images),
+        sum(len(data) for data in images.values()) / 1000000,
+        Image is not None))
+    try:
+        for (mode, run) in [
+                ("direct", lambda: run_direct(urls, playlist)),
+                ("artwork store", lambda: run_store(urls, playlist, store,
+                                                   local))]:
+            remote.reset_counters()
+            (latencies, served) = run()
+            latencies.sort()
+            print("{:14} internet {:8.0f} bytes/track change, "
+                  "client {:8.0f} bytes/track change, time to first paint "
+                  "median {:7.1f}ms p95 {:7.1f}ms".format(
+                      mode, remote.bytes_sent / track_changes,
+                      served / track_changes,
+                      latencies[len(latencies) // 2] * 1000,
+                      latencies[int(len(latencies) * 0.95)] * 1000))
+    finally:
+        remote.stop()
+        local.stop()
+        simple_http.close_sessions()
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Measures enrichment latency and HTTP requests after a restart with and
+without the persistent metadata cache. Uses stub sources with the
+latencies from benchmark_metadata.
+
+Usage: python -m ac2.dev.benchmark_cache [songs] [scale]
+'''
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep
+
+import ac2.metadata
+from ac2.metadata import Metadata, enrich_metadata, enrichment_steps
+from ac2.data.cache import PersistentCache
+from ac2.data.coverarthandler import covers
+from ac2.dev.benchmark_metadata import LATENCIES
+
+
+class CountingSources():
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def steps(self):
+        return [(source, self.stub(source), after)
+                for (source, _step, after) in enrichment_steps]
+
+    def stub(self, source):
+
+        def enrich(metadata):
+            with self.lock:
+                self.requests += 1
+            sleep(LATENCIES[source] * self.scale)
+            if source == "musicbrainz":
+                metadata.mbid = "mbid-" + metadata.title
+                metadata.albummbid = "album-" + metadata.artist
+            elif source == "coverartarchive":
+                metadata.externalArtUrl = "http://caa/{}.jpg".format(
+                    metadata.albummbid)
+
+        return enrich
+
+
+def enrich_songs(songs, scale):
+    sources = CountingSources(scale)
+    steps = sources.steps()
+    start = perf_counter()
+    for (artist, title) in songs:
+        enrich_metadata(Metadata(artist, title), steps=steps)
+    return ((perf_counter() - start) / len(songs), sources.requests)
+
+
+def main():
+    num_songs = 50
+    scale = 0.1
+    if len(sys.argv) > 1:
+        num_songs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        scale = float(sys.argv[2])
+
+    songs = [("Artist {}".format(i % 10), "Title {}".format(i))
+             for i in range(num_songs)]
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "cache.db")
+
+    for (mode, cache) in [("memory only", None),
+                          ("persistent", PersistentCache(path))]:
+        ac2.metadata.persistent_cache = cache
+        # first start
+        enrich_songs(songs, scale)
+
+        # restart: in-memory caches are empty
+        covers.clear()
+        if cache is not None:
+            cache.close()
+            ac2.metadata.persistent_cache = PersistentCache(path)
+        (latency, requests) = enrich_songs(songs, scale)
+        print("{:12} warm start: {:7.1f}ms/song, {:4} requests for "
+              "{} songs".format(mode, latency * 1000, requests, num_songs))
+
+    ac2.metadata.persistent_cache.close()
+    ac2.metadata.persistent_cache = None
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Scalability of /api/events with many idle subscribers. The webserver
+runs on gevent in its own process. Memory per subscriber is the growth
+of the server's resident set size after all clients connected, fan-out
+latency is the time from a volume change until each subscriber received
+the event.
+
+Usage: python -m ac2.dev.benchmark_events [subscribers] [changes]
+'''
+
+from gevent import monkey
+monkey.patch_all()
+
+import os
+import subprocess
+import sys
+from time import perf_counter, sleep
+
+import gevent
+import gevent.socket
+
+PORT = 18924
+
+SERVER = r'''
+import sys
+
+from gevent import monkey
+monkey.patch_all()
+from gevent.pywsgi import WSGIServer
+
+from ac2.metadata import Metadata, update_web_snapshot
+from ac2.webserver import AudioControlWebserver
+from ac2.fileserver import SendfileHandler
+
+ws = AudioControlWebserver()
+md = Metadata("Artist", "Title", "Album")
+update_web_snapshot(md)
+ws.notify(md)
+ws.notify_volume(0)
+
+# volume changes without a volume control
+ws.bottle.route("/bench/volume/<percent:int>", method="POST",
+                callback=lambda percent: ws.notify_volume(percent) or "ok")
+
+WSGIServer(("127.0.0.1", int(sys.argv[1])), ws.bottle,
+           handler_class=SendfileHandler, log=None).serve_forever()
+'''
+
+
+def rss(pid):
+    with open("/proc/{}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+
+def request(method, path, headers={}):
+    sock = gevent.socket.create_connection(("127.0.0.1", PORT))
+    data = "{} {} HTTP/1.1\r\nHost: localhost\r\n".format(method, path)
+    for (name, value) in headers.items():
+        data += "{}: {}\r\n".format(name, value)
+    sock.sendall((data + "\r\n").encode())
+    return sock
+
+
+def start_server():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd()] + [p for p in [env.get("PYTHONPATH")] if p])
+    server = subprocess.Popen([sys.executable, "-c", SERVER, str(PORT)],
+                              env=env,
+                              stderr=subprocess.DEVNULL)
+    for _i in range(100):
+        try:
+            request("GET", "/api/track/metadata").close()
+            return server
+        except ConnectionRefusedError:
+            sleep(0.1)
+    server.kill()
+    raise IOError("webserver did not start")
+
+
+class Subscriber():
+
+    def __init__(self):
+        self.sock = request("GET", "/api/events")
+        self.buffer = b""
+        self.received = {}
+
+    def wait_for(self, marker):
+        while marker not in self.buffer:
+            block = self.sock.recv(65536)
+            if not block:
+                raise IOError("event stream closed")
+            self.buffer += block
+        self.buffer = self.buffer[self.buffer.index(marker) + len(marker):]
+
+    def run(self, changes):
+        for percent in range(1, changes + 1):
+            self.wait_for('data: {{"percent":{}}}\n\n'.format(percent)
+                          .encode())
+            self.received[percent] = perf_counter()
+
+
+def main():
+    num_subscribers = 500
+    changes = 20
+    if len(sys.argv) > 1:
+        num_subscribers = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        changes = int(sys.argv[2])
+
+    server = start_server()
+    try:
+        sleep(0.5)
+        rss_before = rss(server.pid)
+
+        subscribers = []
+        for _i in range(num_subscribers):
+            subscriber = Subscriber()
+            # current volume
+            subscriber.wait_for(b'data: {"percent":0}\n\n')
+            subscribers.append(subscriber)
+        sleep(0.5)
+        rss_after = rss(server.pid)
+
+        greenlets = [gevent.spawn(s.run, changes) for s in subscribers]
+        latencies = []
+        for percent in range(1, changes + 1):
+            published = perf_counter()
+            request("POST", "/bench/volume/{}".format(percent),
+                    {"Content-Length": "0"}).close()
+            deadline = perf_counter() + 10
+            while any(percent not in s.received for s in subscribers) and \
+                    perf_counter() < deadline:
+                gevent.sleep(0.001)
+            latencies.extend(s.received[percent] - published
+                             for s in subscribers if percent in s.received)
+        gevent.killall(greenlets)
+
+        latencies.sort()
+        print("{} subscribers, {:.1f} kB server memory per subscriber"
+              .format(num_subscribers,
+                      (rss_after - rss_before) / num_subscribers / 1024))
+        print("fan-out latency median {:.1f}ms, p95 {:.1f}ms, max {:.1f}ms, "
+              "{} of {} events delivered".format(
+                  latencies[len(latencies) // 2] * 1000,
+                  latencies[int(len(latencies) * 0.95)] * 1000,
+                  latencies[-1] * 1000,
+                  len(latencies), num_subscribers * changes))
+        for s in subscribers:
+            s.sock.close()
+    finally:
+        server.kill()
+
+
+if __name__ == "__main__":
+    main()
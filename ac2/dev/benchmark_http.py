@@ -0,0 +1,115 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Compares a new connection per request with pooled keep-alive sessions
+against a local HTTP server. Setting up a connection is delayed by
+handshake seconds to simulate TCP and TLS handshakes on a slow uplink.
+
+Usage: python -m ac2.dev.benchmark_http [requests] [handshake]
+'''
+
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+import requests
+
+import ac2.simple_http as simple_http
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    handshake = 0.05
+
+    def setup(self):
+        sleep(self.handshake)
+        super().setup()
+
+    def do_GET(self):
+        body = b'{"result": "ok"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def unpooled_get(url):
+    return requests.get(url, timeout=10)
+
+
+def pooled_get(url):
+    simple_http.clear_cache()
+    return simple_http.retrieve_url(url)
+
+
+def run(get, base_url, num_requests, threads=4):
+    latencies = []
+
+    def request(i):
+        start = perf_counter()
+        res = get("{}/track/{}".format(base_url, i))
+        latencies.append(perf_counter() - start)
+        return res
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(request, range(num_requests)))
+    elapsed = perf_counter() - start
+
+    assert all(r is not None and r.status_code == 200 for r in results)
+    latencies.sort()
+    return (num_requests / elapsed,
+            latencies[int(len(latencies) * 0.95)])
+
+
+def main():
+    num_requests = 200
+    if len(sys.argv) > 1:
+        num_requests = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        StubHandler.handshake = float(sys.argv[2])
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+
+    for (mode, get) in [("new connection", unpooled_get),
+                        ("pooled", pooled_get)]:
+        (rate, p95) = run(get, base_url, num_requests)
+        print("{:15} {:7.1f} requests/s, p95 latency {:6.1f}ms".format(
+            mode, rate, p95 * 1000))
+
+    server.shutdown()
+    simple_http.close_sessions()
+
+
+if __name__ == "__main__":
+    main()
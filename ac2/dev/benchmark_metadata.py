@@ -0,0 +1,132 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Compares sequential and parallel metadata enrichment with stub sources
+that have fixed latencies and measures the time until the first cover
+is reported with and without progressive updates.
+
+Usage: python -m ac2.dev.benchmark_metadata [scale]
+'''
+
+import sys
+from time import perf_counter, sleep
+
+from ac2.metadata import Metadata, enrich_metadata, enrichment_steps, \
+    NOTIFY_INTERVAL
+
+# Typical latencies in seconds, musicbrainz is rate limited
+LATENCIES = {
+    "musicbrainz": 1.0,
+    "last.fm": 0.6,
+    "hifiberry db": 0.3,
+    "fanart.tv": 0.4,
+    "coverartarchive": 0.5,
+    "hifiberry db update": 0.2,
+    "fanart.tv artist": 0.4,
+}
+
+# Attributes found by every source
+RESULTS = {
+    "musicbrainz": {"mbid": "mbid", "albummbid": "albummbid",
+                    "artistmbid": "artistmbid"},
+    "last.fm": {"externalArtUrl": "http://lastfm/cover.jpg"},
+    "hifiberry db": {},
+    "fanart.tv": {},
+    "coverartarchive": {"externalArtUrl": "http://caa/cover.jpg"},
+    "hifiberry db update": {},
+    "fanart.tv artist": {},
+}
+
+
+def stub(latency, results):
+
+    def enrich(metadata):
+        sleep(latency)
+        metadata.__dict__.update(results)
+
+    return enrich
+
+
+def stub_steps(scale, sequential):
+    steps = []
+    previous = None
+    for (source, _step, after) in enrichment_steps:
+        if sequential:
+            after = [previous] if previous is not None else []
+        steps.append((source,
+                      stub(LATENCIES[source] * scale, RESULTS[source]),
+                      after))
+        previous = source
+    return steps
+
+
+def critical_path(steps):
+    end = {}
+    for (source, _step, after) in steps:
+        start = max([end[s] for s in after], default=0)
+        end[source] = start + LATENCIES[source]
+    return max(end.values())
+
+
+class ArtworkCallback():
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.first_artwork = None
+        self.updates = 0
+
+    def update_metadata_attributes(self, attributes, _songId):
+        self.updates += 1
+        if self.first_artwork is None and "externalArtUrl" in attributes:
+            self.first_artwork = perf_counter() - self.start
+
+
+def main():
+    scale = 1
+    if len(sys.argv) > 1:
+        scale = float(sys.argv[1])
+
+    for (mode, sequential) in [("sequential", True), ("parallel", False)]:
+        steps = stub_steps(scale, sequential)
+        start = perf_counter()
+        enrich_metadata(Metadata("Artist", "Title"), steps=steps)
+        print("{:10} {:6.2f}s (sum of latencies {:4.2f}s, "
+              "critical path {:4.2f}s)".format(
+                  mode,
+                  perf_counter() - start,
+                  sum(LATENCIES.values()) * scale,
+                  critical_path(steps) * scale))
+
+    for (mode, notify_interval) in [("final", None),
+                                    ("progressive", NOTIFY_INTERVAL)]:
+        callback = ArtworkCallback()
+        enrich_metadata(Metadata("Artist", "Title"),
+                        callback=callback,
+                        steps=stub_steps(scale, False),
+                        notify_interval=notify_interval)
+        print("{:12} first artwork after {:4.2f}s, {} updates".format(
+            mode, callback.first_artwork, callback.updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Load test of /api/track/metadata with many clients polling the current
+song. The webserver runs in its own process on gevent, its CPU time is
+read from /proc.
+
+Compared are serializing the metadata on every request (as before
+metadata snapshots), returning the pre-serialized snapshot and clients
+that revalidate with If-None-Match and get 304 responses.
+
+Usage: python -m ac2.dev.benchmark_metadata_api [clients] [seconds]
+'''
+
+import json
+import os
+import subprocess
+import sys
+import threading
+from time import perf_counter, sleep
+
+import requests
+
+SERVER = r'''
+import json
+import sys
+
+from gevent import monkey
+monkey.patch_all()
+from gevent.pywsgi import WSGIServer
+
+from ac2.metadata import Metadata, update_web_snapshot
+from ac2.webserver import AudioControlWebserver
+
+ws = AudioControlWebserver()
+md = Metadata("Artist", "Title", "Album")
+md.playerName = "mpd"
+md.playerState = "playing"
+md.artUrl = "http://coverartarchive.org/release/1234/front-500.jpg"
+md.wiki = "An album that has been released a long time ago. " * 20
+md.tags = ["rock", "pop", "indie", "alternative", "90s"]
+md.mbid = "5b11f4ce-a62d-471e-81fc-a69a8278c7da"
+md.artistmbid = "7e84f845-ac16-41fe-9ff8-df12eb32af55"
+md.duration = 245
+md.position = 30
+update_web_snapshot(md)
+ws.notify(md)
+
+# the handler before metadata snapshots
+ws.bottle.route("/old/metadata", method="GET",
+                callback=lambda: json.dumps(ws.metadata.__dict__,
+                                            skipkeys=True))
+
+WSGIServer(("127.0.0.1", int(sys.argv[1])), ws.bottle,
+           log=None).serve_forever()
+'''
+
+
+def cpu_time(pid):
+    fields = open("/proc/{}/stat".format(pid)).read().split(")")[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def start_server(port):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd()] + [p for p in [env.get("PYTHONPATH")] if p])
+    server = subprocess.Popen([sys.executable, "-c", SERVER, str(port)],
+                              env=env,
+                              stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}".format(port)
+    for _i in range(100):
+        try:
+            requests.get(url + "/api/track/metadata", timeout=1)
+            return (server, url)
+        except requests.ConnectionError:
+            sleep(0.1)
+    server.kill()
+    raise IOError("webserver did not start")
+
+
+def poll(url, conditional, stop, counts):
+    session = requests.Session()
+    headers = {}
+    requests_done = 0
+    while not stop.is_set():
+        r = session.get(url, headers=headers, timeout=10)
+        if r.status_code == 200:
+            json.loads(r.text)
+            if conditional and "ETag" in r.headers:
+                headers = {"If-None-Match": r.headers["ETag"]}
+        elif r.status_code != 304:
+            raise IOError("HTTP error {}".format(r.status_code))
+        requests_done += 1
+    counts.append(requests_done)
+
+
+def run(url, num_clients, duration, conditional, pid):
+    stop = threading.Event()
+    counts = []
+    clients = [threading.Thread(target=poll,
+                                args=(url, conditional, stop, counts))
+               for _i in range(num_clients)]
+
+    cpu_start = cpu_time(pid)
+    start = perf_counter()
+    for client in clients:
+        client.start()
+    sleep(duration)
+    stop.set()
+    for client in clients:
+        client.join()
+    elapsed = perf_counter() - start
+    cpu = cpu_time(pid) - cpu_start
+
+    num_requests = sum(counts)
+    return (num_requests / elapsed, cpu / num_requests)
+
+
+def main():
+    num_clients = 50
+    duration = 10
+    if len(sys.argv) > 1:
+        num_clients = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = int(sys.argv[2])
+
+    (server, url) = start_server(18923)
+    try:
+        for (mode, path, conditional) in [
+                ("json.dumps", "/old/metadata", False),
+                ("snapshot", "/api/track/metadata", False),
+                ("snapshot 304", "/api/track/metadata", True)]:
+            (rate, cpu) = run(url + path, num_clients, duration,
+                              conditional, server.pid)
+            print("{:13} {:7.1f} requests/s, server CPU {:6.3f}ms/request"
+                  .format(mode, rate, cpu * 1000))
+    finally:
+        server.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Compares MPRIS polling with signal based tracking and measures the effect
+of proxy caching and GetAll snapshots on a StubBus.
+
+Usage: python -m ac2.dev.benchmark_mpris [players] [seconds]
+'''
+
+import random
+import sys
+import threading
+from time import perf_counter, process_time, sleep
+
+from ac2.players.mpris import MPRIS
+from ac2.dev.mprisstub import StubBus
+
+# CPU time of a D-Bus round trip on a Raspberry Pi 3 (marshalling,
+# context switches to dbus-daemon and the player)
+CALL_COST = 0.0005
+
+
+def create_mpris(bus, use_signals):
+    mpris = MPRIS()
+    mpris.bus = bus
+    mpris.subscribe_signals(properties=use_signals)
+    return mpris
+
+
+def controller_loop(mpris, wakeup, loop_delay, stop, seen):
+    """
+    Does the same MPRIS calls as AudioController.main_loop
+    """
+    while not stop.is_set():
+        for p in mpris.retrieve_players():
+            snapshot = mpris.snapshot(p)
+            if snapshot is not None and snapshot.state.lower() == "playing":
+                md = snapshot.metadata
+                if seen.get(p) != md.trackId:
+                    seen[p] = md.trackId
+                    seen["changed"] = perf_counter()
+        wakeup.wait(loop_delay)
+        wakeup.clear()
+
+
+def run(num_players, duration, use_signals, loop_delay=1):
+    bus = StubBus(call_cost=CALL_COST)
+    players = [bus.add_player("player{}".format(i))
+               for i in range(num_players)]
+    players[0].set(PlaybackStatus="Playing")
+
+    mpris = create_mpris(bus, use_signals)
+    wakeup = threading.Event()
+    mpris.add_listener(wakeup.set)
+
+    stop = threading.Event()
+    seen = {}
+    loop = threading.Thread(target=controller_loop,
+                            args=(mpris, wakeup, loop_delay, stop, seen))
+    loop.start()
+    sleep(0.2)
+    bus.reset_counters()
+
+    latencies = []
+    cpu_start = process_time()
+    start = perf_counter()
+    track = 1
+    while perf_counter() - start < duration:
+        sleep(random.uniform(0.5, 2))
+        seen.pop("changed", None)
+        changed = perf_counter()
+        players[0].set(Metadata={"xesam:artist": ["Artist"],
+                                 "xesam:title": "Title {}".format(track),
+                                 "mpris:trackid": "/track/{}".format(track)})
+        track += 1
+        while "changed" not in seen and perf_counter() - changed < 5:
+            sleep(0.001)
+        if "changed" in seen:
+            latencies.append(seen["changed"] - changed)
+
+    elapsed = perf_counter() - start
+    cpu = process_time() - cpu_start
+    stop.set()
+    wakeup.set()
+    loop.join()
+
+    latencies.sort()
+    return {
+        "cpu_per_hour": cpu / elapsed * 3600,
+        "round_trips_per_second": bus.round_trips() / elapsed,
+        "latency_median": latencies[len(latencies) // 2],
+        "latency_max": latencies[-1],
+    }
+
+
+def calls_per_second(num_players, duration, cache_proxies):
+    """
+    Polls state and metadata of all players as fast as possible
+    """
+    bus = StubBus(call_cost=CALL_COST)
+    players = [bus.add_player("player{}".format(i)).name
+               for i in range(num_players)]
+    mpris = create_mpris(bus, False)
+
+    calls = 0
+    start = perf_counter()
+    while perf_counter() - start < duration:
+        for p in players:
+            if not cache_proxies:
+                mpris.invalidate(p)
+            mpris.retrieve_state(p)
+            mpris.get_meta(p)
+            calls += 2
+
+    return calls / (perf_counter() - start)
+
+
+def round_trips_per_iteration(num_players, use_snapshots, playing,
+                              iterations=100):
+    """
+    Counts D-Bus round trips of a polling loop iteration. The first player
+    is either playing or the paused active player.
+    """
+    bus = StubBus()
+    players = [bus.add_player("player{}".format(i)).name
+               for i in range(num_players)]
+    if playing:
+        bus.players[players[0]].properties["PlaybackStatus"] = "Playing"
+    else:
+        bus.players[players[0]].properties["PlaybackStatus"] = "Paused"
+    mpris = create_mpris(bus, False)
+
+    for i in range(iterations + 1):
+        if i == 1:
+            # ignore proxy creation
+            bus.reset_counters()
+        for p in players:
+            if use_snapshots:
+                mpris.snapshot(p)
+            elif mpris.retrieve_state(p) == "Playing":
+                mpris.get_meta(p)
+        if not(playing) and not(use_snapshots):
+            # metadata of the paused active player
+            mpris.get_meta(players[0])
+
+    return bus.round_trips() / iterations
+
+
+def main():
+    num_players = 6
+    duration = 30
+    if len(sys.argv) > 1:
+        num_players = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        duration = int(sys.argv[2])
+
+    for (mode, cache_proxies) in [("no proxy cache", False),
+                                  ("proxy cache", True)]:
+        print("{:15} {:8.0f} calls/s".format(
+            mode,
+            calls_per_second(num_players, duration / 10, cache_proxies)))
+
+    for playing in [True, False]:
+        for (mode, use_snapshots) in [("Get", False), ("GetAll", True)]:
+            print("{:15} {:8.1f} round trips/iteration ({})".format(
+                mode,
+                round_trips_per_iteration(num_players, use_snapshots, playing),
+                "playing" if playing else "paused"))
+
+    for (mode, use_signals) in [("polling", False), ("signals", True)]:
+        res = run(num_players, duration, use_signals)
+        print("{:8} CPU {:7.1f}s/h, {:6.1f} D-Bus calls/s, "
+              "change-to-notify latency median {:6.1f}ms max {:6.1f}ms".format(
+                  mode,
+                  res["cpu_per_hour"],
+                  res["round_trips_per_second"],
+                  res["latency_median"] * 1000,
+                  res["latency_max"] * 1000))
+
+
+if __name__ == "__main__":
+    main()
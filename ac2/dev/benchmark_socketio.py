@@ -0,0 +1,217 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Bytes a Socket.IO client receives per song with full metadata updates
+and with delta updates. Every song goes through a typical enrichment
+sequence: the player reports the song, then cover, MusicBrainz IDs,
+tags, wiki text etc. arrive one after another.
+
+The webserver runs on gevent in its own process, two clients connect
+with HTTP long-polling. Received bytes are counted on the HTTP
+responses and include Engine.IO framing.
+
+Usage: python -m ac2.dev.benchmark_socketio [songs]
+'''
+
+import copy
+import os
+import subprocess
+import sys
+import threading
+from time import sleep
+
+import requests
+import socketio
+
+from ac2.metadata import Metadata
+
+PORT = 18925
+
+SERVER = r'''
+import sys
+
+from gevent import monkey
+monkey.patch_all()
+from gevent.pywsgi import WSGIServer
+
+from ac2.metadata import update_web_snapshot
+from ac2.webserver import AudioControlWebserver
+from ac2.socketio import SocketioAPI
+from ac2.dev.benchmark_socketio import enrichment_sequence
+
+ws = AudioControlWebserver()
+api = SocketioAPI(ws.bottle, None)
+updates = enrichment_sequence(int(sys.argv[2]))
+
+
+def step(number):
+    update_web_snapshot(updates[number])
+    api.metadata_handler.notify(updates[number])
+    return "ok"
+
+
+ws.bottle.route("/bench/step/<number:int>", method="POST", callback=step)
+
+WSGIServer(("127.0.0.1", int(sys.argv[1])), api.app, log=None) \
+    .serve_forever()
+'''
+
+WIKI = "The album was recorded in a small studio over a couple of weeks " \
+    "and became one of the best known records of the band. " * 8
+
+
+def enrichment_sequence(songs):
+    """
+    Metadata notifications for the given number of songs
+    """
+    updates = []
+    for i in range(songs):
+        md = Metadata("Artist {}".format(i), "Title {}".format(i),
+                      "Album {}".format(i // 10))
+        md.playerName = "ShairportSync"
+        md.playerState = "playing"
+        md.duration = 240
+        md.positionupdate = 1600000000 + i * 240
+        steps = [
+            {},
+            {"externalArtUrl": "http://coverartarchive.org/release/"
+             "c5ba4e4a-ec08-4b5c-bd4b-1fbc4b0c7e6c/front-500.jpg"},
+            {"localArtUrl": "artwork/cache/3f2a9c0de1b84e5f"},
+            {"mbid": "4a2f8b1e-6c0d-4f0e-9b7d-1c2a3e4f5a6b",
+             "artistmbid": "7e84f845-ac16-41fe-9ff8-df12eb32af55",
+             "albummbid": "c5ba4e4a-ec08-4b5c-bd4b-1fbc4b0c7e6c"},
+            {"tags": ["rock", "alternative", "indie", "90s", "britpop"]},
+            {"wiki": WIKI},
+            {"releaseDate": "1997-05-21"},
+            {"loveSupported": True, "loved": False, "playCount": 12},
+            {"position": 120},
+        ]
+        for changes in steps:
+            for (attrib, value) in changes.items():
+                setattr(md, attrib, value)
+            updates.append(copy.copy(md))
+    return updates
+
+
+def start_server(songs):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.getcwd()] + [p for p in [env.get("PYTHONPATH")] if p])
+    server = subprocess.Popen([sys.executable, "-c", SERVER,
+                               str(PORT), str(songs)],
+                              env=env,
+                              stderr=subprocess.DEVNULL)
+    for _i in range(100):
+        try:
+            requests.get("http://127.0.0.1:{}/api/track/metadata"
+                         .format(PORT), timeout=1)
+            return server
+        except requests.ConnectionError:
+            sleep(0.1)
+    server.kill()
+    raise IOError("webserver did not start")
+
+
+class CountingClient():
+
+    def __init__(self, use_delta):
+        self.bytes = 0
+        self.events = 0
+        self.resyncs = 0
+        self.version = None
+        self.metadata = None
+        self.received = threading.Event()
+
+        session = requests.Session()
+        session.hooks["response"].append(self.count)
+        self.sio = socketio.Client(http_session=session)
+        if use_delta:
+            self.sio.on("delta", self.delta, namespace="/metadata")
+        else:
+            self.sio.on("update", self.update, namespace="/metadata")
+        self.sio.connect("http://127.0.0.1:{}".format(PORT),
+                         transports=["polling"], namespaces=["/metadata"])
+        if use_delta:
+            self.full(self.sio.call("delta", namespace="/metadata"))
+        else:
+            self.update(self.sio.call("get", namespace="/metadata"))
+
+    def count(self, response, *_args, **_kwargs):
+        self.bytes += len(response.content)
+
+    def update(self, metadata):
+        self.metadata = metadata
+        self.events += 1
+        self.received.set()
+
+    def full(self, versioned):
+        self.version = versioned["version"]
+        self.metadata = versioned["metadata"]
+
+    def delta(self, delta):
+        if delta["base"] != self.version:
+            self.resyncs += 1
+            self.full(self.sio.call("get", namespace="/metadata"))
+        else:
+            self.metadata.update(delta["changes"])
+            self.version = delta["version"]
+        self.events += 1
+        self.received.set()
+
+
+def main():
+    songs = 20
+    if len(sys.argv) > 1:
+        songs = int(sys.argv[1])
+
+    updates = enrichment_sequence(songs)
+    server = start_server(songs)
+    try:
+        clients = {"full": CountingClient(False),
+                   "delta": CountingClient(True)}
+        sleep(0.5)
+        for client in clients.values():
+            client.bytes = 0
+            client.events = 0
+
+        for number in range(len(updates)):
+            for client in clients.values():
+                client.received.clear()
+            requests.post("http://127.0.0.1:{}/bench/step/{}"
+                          .format(PORT, number))
+            for client in clients.values():
+                client.received.wait(5)
+
+        for client in clients.values():
+            client.sio.disconnect()
+
+        assert clients["full"].metadata == clients["delta"].metadata
+        for (mode, client) in clients.items():
+            print("{:6} {:7.0f} bytes/song, {} events, {} resyncs".format(
+                mode, client.bytes / songs, client.events, client.resyncs))
+    finally:
+        server.kill()
+
+
+if __name__ == "__main__":
+    main()
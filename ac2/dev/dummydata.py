@@ -22,7 +22,7 @@ SOFTWARE.
 
 from time import sleep
 from threading import Thread
-from ac2.metadata import Metadata
+from ac2.metadata import Metadata, update_web_snapshot
 
 
 class DummyMetadataCreator(Thread):
@@ -74,6 +74,8 @@ class DummyMetadataCreator(Thread):
                           playerName="dummy",
                           playerState=states[stateindex])
             if self.display is not None:
+                # like the controller does before notifying displays
+                update_web_snapshot(md)
                 self.display.notify(md)
 
             sleep(self.interval)
@@ -0,0 +1,215 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import os
+import re
+import struct
+import threading
+import zlib
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def jpeg_image(width, height, size, exif_size=0, sof=0xC0):
+    """
+    JPEG header with random scan data. exif_size bytes of APP1 segments
+    are inserted in front of the frame header. sof is the start of frame
+    marker, e.g. 0xC2 for progressive JPEGs.
+    """
+    data = b'\xff\xd8'
+    data += b'\xff\xe0' + struct.pack(">H", 16) + b'JFIF\x00\x01\x01' + \
+        b'\x00' * 7
+    while exif_size > 0:
+        length = min(exif_size, 65533)
+        data += b'\xff\xe1' + struct.pack(">H", length + 2) + \
+            b'\x00' * length
+        exif_size -= length
+    # Huffman table (C4) and fill bytes before the frame header
+    data += b'\xff\xc4' + struct.pack(">H", 21) + b'\x00' * 19
+    data += b'\xff\xff'
+    data += bytes([0xFF, sof]) + \
+        struct.pack(">HBHHB", 17, 8, height, width, 3) + \
+        b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    data += b'\xff\xda' + struct.pack(">H", 12) + b'\x03\x01\x00\x02\x11' + \
+        b'\x03\x11\x00\x3f\x00'
+    return data + os.urandom(max(size - len(data) - 2, 0)) + b'\xff\xd9'
+
+
+def png_image(width, height, size):
+    ihdr = struct.pack(">LLBBBBB", width, height, 8, 2, 0, 0, 0)
+    data = b'\211PNG\r\n\032\n' + chunk(b'IHDR', ihdr)
+    return data + chunk(b'IDAT', os.urandom(max(size - len(data) - 24, 0))) \
+        + chunk(b'IEND', b'')
+
+
+def chunk(chunk_type, data):
+    return struct.pack(">L", len(data)) + chunk_type + data + \
+        struct.pack(">L", zlib.crc32(chunk_type + data))
+
+
+def gif_image(width, height, size):
+    data = b'GIF89a' + struct.pack("<HH", width, height) + b'\x00\x00\x00'
+    return data + os.urandom(max(size - len(data) - 1, 0)) + b'\x3b'
+
+
+def webp_image(width, height, size, kind="VP8 "):
+    """
+    WebP with a lossy (VP8), lossless (VP8L) or extended (VP8X) header
+    """
+    if kind == "VP8 ":
+        header = b'\x00\x00\x00\x9d\x01\x2a' + \
+            struct.pack("<HH", width, height)
+    elif kind == "VP8L":
+        header = b'\x2f' + struct.pack(
+            "<L", (width - 1) | ((height - 1) << 14))
+    else:
+        header = b'\x10\x00\x00\x00' + (width - 1).to_bytes(3, "little") + \
+            (height - 1).to_bytes(3, "little")
+    body = os.urandom(max(size - len(header) - 20, 0))
+    data = kind.encode() + struct.pack("<L", len(header) + len(body)) + \
+        header + body
+    return b'RIFF' + struct.pack("<L", len(data) + 4) + b'WEBP' + data
+
+
+def box(box_type, payload, version=None):
+    if version is not None:
+        # full box, flags are always 0
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack(">L", len(payload) + 8) + box_type + payload
+
+
+def avif_image(width, height, size):
+    """
+    AVIF with a thumbnail in front of the primary image
+    """
+    ftyp = box(b'ftyp', b'avif' + b'\x00' * 4 + b'avifmif1miaf')
+    hdlr = box(b'hdlr', b'\x00' * 4 + b'pict' + b'\x00' * 13, version=0)
+    pitm = box(b'pitm', struct.pack(">H", 1), version=0)
+    ipco = box(b'ipco',
+               box(b'ispe', struct.pack(">LL", 160, 160), version=0) +
+               box(b'pixi', b'\x03\x08\x08\x08', version=0) +
+               box(b'ispe', struct.pack(">LL", width, height), version=0))
+    # item 2 (thumbnail): ispe 1, item 1: pixi 2, ispe 3
+    ipma = box(b'ipma', struct.pack(">LHBBHBBB", 2, 2, 1, 0x81,
+                                    1, 2, 0x82, 0x83), version=0)
+    meta = box(b'meta', hdlr + pitm + box(b'iprp', ipco + ipma), version=0)
+    data = ftyp + meta
+    return data + box(b'mdat', os.urandom(max(size - len(data) - 8, 0)))
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # client closed the connection before reading everything
+            pass
+
+    def do_GET(self):
+        data = self.server.images.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        with self.server.lock:
+            self.server.requests += 1
+
+        start, end = 0, len(data)
+        match = re.match(r"bytes=(\d+)-(\d*)$",
+                         self.headers.get("Range", ""))
+        if self.server.ranges and match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, len(data))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(
+                    len(data)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                start, end - 1, len(data)))
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", self.server.content_type(self.path))
+        self.send_header("Content-Length", str(end - start))
+        self.end_headers()
+
+        # send in small blocks to see how much the client really reads
+        try:
+            for pos in range(start, end, 16384):
+                block = data[pos:min(pos + 16384, end)]
+                self.wfile.write(block)
+                if self.server.bandwidth:
+                    sleep(len(block) / self.server.bandwidth)
+                with self.server.lock:
+                    self.server.bytes_sent += len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for images that counts the number of bytes sent.
+    Range requests can be disabled to simulate servers that always send
+    the full file. bandwidth (bytes/s) limits the transfer rate.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, images, ranges=True, bandwidth=None):
+        super().__init__(("127.0.0.1", 0), ImageHandler)
+        self.images = images
+        self.ranges = ranges
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:{}{}".format(self.server_port, path)
+
+    def content_type(self, path):
+        return "image/" + path.rsplit(".", 1)[-1]
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
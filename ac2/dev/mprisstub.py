@@ -0,0 +1,163 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import threading
+from time import perf_counter
+
+from ac2.players.mpris import MPRIS_PREFIX, MPRIS_PLAYER_INTERFACE, \
+    PROPERTIES_INTERFACE
+
+
+class ServiceUnknown(Exception):
+    pass
+
+
+class StubPlayer():
+    """
+    A MPRIS player that lives on a StubBus. Changing properties will
+    send a PropertiesChanged signal like a real player would do.
+    """
+
+    def __init__(self, bus, name, unique_name):
+        self.bus = bus
+        self.name = name
+        self.unique_name = unique_name
+        self.commands = []
+        self.properties = {
+            "PlaybackStatus": "Stopped",
+            "Metadata": {"xesam:artist": ["Artist"],
+                         "xesam:title": "Title",
+                         "mpris:trackid": "/track/0"},
+            "Position": 0,
+            "CanPause": True,
+            "CanGoNext": True,
+            "CanGoPrevious": True,
+            "CanPlay": True,
+            "CanSeek": False,
+        }
+
+    def set(self, **changed):
+        self.properties.update(changed)
+        self.bus.emit(self.unique_name,
+                      "PropertiesChanged",
+                      MPRIS_PLAYER_INTERFACE, changed, [])
+
+
+class StubProxy():
+
+    def __init__(self, bus, player):
+        self.bus = bus
+        self.player = player
+
+    def get_dbus_method(self, member, dbus_interface=None):
+
+        def method(*args):
+            self.bus.round_trip(member)
+            if self.player.name not in self.bus.players:
+                raise ServiceUnknown(self.player.name)
+
+            if dbus_interface == PROPERTIES_INTERFACE:
+                if member == "Get":
+                    return self.player.properties[args[1]]
+                elif member == "GetAll":
+                    return dict(self.player.properties)
+            else:
+                self.player.commands.append(member)
+
+        return method
+
+
+class StubBus():
+    """
+    Stand-in for a dbus SystemBus connection that can be used for tests
+    and benchmarks without a running D-Bus daemon. Every method call
+    counts as a round trip and burns call_cost seconds of CPU time.
+    """
+
+    def __init__(self, call_cost=0):
+        self.call_cost = call_cost
+        self.players = {}
+        self.receivers = []
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.next_id = 1
+
+    def add_player(self, name):
+        if not name.startswith(MPRIS_PREFIX):
+            name = MPRIS_PREFIX + name
+        unique_name = ":1.{}".format(self.next_id)
+        self.next_id += 1
+        player = StubPlayer(self, name, unique_name)
+        self.players[name] = player
+        self.emit("org.freedesktop.DBus", "NameOwnerChanged",
+                  name, "", unique_name)
+        return player
+
+    def remove_player(self, name):
+        player = self.players.pop(name)
+        self.emit("org.freedesktop.DBus", "NameOwnerChanged",
+                  name, player.unique_name, "")
+
+    def round_trip(self, member):
+        with self.lock:
+            self.calls[member] = self.calls.get(member, 0) + 1
+        if self.call_cost > 0:
+            end = perf_counter() + self.call_cost
+            while perf_counter() < end:
+                pass
+
+    def round_trips(self):
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls = {}
+
+    def get_object(self, name, _path):
+        # dbus-python introspects new proxy objects
+        self.round_trip("Introspect")
+        player = self.players.get(name)
+        if player is None:
+            raise ServiceUnknown(name)
+        return StubProxy(self, player)
+
+    def list_names(self):
+        self.round_trip("ListNames")
+        return ["org.freedesktop.DBus"] + list(self.players.keys())
+
+    def get_name_owner(self, name):
+        self.round_trip("GetNameOwner")
+        return self.players[name].unique_name
+
+    def add_signal_receiver(self, handler, signal_name=None,
+                            dbus_interface=None, path=None,
+                            sender_keyword=None, **_kwargs):
+        self.receivers.append((handler, signal_name, sender_keyword))
+
+    def emit(self, sender, signal_name, *args):
+        for (handler, name, sender_keyword) in self.receivers:
+            if name != signal_name:
+                continue
+            if sender_keyword is not None:
+                handler(*args, **{sender_keyword: sender})
+            else:
+                handler(*args)
@@ -0,0 +1,194 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import json
+import logging
+import threading
+from collections import deque
+from time import monotonic
+
+# Seconds between heartbeats on an idle event stream
+HEARTBEAT = 15
+
+# Maximum time a long-poll request waits for a change
+LONGPOLL_TIMEOUT = 30
+
+
+class Event():
+
+    __slots__ = ["id", "type", "data"]
+
+    def __init__(self, event_id, event_type, data):
+        self.id = event_id
+        self.type = event_type
+        # JSON
+        self.data = data
+
+    def sse(self):
+        """
+        Server-Sent Events format
+        """
+        return "id: {}\nevent: {}\ndata: {}\n\n".format(self.id,
+                                                        self.type,
+                                                        self.data)
+
+
+class EventBroker():
+    """
+    Distributes state changes to any number of subscribers.
+
+    Subscribers don't have their own queues. Every event gets the next
+    id and is kept in a short history, a subscriber only remembers the
+    id of the last event it has seen. Publishing wakes up all waiting
+    subscribers, each of them then takes the events after its id.
+
+    A subscriber that fell behind the history (or knows ids from before
+    a restart) gets the current state of every event type instead.
+    """
+
+    def __init__(self, history=100):
+        self.condition = threading.Condition()
+        self.history = deque(maxlen=history)
+        self.latest = {}
+        self.last_id = 0
+        self.subscribers = 0
+        self.published = 0
+        self.unchanged = 0
+
+    def publish(self, event_type, data):
+        """
+        Publish data of the given type. data can be anything that can be
+        serialized to JSON or a string that is JSON already. Returns the
+        event or None if nothing changed since the last event of this
+        type.
+        """
+        if not isinstance(data, str):
+            data = json.dumps(data, separators=(",", ":"))
+
+        with self.condition:
+            latest = self.latest.get(event_type)
+            if latest is not None and latest.data == data:
+                self.unchanged += 1
+                return None
+
+            self.last_id += 1
+            event = Event(self.last_id, event_type, data)
+            self.history.append(event)
+            self.latest[event_type] = event
+            self.published += 1
+            self.condition.notify_all()
+
+        logging.debug("published %s event %s", event_type, event.id)
+        return event
+
+    def current(self):
+        """
+        The latest event of every type
+        """
+        with self.condition:
+            return self._current()
+
+    def events_after(self, last_id):
+        with self.condition:
+            return self._events_after(last_id)
+
+    def _events_after(self, last_id):
+        if last_id is None or last_id > self.last_id:
+            return self._current()
+
+        if last_id == self.last_id:
+            return []
+
+        if len(self.history) == 0 or self.history[0].id > last_id + 1:
+            # missed events that aren't in the history anymore
+            return self._current()
+
+        return [e for e in self.history if e.id > last_id]
+
+    def _current(self):
+        return sorted(self.latest.values(), key=lambda e: e.id)
+
+    def wait_for(self, predicate, timeout):
+        """
+        Waits until predicate() is true, it's checked after every event
+        """
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+    def subscribe(self, last_id=None, heartbeat=HEARTBEAT):
+        """
+        Generator that yields lists of new events. If no event has been
+        published for heartbeat seconds, an empty list is yielded.
+
+        Without last_id, it starts with the current state.
+        """
+        with self.condition:
+            self.subscribers += 1
+            events = self._events_after(last_id)
+            last_id = self.last_id
+        try:
+            while True:
+                yield events
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: last_id != self.last_id, heartbeat)
+                    events = self._events_after(last_id)
+                    last_id = self.last_id
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self.condition:
+            return {"subscribers": self.subscribers,
+                    "last_id": self.last_id,
+                    "published": self.published,
+                    "unchanged": self.unchanged}
+
+
+class SSEStream():
+    """
+    Formats events of a subscription as a text/event-stream
+    """
+
+    def __init__(self, broker, last_id=None, heartbeat=HEARTBEAT,
+                 retry=3000):
+        self.subscription = broker.subscribe(last_id, heartbeat)
+        self.retry = retry
+        self.started = monotonic()
+
+    def __iter__(self):
+        # tells the browser how long to wait before reconnecting
+        yield "retry: {}\n\n".format(self.retry).encode()
+        for events in self.subscription:
+            if len(events) == 0:
+                yield b": heartbeat\n\n"
+            else:
+                yield "".join(e.sse() for e in events).encode()
+
+    def close(self):
+        """
+        Called by the WSGI server when the client disconnected
+        """
+        self.subscription.close()
+        logging.debug("event stream closed after %.0fs",
+                      monotonic() - self.started)
@@ -0,0 +1,190 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import hashlib
+import logging
+import os
+import threading
+
+from bottle import HTTPResponse, request, static_file
+from expiringdict import ExpiringDict
+from gevent.socket import wait_write
+from geventwebsocket.handler import WebSocketHandler
+
+# Content hashes of served files, path: (mtime, size, etag)
+etags = ExpiringDict(max_len=1000, max_age_seconds=86400)
+etags_lock = threading.Lock()
+
+# Responses for URLs that change whenever the content changes
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Clients have to ask if the file is still valid, this is cheap
+REVALIDATE = "no-cache"
+
+BLOCK_SIZE = 65536
+
+sendfile_stats = {"files": 0, "bytes": 0, "fallback": 0}
+
+
+def file_etag(path):
+    """
+    Strong ETag based on the content of the file. It's only computed
+    again if modification time or size of the file changed.
+    """
+    stat = os.stat(path)
+    with etags_lock:
+        cached = etags.get(path)
+    if cached is not None and cached[0] == stat.st_mtime_ns and \
+            cached[1] == stat.st_size:
+        return cached[2]
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    etag = '"{}"'.format(digest.hexdigest()[:16])
+    with etags_lock:
+        etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+    return etag
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Checks an If-None-Match header, weak comparison as required for it
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def serve_file(filename, root, mimetype=None, etag=None,
+               cache_control=REVALIDATE):
+    """
+    bottle's static_file with a content based ETag. If-None-Match and
+    If-Modified-Since are answered with 304 Not Modified.
+
+    static_file handles ETags only since bottle 0.13, they are added
+    to its response here so it works with bottle 0.12 as well.
+    """
+    if mimetype is None:
+        res = static_file(filename, root=root)
+    else:
+        res = static_file(filename, root=root, mimetype=mimetype)
+    if res.status_code >= 400:
+        return res
+
+    if etag is None:
+        path = os.path.abspath(os.path.join(root, filename.strip("/\\")))
+        try:
+            etag = file_etag(path)
+        except OSError:
+            # removed in the meantime
+            return res
+
+    res.set_header("ETag", etag)
+    res.set_header("Cache-Control", cache_control)
+    if res.status_code == 304 or \
+            not etag_matches(request.environ.get("HTTP_IF_NONE_MATCH"), etag):
+        return res
+
+    if hasattr(res.body, "close"):
+        res.body.close()
+    not_modified = HTTPResponse(status=304)
+    for header in ["ETag", "Cache-Control", "Last-Modified", "Date"]:
+        if header in res.headers:
+            not_modified.set_header(header, res.headers[header])
+    return not_modified
+
+
+class FileWrapper():
+    """
+    wsgi.file_wrapper that lets SendfileHandler send the file with
+    os.sendfile. Other servers just iterate over it.
+    """
+
+    def __init__(self, filelike, block_size=BLOCK_SIZE):
+        self.filelike = filelike
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.filelike.read(self.block_size), b"")
+
+    def close(self):
+        self.filelike.close()
+
+
+class SendfileHandler(WebSocketHandler):
+    """
+    gevent WSGI handler that sends files without copying them to user
+    space
+    """
+
+    def get_environ(self):
+        environ = super().get_environ()
+        environ["wsgi.file_wrapper"] = FileWrapper
+        return environ
+
+    def process_result(self):
+        if not isinstance(self.result, FileWrapper) or \
+                self.response_use_chunked or \
+                self.environ.get("wsgi.url_scheme") != "http":
+            return super().process_result()
+
+        try:
+            fd = self.result.filelike.fileno()
+            length = os.fstat(fd).st_size - self.result.filelike.tell()
+        except (AttributeError, OSError, ValueError):
+            sendfile_stats["fallback"] += 1
+            return super().process_result()
+
+        # headers
+        self.write(b"")
+        sent = sendfile(self.socket, fd, self.result.filelike.tell(), length)
+        sendfile_stats["files"] += 1
+        sendfile_stats["bytes"] += sent
+
+
+def sendfile(sock, fd, offset, count):
+    """
+    os.sendfile on a non-blocking gevent socket
+    """
+    out = sock.fileno()
+    sent = 0
+    while sent < count:
+        try:
+            n = os.sendfile(out, fd, offset + sent, count - sent)
+        except BlockingIOError:
+            wait_write(out, timeout=sock.timeout)
+            continue
+        if n == 0:
+            logging.debug("file ended after %s of %s bytes", sent, count)
+            break
+        sent += n
+    return sent
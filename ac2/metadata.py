@@ -21,9 +21,13 @@ SOFTWARE.
 '''
 
 import copy
+import json
+import os
 import threading
 import logging
-from time import time 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import time, monotonic
 
 from expiringdict import ExpiringDict
 
@@ -32,7 +36,11 @@ import ac2.data.lastfm as lastfmdata
 import ac2.data.fanarttv as fanarttv
 import ac2.data.hifiberry as hifiberrydb
 import ac2.data.coverartarchive as coverartarchive
+import ac2.data.artworkstore as artworkstore
 from ac2.data.identities import host_uuid
+from ac2.data.coverarthandler import current_picture_url, \
+    best_picture_size, Coverart, covers
+from ac2.data.cache import DAY
 from ac2.data.guess import guess_order, guess_stream_order, \
     ORDER_ARTIST_TITLE, ORDER_TITLE_ARTIST, ORDER_ARTIST_TITLE
 from ac2.constants import STATE_PLAYING
@@ -40,6 +48,24 @@ from ac2.constants import STATE_PLAYING
 # Use external metadata?
 external_metadata = True
 
+# PersistentCache for enriched metadata, configured in audiocontrol2.py
+persistent_cache = None
+
+# Enriched attributes that are stored in the persistent cache and their TTL
+PERSISTENT_FIELDS = {
+    "mbid": 180 * DAY,
+    "artistmbid": 180 * DAY,
+    "albummbid": 180 * DAY,
+    "releaseDate": 180 * DAY,
+    "tags": 30 * DAY,
+    "wiki": 30 * DAY,
+    "externalArtUrl": 30 * DAY,
+    "hifiberry_cover_found": 30 * DAY,
+}
+# All sources have been queried for this song
+COMPLETE_TTL = 30 * DAY
+ORDER_TTL = 180 * DAY
+
 order_cache = ExpiringDict(max_len=10, max_age_seconds=3600)
 
 class Metadata:
@@ -61,6 +87,8 @@ class Metadata:
         self.albumTitle = albumTitle
         self.artUrl = artUrl
         self.externalArtUrl = None
+        # externalArtUrl in the local artwork store
+        self.localArtUrl = None
         self.discNumber = discNumber
         self.tracknumber = trackNumber
         self.playerName = playerName
@@ -152,6 +180,9 @@ class Metadata:
             if len(data2) > 0:
                 
                 cached_order = order_cache.get(data1+"/"+data2,-1)
+                if cached_order < 0 and persistent_cache is not None:
+                    cached_order = persistent_cache.get("order",
+                                                        data1+"/"+data2, -1)
             
                 if cached_order>=0:
                     order = cached_order
@@ -171,6 +202,11 @@ class Metadata:
                     self.title = data2
 
                 order_cache[data1+"/"+data2] = order
+                if persistent_cache is not None and \
+                        order != cached_order and \
+                        order in [ORDER_ARTIST_TITLE, ORDER_TITLE_ARTIST]:
+                    persistent_cache.put("order", data1+"/"+data2, order,
+                                         ORDER_TTL)
 
 
 
@@ -214,63 +250,471 @@ class Metadata:
                                                 self.albumTitle, self.artUrl)
 
 
-def enrich_metadata(metadata, callback=None):
+def enrich_musicbrainz(metadata):
+    musicbrainz.enrich_metadata(metadata)
+
+
+def enrich_hifiberrydb(metadata):
+    hifiberrydb.enrich_metadata(metadata)
+
+
+def enrich_lastfm(metadata):
+    lastfmdata.enrich_metadata(metadata)
+
+
+def enrich_fanarttv_cover(metadata):
+    # Fanart.TV, but without artist picture
+    fanarttv.enrich_metadata(metadata, allow_artist_picture=False)
+
+
+def enrich_coverartarchive(metadata):
+    coverartarchive.enrich_metadata(metadata)
+
+
+def send_hifiberrydb_update(metadata):
+    hifiberrydb.send_update(metadata)
+
+
+def enrich_fanarttv_artist(metadata):
+    # still no cover? try to get at least an artist picture
+    fanarttv.enrich_metadata(metadata, allow_artist_picture=True)
+
+
+# External sources and the sources they depend on. Sources that don't
+# depend on each other are queried in parallel.
+enrichment_steps = [
+    # only need artist and title
+    ("musicbrainz", enrich_musicbrainz, []),
+    ("last.fm", enrich_lastfm, []),
+    # need MBIDs
+    ("hifiberry db", enrich_hifiberrydb, ["musicbrainz"]),
+    ("fanart.tv", enrich_fanarttv_cover, ["musicbrainz", "last.fm"]),
+    ("coverartarchive", enrich_coverartarchive, ["musicbrainz", "last.fm"]),
+    # need the best cover
+    ("hifiberry db update", send_hifiberrydb_update,
+     ["hifiberry db", "fanart.tv", "coverartarchive"]),
+    ("fanart.tv artist", enrich_fanarttv_artist,
+     ["hifiberry db", "fanart.tv", "coverartarchive"]),
+]
+
+PROVIDER_WORKERS = 4
+
+# Minimal time between two metadata updates of the same song
+NOTIFY_INTERVAL = 0.25
+provider_pool = ThreadPoolExecutor(max_workers=PROVIDER_WORKERS,
+                                   thread_name_prefix="metadata provider")
+
+
+def working_copy(metadata):
+    md = metadata.copy()
+    md.tags = list(metadata.tags)
+    return md
+
+
+def merge_metadata(metadata, base, result, priority, origin):
+    """
+    Merge attributes a source changed on its working copy into metadata.
+    If multiple sources set the same attribute, the source listed first
+    in the enrichment steps wins.
+    """
+    for attrib in result.__dict__:
+        value = result.__dict__[attrib]
+        before = base.__dict__.get(attrib)
+
+        if attrib == "tags":
+            for tag in value:
+                if tag not in metadata.tags:
+                    metadata.tags.append(tag)
+        elif attrib == "externalArtUrl":
+            # the best cover has been selected by best_picture_url
+            if value != before:
+                url = current_picture_url(metadata.songId())
+                metadata.externalArtUrl = url if url is not None else value
+        elif value != before:
+            if metadata.__dict__.get(attrib) == before or \
+                    origin.get(attrib, priority) > priority:
+                metadata.__dict__[attrib] = value
+                origin[attrib] = priority
+
+
+def attribute_values(metadata):
+    values = {}
+    for attrib in metadata.__dict__:
+        value = metadata.__dict__[attrib]
+        if isinstance(value, list):
+            value = list(value)
+        values[attrib] = value
+    return values
+
+
+def changed_attributes(metadata, published):
+    changes = {}
+    for (attrib, value) in attribute_values(metadata).items():
+        if attrib not in published or published[attrib] != value:
+            changes[attrib] = value
+    return changes
+
+
+def load_cached(metadata):
+    """
+    Fill in attributes from the persistent cache. Returns True if all
+    sources have been queried for this song before.
+    """
+    songId = metadata.songId()
+
+    for attrib in PERSISTENT_FIELDS:
+        if metadata.__dict__.get(attrib) in [None, [], False]:
+            value = persistent_cache.get("song", songId + "|" + attrib)
+            if value is not None:
+                metadata.__dict__[attrib] = value
+
+    cover = persistent_cache.get("cover", songId)
+    if cover is None and metadata.albummbid is not None:
+        cover = persistent_cache.get("cover", metadata.albummbid)
+    if cover is not None:
+        (url, width, height) = cover
+        if width * height > 0 and covers.get(songId) is None:
+            # size is known, this doesn't need a HTTP request
+            covers[songId] = Coverart(url, width, height)
+        if metadata.externalArtUrl is None:
+            metadata.externalArtUrl = url
+
+    return persistent_cache.get("complete", songId, False)
+
+
+def store_cached(metadata):
+    songId = metadata.songId()
+
+    for (attrib, ttl) in PERSISTENT_FIELDS.items():
+        value = metadata.__dict__.get(attrib)
+        if value not in [None, [], False]:
+            persistent_cache.put("song", songId + "|" + attrib, value, ttl)
+
+    if metadata.externalArtUrl is not None:
+        (width, height) = best_picture_size(songId)
+        cover = [metadata.externalArtUrl, width, height]
+        ttl = PERSISTENT_FIELDS["externalArtUrl"]
+        persistent_cache.put("cover", songId, cover, ttl)
+        if metadata.albummbid is not None:
+            persistent_cache.put("cover", metadata.albummbid, cover, ttl)
+
+    # Don't skip the sources next time if nothing has been found, they
+    # might just have been unavailable
+    if metadata.mbid is not None or metadata.externalArtUrl is not None:
+        persistent_cache.put("complete", songId, True, COMPLETE_TTL)
+
+
+def store_artwork(metadata):
+    """
+    Download the selected cover to the local artwork store
+    """
+    if metadata.externalArtUrl is None:
+        return
+
+    key = artworkstore.artwork_store.add(metadata.externalArtUrl)
+    if key is not None:
+        metadata.localArtUrl = artworkstore.local_url(key)
+
+
+def enrich_metadata(metadata, callback=None, cancelled=None,
+                    steps=None, notify_interval=NOTIFY_INTERVAL):
     """
     Add more metadata to a song based on the information that are already
     given. These will be retrieved from external sources.
+
+    Every source works on its own copy of the metadata, results are
+    merged when it is finished. Changed attributes are sent to the
+    callback as soon as they are available, but not more often than
+    every notify_interval seconds (only at the end if notify_interval is
+    None). If cancelled() returns True, no more sources will be queried
+    and the callback won't be called anymore.
     """
     songId = metadata.songId()
 
+    if steps is None:
+        steps = enrichment_steps
+
+    published = attribute_values(metadata)
+    last_notify = 0
+    pending = False
+
+    store = artworkstore.artwork_store
+    artwork_url = None
+    download = None
+
+    def update_artwork():
+        """
+        Use the stored cover right away, new covers are downloaded in the
+        background
+        """
+        nonlocal artwork_url, download
+        url = metadata.externalArtUrl
+        if store is None or url is None or url == artwork_url:
+            return
+        artwork_url = url
+        key = store.stored(url)
+        if key is not None:
+            metadata.localArtUrl = artworkstore.local_url(key)
+            download = None
+        else:
+            metadata.localArtUrl = None
+            download = provider_pool.submit(store.add, url)
+
+    def notify():
+        nonlocal last_notify, pending
+        pending = False
+        changes = changed_attributes(metadata, published)
+        if len(changes) > 0:
+            logging.debug("publishing %s for %s", list(changes), songId)
+            callback.update_metadata_attributes(changes, songId)
+            published.update(changes)
+        last_notify = monotonic()
+
     if external_metadata:
 
         metadata.host_uuid = host_uuid()
-        
-        # Try musicbrainzs first
-        try:
-            musicbrainz.enrich_metadata(metadata)
-        except Exception as e:
-            logging.warning("error when retrieving data from musicbrainz")
-            logging.exception(e)
-            
-        # Then HiFiBerry MusicDB
-        try:
-            hifiberrydb.enrich_metadata(metadata)
-        except Exception as e:
-            logging.warning("error when retrieving data from hifiberry db")
-            logging.exception(e)
-
-        # Then Last.FM
-        try:
-            lastfmdata.enrich_metadata(metadata)
-        except Exception as e:
-            logging.warning("error when retrieving data from last.fm")
-            logging.exception(e)
-                
-        # try Fanart.TV, but without artist picture
-        try:
-            fanarttv.enrich_metadata(metadata, allow_artist_picture=False)
-        except Exception as e:
-            logging.exception(e)
-        
-        # try coverartarchive
-        try:
-            coverartarchive.enrich_metadata(metadata)
-        except Exception as e:
-            logging.exception(e)
-            
-        hifiberrydb.send_update(metadata)
-        
-        # still no cover? try to get at least an artist picture
-        try:
-            fanarttv.enrich_metadata(metadata, allow_artist_picture=True)
-        except Exception as e:
-            logging.exception(e)
-    
+
+        # Songs that have been enriched before don't need any network
+        # requests
+        from_cache = False
+        if persistent_cache is not None:
+            try:
+                from_cache = load_cached(metadata)
+            except Exception as e:
+                logging.warning("can't read persistent cache: %s", e)
+        if from_cache:
+            logging.debug("found %s in persistent cache", songId)
+            steps = []
+        update_artwork()
+
+        priorities = {}
+        for (priority, (source, _step, _after)) in enumerate(steps):
+            priorities[source] = priority
+        waiting = list(steps)
+        finished = set()
+        running = {}
+        origin = {}
+
+        while len(waiting) > 0 or len(running) > 0 or download is not None:
+            if cancelled is not None and cancelled():
+                logging.debug("stopped enrichment of %s", songId)
+                return False
+
+            for (source, step, after) in list(waiting):
+                if all(s in finished for s in after):
+                    waiting.remove((source, step, after))
+                    base = working_copy(metadata)
+                    work = working_copy(base)
+                    future = provider_pool.submit(step, work)
+                    running[future] = (source, base, work)
+
+            if len(running) == 0 and download is None:
+                logging.error("can't query %s, dependencies not met",
+                              [s[0] for s in waiting])
+                break
+
+            # Updates that are held back have to be sent when the
+            # notify interval is over
+            timeout = None
+            if callback is not None and pending and \
+                    notify_interval is not None:
+                timeout = max(last_notify + notify_interval - monotonic(), 0)
+
+            futures = list(running.keys())
+            if download is not None:
+                futures.append(download)
+            (done, _not_done) = wait(futures, timeout=timeout,
+                                     return_when=FIRST_COMPLETED)
+
+            if download in done:
+                try:
+                    key = download.result()
+                    if key is not None:
+                        metadata.localArtUrl = artworkstore.local_url(key)
+                        pending = True
+                except Exception as e:
+                    logging.warning("can't store artwork: %s", e)
+                download = None
+
+            for future in sorted([f for f in done if f in running],
+                                 key=lambda f: priorities[running[f][0]]):
+                (source, base, work) = running.pop(future)
+                finished.add(source)
+                try:
+                    future.result()
+                    merge_metadata(metadata, base, work,
+                                   priorities[source], origin)
+                    pending = True
+                except Exception as e:
+                    logging.warning("error when retrieving data from %s",
+                                    source)
+                    logging.exception(e)
+            update_artwork()
+
+            if callback is not None and pending and \
+                    notify_interval is not None and \
+                    monotonic() >= last_notify + notify_interval:
+                notify()
+
+        if persistent_cache is not None and not from_cache:
+            try:
+                store_cached(metadata)
+            except Exception as e:
+                logging.warning("can't write persistent cache: %s", e)
+
     if callback is not None:
-        callback.update_metadata_attributes(metadata.__dict__, songId)
+        notify()
 
- 
-def enrich_metadata_bg(metadata, callback):
-    md = metadata.copy()
-    threading.Thread(target=enrich_metadata, args=(md, callback)).start()
+    return True
+
+
+class EnrichmentExecutor():
+    """
+    Runs metadata enrichment on a fixed number of worker threads.
+
+    Only the latest song matters: queued jobs of older songs are dropped
+    when a new song is submitted and running jobs of older songs stop
+    between two sources.
+    """
+
+    def __init__(self, workers=2, steps=None):
+        self.workers = workers
+        self.steps = steps
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.threads = []
+        self.latest = None
+        self.active = 0
+        self.submitted = 0
+        self.completed = 0
+        self.dropped = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+
+    def submit(self, metadata, callback):
+        md = metadata.copy()
+        songId = md.songId()
+        with self.condition:
+            self.latest = songId
+            self.submitted += 1
+
+            for job in list(self.queue):
+                if job[0].songId() != songId:
+                    self.queue.remove(job)
+                    self.dropped += 1
+
+            self.queue.append((md, callback))
+            self.max_queue_depth = max(self.max_queue_depth,
+                                       len(self.queue))
+
+            if len(self.threads) < self.workers and \
+                    len(self.queue) > len(self.threads) - self.active:
+                thread = threading.Thread(target=self.work,
+                                          name="metadata enrichment",
+                                          daemon=True)
+                self.threads.append(thread)
+                thread.start()
+
+            self.condition.notify()
+
+    def superseded(self, songId):
+        return songId != self.latest
+
+    def work(self):
+        while True:
+            with self.condition:
+                while len(self.queue) == 0:
+                    self.condition.wait()
+                (md, callback) = self.queue.popleft()
+                self.active += 1
+
+            songId = md.songId()
+            try:
+                finished = enrich_metadata(
+                    md, callback,
+                    cancelled=lambda: self.superseded(songId),
+                    steps=self.steps)
+            except Exception as e:
+                logging.exception(e)
+                finished = True
+
+            with self.condition:
+                self.active -= 1
+                if finished:
+                    self.completed += 1
+                else:
+                    self.cancelled += 1
 
+    def stats(self):
+        with self.condition:
+            return {
+                "workers": len(self.threads),
+                "active": self.active,
+                "queue_depth": len(self.queue),
+                "max_queue_depth": self.max_queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "dropped": self.dropped,
+                "cancelled": self.cancelled,
+            }
+
+
+enrichment_executor = EnrichmentExecutor()
+
+
+class MetadataSnapshot():
+    """
+    Attribute values of a song at one point in time, serialized to JSON
+    only once. Don't modify a snapshot, create a new one.
+    """
+
+    __slots__ = ["version", "values", "json", "etag"]
+
+    def __init__(self, values, version, epoch=""):
+        self.version = version
+        self.values = values
+        self.json = json.dumps(values, skipkeys=True,
+                               separators=(",", ":"))
+        # versions start at 1 again after a restart
+        self.etag = '"{}{}"'.format(epoch, version)
+
+
+class MetadataSnapshots():
+    """
+    Creates snapshots of the current metadata. Every change gets a new,
+    higher version. Consumers that are notified about the same change
+    share its snapshot, it's serialized only once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.epoch = os.urandom(4).hex() + "-"
+        self.version = 0
+        self.current = None
+
+    def update(self, metadata):
+        values = attribute_values(metadata)
+        with self.lock:
+            if self.current is None or self.current.values != values:
+                self.version += 1
+                self.current = MetadataSnapshot(values, self.version,
+                                                self.epoch)
+            return self.current
+
+
+# Metadata sent to web clients (REST API and Socket.IO)
+web_snapshots = MetadataSnapshots()
+
+
+def update_web_snapshot(metadata):
+    """
+    Called once per change by the controller. The REST API and Socket.IO
+    send web_snapshots.current, so they agree on the version.
+    """
+    metadata = copy.copy(metadata)
+    artworkstore.use_local_artwork(metadata)
+    return web_snapshots.update(metadata)
+
+
+def enrich_metadata_bg(metadata, callback):
+    enrichment_executor.submit(metadata, callback)
@@ -22,6 +22,13 @@ SOFTWARE.
 
 import dbus
 import logging
+import threading
+from collections import deque
+from time import time
+
+import gevent
+from gevent import monkey
+
 from ac2.metadata import Metadata
 
 from ac2.constants import CMD_NEXT, CMD_PAUSE, CMD_PLAY, CMD_PLAYPAUSE, CMD_PREV, CMD_STOP
@@ -33,28 +40,361 @@ mpris_commands = [CMD_NEXT, CMD_PREV,
 
 
 MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+MPRIS_PATH = "/org/mpris/MediaPlayer2"
+MPRIS_PLAYER_INTERFACE = "org.mpris.MediaPlayer2.Player"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+DBUS_NAME = "org.freedesktop.DBus"
+DBUS_PATH = "/org/freedesktop/DBus"
+
+# Capabilities that map to supported commands
+MPRIS_CAPABILITIES = {
+    "pause": "CanPause",
+    "next": "CanGoNext",
+    "previous": "CanGoPrevious",
+    "play": "CanPlay",
+    "seek": "CanSeek"
+}
+
+
+class SignalDispatcher():
+    """
+    D-Bus signals are received by a GLib main loop on a native thread.
+    Their handlers must not run there: gevent's monkey patching turns
+    locks and events into gevent objects that can't be used from a
+    foreign thread. The handlers are queued and run in a greenlet,
+    the gevent hub is woken up by an async watcher, which is thread-safe.
+    """
+
+    def __init__(self):
+        self.pending = deque()
+        self.watcher = gevent.get_hub().loop.async_()
+        self.watcher.start(self.schedule)
+
+    def wrap(self, handler):
+
+        def queue(*args, **kwargs):
+            self.pending.append((handler, args, kwargs))
+            self.watcher.send()
+
+        return queue
+
+    def schedule(self):
+        # the watcher callback runs in the hub, which must not block
+        gevent.spawn(self.run_pending)
+
+    def run_pending(self):
+        while len(self.pending) > 0:
+            (handler, args, kwargs) = self.pending.popleft()
+            try:
+                handler(*args, **kwargs)
+            except Exception as e:
+                logging.warning("D-Bus signal handler %s failed: %s",
+                                handler, e)
+
+
+def start_native_thread(target):
+    """
+    Starts a thread that is a real thread also if threading has been
+    monkey patched by gevent. Use it for code that blocks in C and never
+    yields to the gevent hub.
+    """
+    start_new_thread = monkey.get_original("_thread", "start_new_thread")
+    return start_new_thread(target, ())
+
+
+class PlayerSnapshot():
+    """
+    State, metadata, position and capabilities of a MPRIS player at a
+    given time
+    """
+
+    def __init__(self, state=None, metadata=None, position=0,
+                 supported_commands=[]):
+        self.state = state
+        self.metadata = metadata
+        self.position = position  # position in seconds, None if unknown
+        self.supported_commands = supported_commands
+
+    def __str__(self):
+        return "{} {} ({}s)".format(self.state, self.metadata, self.position)
 
 
 class MPRIS():
     
     def __init__(self):
         self.bus=None
+        # Proxy objects are cached per bus name, they are invalidated when
+        # the owner of the name changes or a call fails
+        self.device_prop_interfaces = {}
+        self.player_interfaces = {}
+        # Signal mode: properties are pushed by PropertiesChanged and
+        # cached locally, D-Bus Get calls are only used to seed the cache
+        # and as a safety net once a cached value is older than max_cache_age
+        self.use_signals = False
+        self.max_cache_age = 30
+        self.properties = {}
+        self.owners = {}
+        # Registry of MPRIS bus names, maintained from NameOwnerChanged
+        # signals once the listener has been started
+        self.player_names = None
+        self.cache_lock = threading.Lock()
+        self.listeners = []
+        self.dispatcher = None
            
     def connect_dbus(self):
         self.bus = dbus.SystemBus()
+        self.invalidate_all()
+
+    def start_listener(self, properties=True):
+        """
+        Listen to D-Bus signals. This needs a GLib main loop that dispatches
+        the signals, it will be started on a native thread.
+        NameOwnerChanged keeps the registry of players up to date, with
+        properties=True PropertiesChanged signals are used as well and
+        MPRIS is switched to signal mode.
+        Returns False if signals are not available on this system.
+        """
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop, threads_init
+            from gi.repository import GLib
+        except ImportError as e:
+            logging.warning("can't use D-Bus signals (%s), polling MPRIS players", e)
+            return False
+
+        threads_init()
+        # Signals are only dispatched on a connection that has been created
+        # with a main loop, therefore a new connection is needed here
+        self.bus = dbus.SystemBus(mainloop=DBusGMainLoop(), private=True)
+        self.invalidate_all()
+        self.dispatcher = SignalDispatcher()
+        self.subscribe_signals(properties)
+
+        # GLib.MainLoop.run blocks and would stall all greenlets
+        start_native_thread(GLib.MainLoop().run)
+        if properties:
+            logging.info("listening to MPRIS PropertiesChanged signals")
+        else:
+            logging.info("listening to D-Bus NameOwnerChanged signals")
+        return True
+
+    def subscribe_signals(self, properties=True):
+        properties_changed = self.properties_changed
+        name_owner_changed = self.name_owner_changed
+        if self.dispatcher is not None:
+            properties_changed = self.dispatcher.wrap(properties_changed)
+            name_owner_changed = self.dispatcher.wrap(name_owner_changed)
+
+        if properties:
+            self.bus.add_signal_receiver(properties_changed,
+                                         signal_name="PropertiesChanged",
+                                         dbus_interface=PROPERTIES_INTERFACE,
+                                         path=MPRIS_PATH,
+                                         sender_keyword="sender")
+            self.use_signals = True
+        self.bus.add_signal_receiver(name_owner_changed,
+                                     signal_name="NameOwnerChanged",
+                                     dbus_interface=DBUS_NAME,
+                                     path=DBUS_PATH)
+
+        # Seed the registry once, it's updated by NameOwnerChanged
+        self.player_names = dict.fromkeys(
+            [name for name in self.bus.list_names()
+             if name.startswith("org.mpris")])
+
+    def add_listener(self, listener):
+        """
+        Register a function that will be called without arguments whenever
+        a player pushed a property change
+        """
+        self.listeners.append(listener)
+
+    def properties_changed(self, interface, changed, invalidated, sender=None):
+        if interface != MPRIS_PLAYER_INTERFACE:
+            return
+
+        name = self.owners.get(sender)
+        if name is None:
+            # Not polled yet, the cache will be seeded on the first poll
+            return
+
+        now = time()
+        with self.cache_lock:
+            props = self.properties.setdefault(name, {})
+            for prop in changed:
+                props[prop] = (changed[prop], now)
+            for prop in invalidated:
+                props.pop(prop, None)
+
+        logging.debug("%s changed %s", name, list(changed.keys()))
+        self.notify_listeners()
+
+    def notify_listeners(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                logging.warning("MPRIS listener %s failed: %s", listener, e)
+
+    def name_owner_changed(self, name, old_owner, new_owner):
+        if not name.startswith("org.mpris"):
+            return
+
+        logging.debug("owner of %s changed from %s to %s",
+                      name, old_owner, new_owner)
+        self.invalidate(name)
+        self.owners.pop(old_owner, None)
+        if new_owner:
+            self.owners[new_owner] = name
+
+        if self.player_names is not None:
+            if new_owner:
+                if name not in self.player_names:
+                    logging.info("MPRIS player %s appeared", name)
+                self.player_names[name] = None
+            else:
+                logging.info("MPRIS player %s disappeared", name)
+                self.player_names.pop(name, None)
+
+        self.notify_listeners()
+
+    def invalidate(self, name):
+        """
+        Forget everything cached for a bus name
+        """
+        self.device_prop_interfaces.pop(name, None)
+        self.player_interfaces.pop(name, None)
+        with self.cache_lock:
+            self.properties.pop(name, None)
+
+    def invalidate_all(self):
         self.device_prop_interfaces = {}
+        self.player_interfaces = {}
+        with self.cache_lock:
+            self.properties = {}
+
+    def get_property(self, name, prop):
+        """
+        Get a property of the MPRIS player interface. In signal mode, the
+        cached value is used if it's not older than max_cache_age
+        """
+        if self.use_signals:
+            with self.cache_lock:
+                (value, updated) = self.properties.get(name, {}).get(prop, (None, 0))
+            if updated > time() - self.max_cache_age:
+                return value
+
+        device_prop = self.dbus_get_device_prop_interface(name)
+        try:
+            value = device_prop.Get(MPRIS_PLAYER_INTERFACE, prop)
+        except Exception:
+            # The cached proxy might point to a player that is gone
+            self.invalidate(name)
+            raise
+
+        if self.use_signals:
+            # Signals are sent from the unique name of the player, which
+            # changes when the player is restarted
+            self.owners[self.bus.get_name_owner(name)] = name
+            with self.cache_lock:
+                self.properties.setdefault(name, {})[prop] = (value, time())
+
+        return value
+
+    def get_all_properties(self, name):
+        """
+        Get all properties of the MPRIS player interface with a single
+        GetAll call. In signal mode, the cache is used as long as state and
+        metadata are not older than max_cache_age.
+        Returns a dict of property: (value, timestamp)
+        """
+        if self.use_signals:
+            with self.cache_lock:
+                props = dict(self.properties.get(name, {}))
+            oldest = min([props.get(prop, (None, 0))[1]
+                          for prop in ["PlaybackStatus", "Metadata"]])
+            if oldest > time() - self.max_cache_age:
+                return props
+
+        device_prop = self.dbus_get_device_prop_interface(name)
+        try:
+            values = device_prop.GetAll(MPRIS_PLAYER_INTERFACE)
+        except Exception:
+            self.invalidate(name)
+            raise
+
+        now = time()
+        props = {}
+        for prop in values:
+            props[prop] = (values[prop], now)
+
+        if self.use_signals:
+            self.owners[self.bus.get_name_owner(name)] = name
+            with self.cache_lock:
+                self.properties[name] = dict(props)
+
+        return props
+
+    def snapshot(self, name):
+        """
+        Returns a PlayerSnapshot or None if the player can't be reached
+        """
+        try:
+            props = self.get_all_properties(name)
+        except Exception as e:
+            logging.warning("got exception %s while polling MPRIS data", e)
+            return None
+
+        (state, _updated) = props.get("PlaybackStatus", (None, 0))
+
+        (prop, _updated) = props.get("Metadata", ({}, 0))
+        md = self.metadata_from_properties(name, prop)
+        if state is not None:
+            md.playerState = str(state).lower()
+
+        # Position is not signalled, it has to be extrapolated. Players
+        # that don't report it keep the defaults of the metadata.
+        position = None
+        if "Position" in props:
+            (position, updated) = props["Position"]
+            md.set_position(position / 1000000)
+            md.positionupdate = updated
+            position = md.get_position()
+
+        supported_commands = ["stop"]  # Stop must always be supported
+        for command in MPRIS_CAPABILITIES:
+            (supported, _updated) = props.get(MPRIS_CAPABILITIES[command],
+                                              (False, 0))
+            if supported:
+                supported_commands.append(command)
+
+        return PlayerSnapshot(state, md, position, supported_commands)
 
     def dbus_get_device_prop_interface(self, name):
-        proxy = self.bus.get_object(name, "/org/mpris/MediaPlayer2")
-        device_prop = dbus.Interface(
-            proxy, "org.freedesktop.DBus.Properties")
+        device_prop = self.device_prop_interfaces.get(name)
+        if device_prop is None:
+            proxy = self.bus.get_object(name, MPRIS_PATH)
+            device_prop = dbus.Interface(
+                proxy, PROPERTIES_INTERFACE)
+            self.device_prop_interfaces[name] = device_prop
         return device_prop
+
+    def dbus_get_player_interface(self, name):
+        player = self.player_interfaces.get(name)
+        if player is None:
+            proxy = self.bus.get_object(name, MPRIS_PATH)
+            player = dbus.Interface(
+                proxy, dbus_interface=MPRIS_PLAYER_INTERFACE)
+            self.player_interfaces[name] = player
+        return player
     
     def retrieve_players(self):
         """
         Returns a list of all MPRIS enabled players that are active in
         the system
         """
+        if self.player_names is not None:
+            return list(self.player_names)
+
         return [name for name in self.bus.list_names()
                 if name.startswith("org.mpris")]
         
@@ -62,29 +402,18 @@ class MPRIS():
     def retrieve_state(self, name):
     # This must be an MPRIS player
         try:
-            device_prop = self.dbus_get_device_prop_interface(name)
-            state = device_prop.Get("org.mpris.MediaPlayer2.Player",
-                                    "PlaybackStatus")
-            return state
+            return self.get_property(name, "PlaybackStatus")
         except Exception as e:
             logging.warning("got exception %s while polling MPRIS data", e)
             
             
     
     def get_supported_commands(self, name):
-        commands = {
-            "pause": "CanPause",
-            "next": "CanGoNext",
-            "previous": "CanGoPrevious",
-            "play": "CanPlay",
-            "seek": "CanSeek"
-        }
+        commands = MPRIS_CAPABILITIES
         try:
             supported_commands = ["stop"]  # Stop must always be supported
-            device_prop = self.dbus_get_device_prop_interface(name)
             for command in commands:
-                supported = device_prop.Get("org.mpris.MediaPlayer2.Player",
-                                            commands[command])
+                supported = self.get_property(name, commands[command])
                 if supported:
                     supported_commands.append(command)
         except Exception as e:
@@ -102,10 +431,7 @@ class MPRIS():
             
         try:
             if command in mpris_commands:
-                proxy = self.bus.get_object(playername,
-                                            "/org/mpris/MediaPlayer2")
-                player = dbus.Interface(
-                    proxy, dbus_interface='org.mpris.MediaPlayer2.Player')
+                player = self.dbus_get_player_interface(playername)
 
                 run_command = getattr(player, command,
                                       lambda: "Unknown command")
@@ -115,6 +441,7 @@ class MPRIS():
         except Exception as e:
             logging.error("exception %s while sending MPRIS command %s to %s",
                           e, command, playername)
+            self.invalidate(playername)
             return False
         
     def playername(self, name):
@@ -131,74 +458,83 @@ class MPRIS():
         Return the metadata for the given player instance
         """
         try:
-            device_prop = self.dbus_get_device_prop_interface(name)
-            prop = device_prop.Get(
-                "org.mpris.MediaPlayer2.Player", "Metadata")
-            try:
-                artist = array_to_string(prop.get("xesam:artist"))
-            except:
-                artist = None
+            prop = self.get_property(name, "Metadata")
+            return self.metadata_from_properties(name, prop)
 
-            try:
-                title = prop.get("xesam:title")
-            except:
-                title = None
+        except dbus.exceptions.DBusException as e:
+            if "ServiceUnknown" in e.__class__.__name__:
+                # unfortunately we can't do anything about this and
+                # logging doesn't help, therefore just ignoring this case
+                pass
+                #  logging.warning("service %s disappered, cleaning up", e)
+            else:
+                logging.warning("no mpris data received %s", e.__class__.__name__)
 
-            try:
-                albumArtist = array_to_string(prop.get("xesam:albumArtist"))
-            except:
-                albumArtist = None
+            md = Metadata()
+            md.playerName = self.playername(name)
+            return md
 
-            try:
-                albumTitle = prop.get("xesam:album")
-            except:
-                albumTitle = None
+    def metadata_from_properties(self, name, prop):
+        """
+        Creates a Metadata object from the MPRIS Metadata property
+        """
+        try:
+            artist = array_to_string(prop.get("xesam:artist"))
+        except:
+            artist = None
 
-            try:
-                artURL = prop.get("mpris:artUrl")
-            except:
-                artURL = None
+        try:
+            title = prop.get("xesam:title")
+        except:
+            title = None
 
-            try:
-                discNumber = prop.get("xesam:discNumber")
-            except:
-                discNumber = None
+        try:
+            albumArtist = array_to_string(prop.get("xesam:albumArtist"))
+        except:
+            albumArtist = None
 
-            try:
-                trackNumber = prop.get("xesam:trackNumber")
-            except:
-                trackNumber = None
+        try:
+            albumTitle = prop.get("xesam:album")
+        except:
+            albumTitle = None
 
-            md = Metadata(artist, title, albumArtist, albumTitle,
-              artURL, discNumber, trackNumber)
+        try:
+            artURL = prop.get("mpris:artUrl")
+        except:
+            artURL = None
 
-            try:
-                md.streamUrl = prop.get("xesam:url")
-            except:
-                pass
+        try:
+            discNumber = prop.get("xesam:discNumber")
+        except:
+            discNumber = None
 
-            try:
-                md.trackId = prop.get("mpris:trackid")
-            except:
-                pass
+        try:
+            trackNumber = prop.get("xesam:trackNumber")
+        except:
+            trackNumber = None
 
+        md = Metadata(artist, title, albumArtist, albumTitle,
+          artURL, discNumber, trackNumber)
 
-            if (name.startswith(MPRIS_PREFIX)):
-                md.playerName = name[len(MPRIS_PREFIX):]
-            else:
-                md.playerName = name
+        try:
+            md.streamUrl = prop.get("xesam:url")
+        except:
+            pass
 
-            return md
+        try:
+            md.trackId = prop.get("mpris:trackid")
+        except:
+            pass
 
-        except dbus.exceptions.DBusException as e:
-            if "ServiceUnknown" in e.__class__.__name__:
-                # unfortunately we can't do anything about this and
-                # logging doesn't help, therefore just ignoring this case
-                pass
-                #  logging.warning("service %s disappered, cleaning up", e)
-            else:
-                logging.warning("no mpris data received %s", e.__class__.__name__)
+        try:
+            # length is given in microseconds
+            md.duration = int(prop.get("mpris:length", 0)) / 1000000
+        except:
+            pass
 
-            md = Metadata()
-            md.playerName = self.playername(name)
-            return md
+        if (name.startswith(MPRIS_PREFIX)):
+            md.playerName = name[len(MPRIS_PREFIX):]
+        else:
+            md.playerName = name
+
+        return md
@@ -0,0 +1,259 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import subprocess
+import sys
+import unittest
+
+from ac2.players.mpris import MPRIS
+from ac2.dev.mprisstub import StubBus
+
+
+def create_mpris(bus, use_signals=True):
+    mpris = MPRIS()
+    mpris.bus = bus
+    mpris.subscribe_signals(properties=use_signals)
+    return mpris
+
+
+class TestMPRIS(unittest.TestCase):
+
+    def test_polling(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus, use_signals=False)
+
+        self.assertEqual(mpris.retrieve_state(player.name), "Stopped")
+        player.properties["PlaybackStatus"] = "Playing"
+        self.assertEqual(mpris.retrieve_state(player.name), "Playing")
+        self.assertEqual(bus.calls["Get"], 2)
+
+    def test_signals(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus)
+        notified = []
+        mpris.add_listener(lambda: notified.append(True))
+
+        self.assertEqual(mpris.retrieve_state(player.name), "Stopped")
+        gets = bus.calls["Get"]
+
+        player.set(PlaybackStatus="Playing",
+                   Metadata={"xesam:artist": ["Artist 2"],
+                             "xesam:title": "Title 2"})
+        self.assertEqual(len(notified), 1)
+        self.assertEqual(mpris.retrieve_state(player.name), "Playing")
+        md = mpris.get_meta(player.name)
+        self.assertEqual(md.artist, "Artist 2")
+        self.assertEqual(md.title, "Title 2")
+        self.assertEqual(md.playerName, "test")
+
+        # Everything has been delivered by the signal
+        self.assertEqual(bus.calls["Get"], gets)
+
+    def test_cache_expiry(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus)
+        mpris.max_cache_age = 0
+
+        self.assertEqual(mpris.retrieve_state(player.name), "Stopped")
+        # Property changed without a signal
+        player.properties["PlaybackStatus"] = "Playing"
+        self.assertEqual(mpris.retrieve_state(player.name), "Playing")
+
+    def test_proxy_cache(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus, use_signals=False)
+
+        for _i in range(5):
+            mpris.retrieve_state(player.name)
+            mpris.get_meta(player.name)
+        mpris.send_command(player.name, "Pause")
+        mpris.send_command(player.name, "Play")
+
+        # one properties and one player interface
+        self.assertEqual(bus.calls["Introspect"], 2)
+        self.assertEqual(player.commands, ["Pause", "Play"])
+
+    def test_owner_changed(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus)
+
+        mpris.retrieve_state(player.name)
+        self.assertIn(player.name, mpris.device_prop_interfaces)
+
+        # Player restarts with a new unique name
+        bus.remove_player(player.name)
+        self.assertNotIn(player.name, mpris.device_prop_interfaces)
+        self.assertIsNone(mpris.retrieve_state(player.name))
+
+        player = bus.add_player("test")
+        player.set(PlaybackStatus="Playing")
+        self.assertEqual(mpris.retrieve_state(player.name), "Playing")
+        self.assertEqual(mpris.owners[player.unique_name], player.name)
+
+    def test_snapshot(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        player.properties["PlaybackStatus"] = "Playing"
+        player.properties["Position"] = 30000000
+        player.properties["Metadata"]["mpris:length"] = 200000000
+        mpris = create_mpris(bus, use_signals=False)
+
+        mpris.snapshot(player.name)
+        bus.reset_counters()
+        snapshot = mpris.snapshot(player.name)
+
+        self.assertEqual(bus.round_trips(), 1)
+        self.assertEqual(snapshot.state, "Playing")
+        self.assertEqual(snapshot.metadata.title, "Title")
+        self.assertEqual(snapshot.metadata.duration, 200)
+        self.assertGreaterEqual(snapshot.position, 30)
+        self.assertEqual(snapshot.supported_commands,
+                         ["stop", "pause", "next", "previous", "play"])
+
+    def test_snapshot_without_position(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        player.properties["PlaybackStatus"] = "Playing"
+        del player.properties["Position"]
+        mpris = create_mpris(bus, use_signals=False)
+
+        snapshot = mpris.snapshot(player.name)
+        self.assertIsNone(snapshot.position)
+        md = snapshot.metadata
+        self.assertEqual(md.playerState, "playing")
+        self.assertGreaterEqual(md.get_position(), 0)
+        self.assertLess(md.get_position(), 5)
+
+    def test_snapshot_signals(self):
+        bus = StubBus()
+        player = bus.add_player("test")
+        mpris = create_mpris(bus)
+
+        mpris.snapshot(player.name)
+        player.set(PlaybackStatus="Paused", CanGoNext=False)
+        bus.reset_counters()
+        snapshot = mpris.snapshot(player.name)
+
+        self.assertEqual(bus.round_trips(), 0)
+        self.assertEqual(snapshot.state, "Paused")
+        self.assertNotIn("next", snapshot.supported_commands)
+
+    def test_registry(self):
+        bus = StubBus()
+        bus.add_player("test1")
+        mpris = create_mpris(bus)
+        notified = []
+        mpris.add_listener(lambda: notified.append(True))
+
+        self.assertEqual(mpris.retrieve_players(),
+                         ["org.mpris.MediaPlayer2.test1"])
+        player = bus.add_player("test2")
+        self.assertEqual(len(notified), 1)
+        self.assertEqual(mpris.retrieve_players(),
+                         ["org.mpris.MediaPlayer2.test1",
+                          "org.mpris.MediaPlayer2.test2"])
+        bus.remove_player("org.mpris.MediaPlayer2.test1")
+        self.assertEqual(mpris.retrieve_players(), [player.name])
+        self.assertEqual(bus.calls["ListNames"], 1)
+
+    def test_registry_polling(self):
+        bus = StubBus()
+        player = bus.add_player("test1")
+        mpris = create_mpris(bus, use_signals=False)
+        mpris.retrieve_state(player.name)
+        self.assertIn(player.name, mpris.device_prop_interfaces)
+
+        bus.add_player("test2")
+        self.assertEqual(mpris.retrieve_players(),
+                         ["org.mpris.MediaPlayer2.test1",
+                          "org.mpris.MediaPlayer2.test2"])
+        bus.remove_player(player.name)
+        self.assertEqual(mpris.retrieve_players(),
+                         ["org.mpris.MediaPlayer2.test2"])
+        self.assertNotIn(player.name, mpris.device_prop_interfaces)
+        self.assertEqual(bus.calls["ListNames"], 1)
+        self.assertFalse(mpris.use_signals)
+
+
+# A blocking loop on a native thread that sends signals, similar to the
+# GLib main loop of the signal listener
+GEVENT_LISTENER = r'''
+from gevent import monkey
+monkey.patch_all()
+
+import threading
+import time
+
+from ac2.players.mpris import SignalDispatcher, start_native_thread
+
+blocking_sleep = monkey.get_original("time", "sleep")
+native_ident = monkey.get_original("_thread", "get_ident")
+main_thread = native_ident()
+received = []
+changed = threading.Event()
+
+
+def properties_changed(value):
+    received.append((value, native_ident() == main_thread))
+    changed.set()
+
+
+dispatcher = SignalDispatcher()
+handler = dispatcher.wrap(properties_changed)
+
+
+def loop():
+    blocking_sleep(0.2)
+    handler("Playing")
+    blocking_sleep(2)
+
+
+start = time.monotonic()
+start_native_thread(loop)
+started = time.monotonic() - start
+assert started < 0.1, started
+assert changed.wait(1)
+assert received == [("Playing", True)], received
+print("ok")
+'''
+
+
+class TestSignalListener(unittest.TestCase):
+
+    def test_gevent(self):
+        # needs its own process because of the monkey patching
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.getcwd()] + [p for p in [env.get("PYTHONPATH")] if p])
+        result = subprocess.run([sys.executable, "-c", GEVENT_LISTENER],
+                                env=env, capture_output=True, timeout=30)
+        self.assertEqual(result.stdout.strip(), b"ok", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,8 +22,6 @@ SOFTWARE.
 
 import threading
 import logging
-import datetime
-import time
 
 
 class MetadataDisplay:
@@ -31,27 +29,43 @@ class MetadataDisplay:
     def __init__(self):
         logging.debug("initializing MetadataDisplay instance")
         self.notifierthread = None
-        self.starttime = None
-        self.async_delay = 1
+        # Only the latest metadata that haven't been sent yet are kept
+        self.pending_metadata = None
+        self.notify_lock = threading.Lock()
         pass
 
     def notify(self, metadata):
         raise RuntimeError("notify not implemented")
 
     def notify_async(self, metadata):
-        # Don't run 2 async notifier threads in parallel
-        # If there is already one running. wait a bit and try again
-        if self.notifierthread is not None and self.notifierthread.is_alive():
-            time.sleep(self.async_delay)
-        
-        if self.notifierthread is not None and self.notifierthread.is_alive():            
-            logging.info("notifier background thread %s still running after %s seconds, "
-                         "not sending notify",
-                         self.notifierthread,
-                         datetime.datetime.now() - self.notifystarttime)
-        else:
-            self.notifierthread = threading.Thread(target=self.notify,
-                                                       args=(metadata,),
-                                                       name="notifier thread "+self.__str__())
-            self.notifystarttime = datetime.datetime.now()
+        # Don't run 2 async notifier threads in parallel. If there is
+        # already one running, it will send these metadata when it's
+        # finished. Updates that were replaced in the meantime are skipped,
+        # the latest one is always sent.
+        with self.notify_lock:
+            if self.pending_metadata is not None:
+                logging.debug("notifier background thread %s still busy, "
+                              "replacing pending update",
+                              self.notifierthread)
+            self.pending_metadata = metadata
+            if self.notifierthread is not None:
+                return
+
+            self.notifierthread = threading.Thread(target=self.notify_pending,
+                                                   name="notifier thread "+self.__str__())
             self.notifierthread.start()
+
+    def notify_pending(self):
+        while True:
+            with self.notify_lock:
+                metadata = self.pending_metadata
+                self.pending_metadata = None
+                if metadata is None:
+                    self.notifierthread = None
+                    return
+
+            try:
+                self.notify(metadata)
+            except Exception as e:
+                logging.warning("could not notify %s: %s", self, e)
+                logging.exception(e)
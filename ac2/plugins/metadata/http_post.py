@@ -21,6 +21,7 @@ SOFTWARE.
 '''
 
 from ac2.plugins.metadata import MetadataDisplay
+from ac2.metadata import MetadataSnapshots
 
 import requests
 import logging
@@ -37,7 +38,10 @@ class MetadataHTTPRequest(MetadataDisplay):
         super().__init__()
         self.request_type = request_type
         self.url = url
-        pass
+        # Not shared with the webserver, unknown artists and titles and
+        # artUrl are different in the data that is posted
+        self.snapshots = MetadataSnapshots()
+        self.posted_version = None
 
     def notify(self, metadata):
 
@@ -74,14 +78,21 @@ class MetadataHTTPRequest(MetadataDisplay):
             pass
             
 
+        snapshot = self.snapshots.update(metadata)
+        if snapshot.version == self.posted_version:
+            logging.debug("metadata didn't change, not posting it again")
+            return
+
         if (self.request_type == "json"):
             try:
-                r = requests.post(self.url, 
-                                  json=md_dict,
+                r = requests.post(self.url,
+                                  data=snapshot.json,
+                                  headers={"Content-Type":
+                                           "application/json"},
                                   timeout=10)
-                logging.info("posted metadata update to %s (%s)", 
+                logging.info("posted metadata update to %s (%s)",
                              self.url,
-                             md_dict)
+                             snapshot.json)
             except Exception as e:
                 logging.error("Exception when posting metadata: %s", e)
                 return
@@ -93,6 +104,8 @@ class MetadataHTTPRequest(MetadataDisplay):
             logging.error("got HTTP error %s when posting metadata to %s",
                           r.status_code,
                           self.url)
+        else:
+            self.posted_version = snapshot.version
 
     def notify_volume(self, volume):
         pass
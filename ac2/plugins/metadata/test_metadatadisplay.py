@@ -0,0 +1,73 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import threading
+import unittest
+from time import sleep, perf_counter
+
+from ac2.plugins.metadata import MetadataDisplay
+
+
+class SlowDisplay(MetadataDisplay):
+
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.received = []
+        self.busy = threading.Event()
+        self.done = threading.Event()
+
+    def notify(self, metadata):
+        self.busy.set()
+        sleep(self.delay)
+        self.received.append(metadata)
+        if metadata == "final":
+            self.done.set()
+
+
+class TestMetadataDisplay(unittest.TestCase):
+
+    def test_latest_update(self):
+        display = SlowDisplay(0.3)
+
+        display.notify_async("first")
+        self.assertTrue(display.busy.wait(1))
+        start = perf_counter()
+        for update in ["second", "third", "final"]:
+            display.notify_async(update)
+        # doesn't wait for the running notifier
+        self.assertLess(perf_counter() - start, 0.1)
+
+        self.assertTrue(display.done.wait(2))
+        # updates that were replaced while the first one was sent are
+        # skipped, the final one is never lost
+        self.assertEqual(display.received, ["first", "final"])
+
+        sleep(0.1)
+        self.assertIsNone(display.notifierthread)
+        display.done.clear()
+        display.notify_async("final")
+        self.assertTrue(display.done.wait(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import logging
+import threading
+from time import monotonic
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import gevent
+from gevent import monkey
+from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+
+
+class PollTimeout(Exception):
+    pass
+
+
+class PlayerPoller():
+    """
+    Polls a set of players in parallel on a bounded thread pool.
+
+    Every player has to answer within the given timeout. A player that
+    missed the deadline won't be polled again until the hanging call
+    returns, therefore it can block at most one worker thread.
+
+    If gevent's monkey patching is active, threads are greenlets. A D-Bus
+    call blocks in C and would stop all greenlets including the one that
+    waits for the timeout, players for which blocking(name) is true are
+    polled on native threads then. All other players are polled in
+    greenlets: their connections belong to the hub and can't be used
+    from another thread.
+    """
+
+    def __init__(self, poll_function, max_workers=4, timeout=2,
+                 blocking=None):
+        self.poll_function = poll_function
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.blocking = blocking
+        self.pending = {}
+        if monkey.is_module_patched("threading"):
+            self.executor = NativeThreadPoolExecutor(max_workers=max_workers)
+            self.use_greenlets = True
+        else:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="player poller")
+            self.use_greenlets = False
+
+    def submit(self, name):
+        if not self.use_greenlets or \
+                (self.blocking is not None and self.blocking(name)):
+            return self.executor.submit(self.poll_function, name)
+
+        future = Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(self.poll_function(name))
+            except BaseException as e:
+                future.set_exception(e)
+
+        gevent.spawn(run)
+        return future
+
+    def poll(self, names):
+        """
+        Poll the given players. Returns a dict name: (result, exception).
+        """
+        futures = {}
+        results = {}
+
+        # Players that disappeared while a poll was hanging
+        for name in list(self.pending.keys()):
+            if name not in names and self.pending[name].done():
+                del self.pending[name]
+
+        for name in names:
+            future = self.pending.get(name)
+            if future is not None:
+                if not future.done():
+                    results[name] = (None, PollTimeout(
+                        "{} still busy with previous poll".format(name)))
+                    continue
+                del self.pending[name]
+
+            futures[name] = self.submit(name)
+
+        wait(futures.values(), timeout=self.timeout)
+
+        for name in futures:
+            future = futures[name]
+            if not future.done():
+                logging.warning("%s did not answer within %ss",
+                                name, self.timeout)
+                self.pending[name] = future
+                results[name] = (None, PollTimeout(
+                    "{} timed out".format(name)))
+            elif future.exception() is not None:
+                results[name] = (None, future.exception())
+            else:
+                results[name] = (future.result(), None)
+
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class PollInterval():
+    """
+    Calculates the delay until the next poll of the main loop.
+
+    Players are polled quickly for a few seconds after something changed
+    and when a track is about to end. If nothing has been playing for
+    idle_after seconds, polling slows down to max_delay.
+    """
+
+    def __init__(self, default_delay=1, min_delay=0.2, max_delay=5,
+                 idle_after=60, fast_period=3, track_end=3):
+        self.default_delay = default_delay
+        self.min_delay = min(min_delay, default_delay)
+        self.max_delay = max(max_delay, default_delay)
+        self.idle_after = idle_after
+        self.fast_period = fast_period
+        self.track_end = track_end
+        self.fast_until = 0
+        self.last_active = monotonic()
+        self.interval = default_delay
+        self.wakeups = {"timer": 0, "signal": 0, "command": 0}
+        self.lock = threading.Lock()
+
+    def activity(self):
+        """
+        Something changed, poll quickly for the next seconds
+        """
+        self.fast_until = monotonic() + self.fast_period
+
+    def wakeup(self, reason):
+        with self.lock:
+            self.wakeups[reason] = self.wakeups.get(reason, 0) + 1
+        if reason == "command":
+            self.activity()
+
+    def next_interval(self, playing, remaining=None):
+        """
+        playing: something is playing
+        remaining: seconds until the current track ends if known
+        """
+        now = monotonic()
+        if playing:
+            self.last_active = now
+
+        if now < self.fast_until:
+            interval = self.min_delay
+        elif playing:
+            interval = self.default_delay
+            if remaining is not None and remaining >= 0:
+                if remaining < self.track_end:
+                    interval = self.min_delay
+                else:
+                    # wake up right before the track ends
+                    interval = min(interval, remaining - self.track_end +
+                                   self.min_delay)
+        elif now - self.last_active > self.idle_after:
+            interval = self.max_delay
+        else:
+            interval = self.default_delay
+
+        self.interval = max(interval, self.min_delay)
+        return self.interval
+
+    def stats(self):
+        with self.lock:
+            wakeups = dict(self.wakeups)
+        return {"interval": self.interval, "wakeups": wakeups}
@@ -0,0 +1,90 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import heapq
+import threading
+from itertools import count
+from time import monotonic
+
+
+class RateLimiter():
+    """
+    Token bucket shared by all callers of an API. Callers with a lower
+    priority value are served first when they are waiting at the same
+    time.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+        self.waiting = []
+        self.counter = count()
+        self.condition = threading.Condition()
+        self.requests = 0
+        self.wait_total = 0
+        self.wait_max = 0
+        self.wait_last = 0
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=0):
+        start = monotonic()
+        with self.condition:
+            me = (priority, next(self.counter))
+            heapq.heappush(self.waiting, me)
+            while True:
+                self.refill()
+                if self.waiting[0] == me and self.tokens >= 1:
+                    heapq.heappop(self.waiting)
+                    self.tokens -= 1
+                    break
+                if self.waiting[0] == me:
+                    self.condition.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.condition.wait()
+
+            waited = monotonic() - start
+            self.requests += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.wait_last = waited
+            # the next one in line has to check the bucket
+            self.condition.notify_all()
+        return waited
+
+    def stats(self):
+        with self.condition:
+            return {
+                "requests": self.requests,
+                "queued": len(self.waiting),
+                "wait_avg": self.wait_total / self.requests
+                if self.requests else 0,
+                "wait_max": self.wait_max,
+                "wait_last": self.wait_last,
+            }
@@ -0,0 +1,88 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import heapq
+import random
+from itertools import count
+from time import monotonic
+
+
+class Scheduler():
+    """
+    Deadlines for periodic work of the main loop, kept in a heap.
+
+    Every key can be scheduled only once, scheduling it again moves the
+    deadline. Checking for due work costs a single heap lookup if
+    nothing is due.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.deadlines = {}
+        self.counter = count()
+
+    def schedule(self, key, delay, jitter=0):
+        """
+        Schedule key to become due in delay seconds. A random value of
+        up to +/- jitter * delay will be added to spread out the work.
+        """
+        if jitter > 0:
+            delay = delay + random.uniform(-jitter, jitter) * delay
+        deadline = monotonic() + max(delay, 0)
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), key))
+
+    def cancel(self, key):
+        # The heap entry will be dropped when it comes up
+        self.deadlines.pop(key, None)
+
+    def scheduled(self, key):
+        return key in self.deadlines
+
+    def due(self, now=None):
+        """
+        Returns all keys that are due and removes them from the schedule
+        """
+        if now is None:
+            now = monotonic()
+        keys = []
+        while self.heap and self.heap[0][0] <= now:
+            (deadline, _seq, key) = heapq.heappop(self.heap)
+            # Skip entries that have been cancelled or rescheduled
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                keys.append(key)
+        return keys
+
+    def next_deadline(self):
+        """
+        Seconds until the next key is due or None if nothing is scheduled
+        """
+        while self.heap and \
+                self.deadlines.get(self.heap[0][2]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - monotonic(), 0)
+
+    def __len__(self):
+        return len(self.deadlines)
@@ -20,64 +20,487 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import json
 import logging
-from expiringdict import ExpiringDict
+import threading
+from collections import OrderedDict, deque
+from time import monotonic
+from urllib.parse import urlsplit, urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from ac2.data.identities import host_uuid, release
+from ac2.singleflight import SingleFlight
 
-cache = ExpiringDict(max_len=100,
-                     max_age_seconds=600)
-negativeCache = ExpiringDict(max_len=100,
-                             max_age_seconds=600)
+# Kept-alive connections and concurrent requests per host
+POOL_SIZE = 4
+MAX_CONCURRENT = 4
+
+# Timeouts are adapted to the latency of a host once there are enough
+# samples: TIMEOUT_FACTOR * p99, but at least MIN_TIMEOUT
+LATENCY_SAMPLES = 100
+MIN_SAMPLES = 10
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT = 1
+
+# A host is skipped for COOLDOWN seconds after FAILURE_THRESHOLD
+# consecutive failures or if more than half of the last ERROR_WINDOW
+# requests failed
+FAILURE_THRESHOLD = 5
+ERROR_WINDOW = 20
+COOLDOWN = 60
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+class HostHealth():
+    """
+    Latencies and errors of requests to a single host. Decides if
+    requests to the host should be sent at all and how long to wait for
+    an answer.
+    """
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.results = deque(maxlen=ERROR_WINDOW)
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.open_until = 0
+        self.cooldown = COOLDOWN
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.state == CIRCUIT_CLOSED:
+                return True
+            if self.state == CIRCUIT_OPEN and monotonic() >= self.open_until:
+                # let a single request find out if the host is back
+                self.state = CIRCUIT_HALF_OPEN
+                return True
+            self.skipped += 1
+            return False
+
+    def timeout(self, default):
+        with self.lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return default
+            p99 = percentile(self.latencies, 0.99)
+        return min(max(p99 * TIMEOUT_FACTOR, MIN_TIMEOUT), default)
+
+    def success(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.results.append(True)
+            self.consecutive_failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                logging.info("host is available again, closing circuit")
+            self.state = CIRCUIT_CLOSED
+
+    def failure(self):
+        with self.lock:
+            self.results.append(False)
+            self.consecutive_failures += 1
+            errors = self.results.count(False)
+            if self.state == CIRCUIT_HALF_OPEN or \
+                    self.consecutive_failures >= FAILURE_THRESHOLD or \
+                    (len(self.results) >= MIN_SAMPLES and
+                     errors > len(self.results) / 2):
+                if self.state != CIRCUIT_OPEN:
+                    logging.warning("too many failures, skipping host for "
+                                    "%ss", self.cooldown)
+                self.state = CIRCUIT_OPEN
+                self.open_until = monotonic() + self.cooldown
+
+    def stats(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            results = list(self.results)
+            state = self.state
+            skipped = self.skipped
+        return {
+            "state": state,
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "error_rate": results.count(False) / len(results)
+            if results else 0,
+            "skipped": skipped,
+        }
+
+
+class CachedResponse():
+    """
+    The parts of a requests.Response that are used by audiocontrol
+    """
+
+    __slots__ = ["status_code", "content_type", "encoding", "content",
+                 "etag", "last_modified"]
+
+    def __init__(self, status_code, content_type, encoding, content,
+                 etag=None, last_modified=None):
+        self.status_code = status_code
+        self.content_type = content_type
+        self.encoding = encoding
+        self.content = content
+        # validators for conditional requests
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @classmethod
+    def from_response(cls, res):
+        return cls(res.status_code,
+                   res.headers.get("Content-Type"),
+                   res.encoding,
+                   res.content,
+                   res.headers.get("ETag"),
+                   res.headers.get("Last-Modified"))
+
+    def can_revalidate(self):
+        return self.etag is not None or self.last_modified is not None
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8",
+                                   errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def size(self):
+        return len(self.content) + 100
+
+
+class ByteLRU():
+    """
+    LRU cache with a size limit in bytes. Entries expire after ttl
+    seconds unless a different TTL is given when storing them.
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            (value, size, expires) = entry
+            if expires < monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def lookup(self, key):
+        """
+        Returns (value, fresh). Expired entries are kept until they are
+        replaced or evicted, so they can be revalidated.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return (None, False)
+            (value, size, expires) = entry
+            self.entries.move_to_end(key)
+            if expires < monotonic():
+                self.misses += 1
+                return (value, False)
+            self.hits += 1
+            return (value, True)
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[2] >= monotonic()
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def put(self, key, value, size=None, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        if size is None:
+            size = len(key)
+            if hasattr(value, "size"):
+                size += value.size()
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, size, monotonic() + ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                (oldest, _entry) = next(iter(self.entries.items()))
+                self._remove(oldest)
+
+    def remove(self, key):
+        with self.lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def info(self):
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0,
+            }
+
+
+cache = ByteLRU(max_bytes=4 * 1024 * 1024, ttl=600)
+negativeCache = ByteLRU(max_bytes=64 * 1024, ttl=600)
+
+
+inflight = SingleFlight()
+
+
+def set_cache_parameters(max_bytes=None, ttl=None, negative_ttl=None):
+    if max_bytes is not None:
+        cache.max_bytes = max_bytes
+    if ttl is not None:
+        cache.ttl = ttl
+    if negative_ttl is not None:
+        negativeCache.ttl = negative_ttl
+
+
+# Conditional requests and responses that didn't need a new body
+revalidation_stats = {"revalidated": 0, "not_modified": 0}
+
+
+def cache_info():
+    return {"positive": cache.info(),
+            "negative": negativeCache.info(),
+            "revalidated": revalidation_stats["revalidated"],
+            "not_modified": revalidation_stats["not_modified"],
+            "inflight": inflight.stats()}
+
+
+def freshness(headers, default_ttl):
+    """
+    Returns how long a response can be used without revalidation based
+    on its Cache-Control header. None means it must not be stored.
+    """
+    cache_control = headers.get("Cache-Control")
+    if cache_control is None:
+        return default_ttl
+
+    ttl = default_ttl
+    for directive in cache_control.lower().split(","):
+        directive = directive.strip()
+        if directive == "no-store":
+            return None
+        elif directive == "no-cache":
+            ttl = 0
+        elif directive.startswith("max-age="):
+            try:
+                ttl = max(int(directive[8:].strip('"')), 0)
+            except ValueError:
+                pass
+    return ttl
+
+
+class HostSession():
+    """
+    A requests session for a single host that keeps connections alive.
+    The number of concurrent requests to the host is limited.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, max_concurrent=MAX_CONCURRENT):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers['User-agent'] = \
+            'audiocontrol/{}/{}'.format(release(), host_uuid())
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.health = HostHealth()
+
+    def request(self, method, url, timeout=10, **kwargs):
+        if not self.health.allow_request():
+            raise CircuitOpen("skipping {}, host is unavailable".format(url))
+
+        timeout = self.health.timeout(timeout)
+        with self.semaphore:
+            start = monotonic()
+            try:
+                res = self.session.request(method, url, timeout=timeout,
+                                           **kwargs)
+            except Exception:
+                self.health.failure()
+                raise
+
+        if res.status_code >= 500:
+            self.health.failure()
+        else:
+            self.health.success(monotonic() - start)
+        return res
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+
+def host_session(url):
+    parts = urlsplit(url)
+    host = (parts.scheme, parts.netloc)
+    with sessions_lock:
+        session = sessions.get(host)
+        if session is None:
+            session = HostSession()
+            sessions[host] = session
+        return session
+
+
+def host_info():
+    with sessions_lock:
+        hosts = dict(sessions)
+    return {"{}://{}".format(scheme, netloc): session.health.stats()
+            for ((scheme, netloc), session) in hosts.items()}
+
+
+def close_sessions():
+    with sessions_lock:
+        for session in sessions.values():
+            session.session.close()
+        sessions.clear()
 
 
 def clear_cache():
     cache.clear()
     negativeCache.clear()
 
-def is_cached(url):
-    return url in cache
+def cache_key(url, params={}):
+    """
+    Responses are cached by URL and query parameters
+    """
+    if not params:
+        return url
+    separator = "&" if "?" in url else "?"
+    return url + separator + urlencode(sorted(params.items()))
+
+
+def is_cached(url, params={}):
+    return cache_key(url, params) in cache
 
 
-def is_negative_cached(url):
-    return url in negativeCache
+def is_negative_cached(url, params={}):
+    return cache_key(url, params) in negativeCache
 
 
 def retrieve_url(url, headers = {}, params= {}, verify=True, timeout=10):
 
-    if url in cache:
-        logging.debug("retrieved from cache: %s", url)
-        return cache[url]
-    else:
-        try:
-            if negativeCache.get(url) is None:
-                headers['User-agent'] = 'audiocontrol/{}/{}'.format(release(), host_uuid())
-                res = requests.get(url, 
-                                   headers=headers, 
-                                   verify=verify,
-                                   params=params,
-                                   timeout=timeout)
-                cache[url] = res
-                return res
+    key = cache_key(url, params)
+    (cached, fresh) = cache.lookup(key)
+    if fresh:
+        logging.debug("retrieved from cache: %s", key)
+        return cached
+
+    # Concurrent requests for the same URL wait for the first one
+    return inflight.do((key, verify), fetch_url, url, key, cached,
+                       headers, params, verify, timeout)
+
+
+def fetch_url(url, key, cached, headers, params, verify, timeout):
+    """
+    Request a URL that isn't in the cache or needs to be revalidated
+    """
+    try:
+        if negativeCache.get(key) is None:
+            headers = dict(headers)
+            if cached is not None:
+                # Expired, but the server can tell us if it's
+                # still valid
+                revalidation_stats["revalidated"] += 1
+                if cached.etag is not None:
+                    headers["If-None-Match"] = cached.etag
+                if cached.last_modified is not None:
+                    headers["If-Modified-Since"] = cached.last_modified
+
+            res = host_session(url).get(url,
+                                        headers=headers,
+                                        verify=verify,
+                                        params=params,
+                                        timeout=timeout)
+            ttl = freshness(res.headers, cache.ttl)
+
+            if res.status_code == 304 and cached is not None:
+                logging.debug("not modified: %s", url)
+                revalidation_stats["not_modified"] += 1
+                res = cached
             else:
-                logging.debug("negative cache hit: %s", url)
-        except Exception as e:
-            logging.debug("HTTP exception while retrieving %s: %s", url, e)
-            negativeCache[url] = True
-            
-            
+                res = CachedResponse.from_response(res)
+
+            if ttl is None or (ttl == 0 and not res.can_revalidate()):
+                cache.remove(key)
+            else:
+                cache.put(key, res, ttl=ttl)
+            return res
+        else:
+            logging.debug("negative cache hit: %s", url)
+    except CircuitOpen as e:
+        # the URL itself might be fine, don't cache this
+        logging.debug("%s", e)
+    except Exception as e:
+        logging.debug("HTTP exception while retrieving %s: %s", key, e)
+        negativeCache[key] = True
+
+
 def post_data(url, data, headers = {}, verify=True, timeout=10):
     
     res = None
     try:
-        headers['User-agent'] = 'audiocontrol/{}/{}'.format(release(), host_uuid())
-        res = requests.post(url, 
-                            data = data, 
-                            headers=headers, 
-                            verify = verify,
-                            timeout = timeout)
+        res = host_session(url).post(url,
+                                     data=data,
+                                     headers=headers,
+                                     verify=verify,
+                                     timeout=timeout)
     except Exception as e:
         logging.debug("HTTP exception while posting %s: %s", url, e)
         
@@ -4,12 +4,70 @@ import logging
 import socketio
 from bottle import Bottle
 from ac2.controller import AudioController
-from ac2.metadata import Metadata
+from ac2.metadata import Metadata, MetadataSnapshot, web_snapshots, \
+    update_web_snapshot
 
 from ac2.plugins.metadata import MetadataDisplay
 
 _LOGGER = logging.getLogger(__name__)
-sio = socketio.Server()
+
+# Rooms of the metadata namespace
+FULL_UPDATES = "full"
+DELTA_UPDATES = "delta"
+
+
+class VersionedSnapshot():
+    """
+    A metadata snapshot together with its version, sent to clients that
+    receive delta updates
+    """
+
+    __slots__ = ["version", "json"]
+
+    def __init__(self, snapshot):
+        self.version = snapshot.version
+        self.json = '{{"version":{},"metadata":{}}}'.format(snapshot.version,
+                                                            snapshot.json)
+
+
+def metadata_delta(previous, snapshot):
+    """
+    Attributes that changed from the previous to the current snapshot
+    """
+    changes = {}
+    for (attrib, value) in snapshot.values.items():
+        if attrib not in previous.values or previous.values[attrib] != value:
+            changes[attrib] = value
+    for attrib in previous.values:
+        if attrib not in snapshot.values:
+            changes[attrib] = None
+    return {"version": snapshot.version,
+            "base": previous.version,
+            "changes": changes}
+
+
+class SnapshotJSON():
+    """
+    JSON encoder for Socket.IO packets that inserts the serialized
+    form of metadata snapshots instead of encoding them again
+    """
+
+    @staticmethod
+    def dumps(obj, **kwargs):
+        serialized = (MetadataSnapshot, VersionedSnapshot)
+        if isinstance(obj, list) and \
+                any(isinstance(o, serialized) for o in obj):
+            return "[" + ",".join(
+                o.json if isinstance(o, serialized)
+                else json.dumps(o, **kwargs) for o in obj) + "]"
+        return json.dumps(obj, **kwargs)
+
+    @staticmethod
+    def loads(s, **kwargs):
+        return json.loads(s, **kwargs)
+
+
+sio = socketio.Server(json=SnapshotJSON)
 
 @sio.event
 def connect(sid, environ):
@@ -21,20 +79,65 @@ def disconnect(sid):
 
 
 class MetadataHandler(socketio.Namespace, MetadataDisplay):
+    """
+    Clients receive the full metadata as "update" event on every change.
+
+    Clients that sent a "delta" event receive "delta" events with only
+    the changed attributes instead:
+    {"version": 5, "base": 4, "changes": {"tags": ["rock"]}}
+    If base isn't the version the client has, it missed an update and
+    has to "get" the full metadata again.
+    """
 
     def __init__(self):
         super().__init__(namespace='/metadata')
         MetadataDisplay.__init__(self)
         self.metadata = Metadata()
+        self.snapshot = web_snapshots.current
+        if self.snapshot is None:
+            self.snapshot = update_web_snapshot(self.metadata)
+        self.versioned = VersionedSnapshot(self.snapshot)
+        self.delta_clients = set()
+
+    def on_connect(self, sid, environ):
+        self.enter_room(sid, FULL_UPDATES)
+
+    def on_disconnect(self, sid, *_args):
+        self.delta_clients.discard(sid)
 
     def on_get(self, sid):
         _LOGGER.debug("metadata on_get event from %s", sid)
-        return self.metadata.__dict__
+        if sid in self.delta_clients:
+            return self.versioned
+        return self.snapshot
+
+    def on_delta(self, sid):
+        """
+        Switch a client to delta updates, returns the current metadata
+        and their version
+        """
+        _LOGGER.debug("metadata delta updates for %s", sid)
+        self.leave_room(sid, FULL_UPDATES)
+        self.enter_room(sid, DELTA_UPDATES)
+        self.delta_clients.add(sid)
+        return self.versioned
 
     def notify(self, metadata):
-        _LOGGER.debug('metadata notify: %s', json.dumps(self.metadata.__dict__, skipkeys=True))
+        # The snapshot has been created by the controller
         self.metadata = metadata
-        sio.emit("update", self.metadata.__dict__, namespace="/metadata")
+        previous = self.snapshot
+        self.snapshot = web_snapshots.current
+        if self.snapshot is previous:
+            _LOGGER.debug("metadata notify: nothing changed")
+            return
+
+        self.versioned = VersionedSnapshot(self.snapshot)
+        _LOGGER.debug('metadata notify: version %s', self.snapshot.version)
+        sio.emit("update", self.snapshot, room=FULL_UPDATES,
+                 namespace="/metadata")
+        if len(self.delta_clients) > 0:
+            sio.emit("delta", metadata_delta(previous, self.snapshot),
+                     room=DELTA_UPDATES, namespace="/metadata")
 
 
 class PlayerHandler(socketio.Namespace):
@@ -0,0 +1,52 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+"""
+Runtime statistics of caches, rate limiters and background workers.
+They are available at /api/stats and not part of the player status,
+which clients poll frequently.
+"""
+
+from ac2 import simple_http
+from ac2.metadata import enrichment_executor
+import ac2.data.musicbrainz as musicbrainz
+import ac2.data.coverarthandler as coverarthandler
+import ac2.data.artworkstore as artworkstore
+
+
+def collect(player_control=None):
+    artwork_store = None
+    if artworkstore.artwork_store is not None:
+        artwork_store = artworkstore.artwork_store.stats()
+
+    stats = {"enrichment": enrichment_executor.stats(),
+             "http_cache": simple_http.cache_info(),
+             "http_hosts": simple_http.host_info(),
+             "musicbrainz": musicbrainz.stats(),
+             "artwork_sizes": coverarthandler.image_cache_info(),
+             "artwork_store": artwork_store}
+
+    interval = getattr(player_control, "interval", None)
+    if interval is not None:
+        stats["poll"] = interval.stats()
+
+    return stats
@@ -0,0 +1,128 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import json
+import threading
+import unittest
+from time import sleep
+
+from ac2.events import EventBroker, SSEStream
+
+
+class TestEventBroker(unittest.TestCase):
+
+    def test_exactly_once(self):
+        broker = EventBroker()
+        broker.publish("volume", {"percent": 50})
+        broker.publish("metadata", '{"title":"song"}')
+
+        subscription = broker.subscribe(heartbeat=1)
+        # a new subscriber starts with the current state
+        events = next(subscription)
+        self.assertEqual([e.type for e in events], ["volume", "metadata"])
+        self.assertEqual(json.loads(events[0].data), {"percent": 50})
+
+        # nothing changed
+        self.assertIsNone(broker.publish("volume", {"percent": 50}))
+        broker.publish("volume", {"percent": 60})
+        broker.publish("volume", {"percent": 70})
+        events = next(subscription)
+        self.assertEqual([e.data for e in events],
+                         ['{"percent":60}', '{"percent":70}'])
+        self.assertEqual(broker.stats()["subscribers"], 1)
+        self.assertEqual(broker.stats()["unchanged"], 1)
+
+        subscription.close()
+        self.assertEqual(broker.stats()["subscribers"], 0)
+
+    def test_resume(self):
+        broker = EventBroker(history=5)
+        for i in range(3):
+            broker.publish("volume", {"percent": i})
+        broker.publish("state", {"state": "playing"})
+
+        events = broker.events_after(2)
+        self.assertEqual([e.id for e in events], [3, 4])
+        self.assertEqual(broker.events_after(4), [])
+
+        for i in range(10):
+            broker.publish("volume", {"percent": 10 + i})
+        # missed more than the history, continue with the current state
+        events = broker.events_after(3)
+        self.assertEqual([e.type for e in events], ["state", "volume"])
+        self.assertEqual(events[1].data, '{"percent":19}')
+
+        # id from before a restart
+        events = broker.events_after(100)
+        self.assertEqual([e.type for e in events], ["state", "volume"])
+
+    def test_heartbeat(self):
+        broker = EventBroker()
+        subscription = broker.subscribe(last_id=100, heartbeat=0.05)
+        self.assertEqual(next(subscription), [])
+        # doesn't wait for ids from before a restart
+        self.assertEqual(next(subscription), [])
+        broker.publish("volume", {"percent": 1})
+        self.assertEqual([e.id for e in next(subscription)], [1])
+
+    def test_fanout(self):
+        broker = EventBroker()
+        received = {}
+
+        def subscriber(i):
+            received[i] = []
+            for events in broker.subscribe(heartbeat=1):
+                received[i].extend(e.id for e in events)
+                if 10 in received[i]:
+                    return
+
+        threads = [threading.Thread(target=subscriber, args=(i,))
+                   for i in range(50)]
+        for t in threads:
+            t.start()
+        sleep(0.1)
+        for i in range(10):
+            broker.publish("volume", {"percent": i})
+            sleep(0.001)
+        for t in threads:
+            t.join(5)
+
+        for ids in received.values():
+            self.assertEqual(ids, list(range(1, 11)))
+        self.assertEqual(broker.stats()["subscribers"], 0)
+
+    def test_sse(self):
+        broker = EventBroker()
+        broker.publish("volume", {"percent": 50})
+        stream = SSEStream(broker, heartbeat=0.05)
+        chunks = iter(stream)
+
+        self.assertEqual(next(chunks), b"retry: 3000\n\n")
+        self.assertEqual(next(chunks),
+                         b'id: 1\nevent: volume\ndata: {"percent":50}\n\n')
+        self.assertEqual(next(chunks), b": heartbeat\n\n")
+        stream.close()
+        self.assertEqual(broker.stats()["subscribers"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
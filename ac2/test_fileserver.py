@@ -0,0 +1,173 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import bottle
+import gevent.socket
+from bottle import Bottle
+from gevent.pywsgi import WSGIServer
+
+from ac2.fileserver import serve_file, file_etag, etags, etag_matches, \
+    sendfile_stats, SendfileHandler, IMMUTABLE
+
+
+def http_get(port, path, headers={}):
+    """
+    Minimal HTTP client that uses gevent sockets, so the server runs in
+    the same thread while waiting for the response
+    """
+    sock = gevent.socket.create_connection(("127.0.0.1", port))
+    request = "GET {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n" \
+        .format(path)
+    for (name, value) in headers.items():
+        request += "{}: {}\r\n".format(name, value)
+    sock.sendall((request + "\r\n").encode())
+
+    blocks = []
+    while True:
+        block = sock.recv(65536)
+        if not block:
+            break
+        blocks.append(block)
+    sock.close()
+    data = b"".join(blocks)
+
+    (head, _sep, body) = data.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    status = int(lines[0].split()[1])
+    response_headers = {}
+    for line in lines[1:]:
+        (name, _sep, value) = line.partition(": ")
+        response_headers[name.lower()] = value
+    return status, response_headers, body
+
+
+def static_file_012(filename, root, mimetype='auto', download=False,
+                    charset='UTF-8'):
+    """
+    static_file with the arguments of bottle 0.12, without ETags
+    """
+    if mimetype == 'auto':
+        mimetype = True
+    return bottle.static_file(filename, root, mimetype=mimetype,
+                              download=download, charset=charset,
+                              etag=False)
+
+
+class TestFileserver(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = os.urandom(300000)
+        with open(os.path.join(self.root, "cover.jpg"), "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        etags.clear()
+
+    def test_etag(self):
+        path = os.path.join(self.root, "cover.jpg")
+        etag = file_etag(path)
+        self.assertEqual(file_etag(path), etag)
+
+        # same size and modification time: not hashed again
+        stat = os.stat(path)
+        with open(path, "wb") as f:
+            f.write(os.urandom(300000))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(file_etag(path), etag)
+
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+        self.assertNotEqual(file_etag(path), etag)
+
+    def test_etag_matches(self):
+        self.assertTrue(etag_matches('"a"', '"a"'))
+        self.assertTrue(etag_matches('"b", W/"a"', '"a"'))
+        self.assertTrue(etag_matches('*', '"a"'))
+        self.assertFalse(etag_matches('"b"', '"a"'))
+        self.assertFalse(etag_matches(None, '"a"'))
+
+    def test_serve(self):
+        self.check_serve()
+
+    def test_serve_bottle_012(self):
+        with patch("ac2.fileserver.static_file", static_file_012):
+            self.check_serve()
+
+    def check_serve(self):
+        app = Bottle()
+        app.route("/static/<filename>", callback=lambda filename:
+                  serve_file(filename, root=self.root))
+        app.route("/immutable/<filename>", callback=lambda filename:
+                  serve_file(filename, root=self.root, etag='"v1"',
+                             cache_control=IMMUTABLE))
+        server = WSGIServer(("127.0.0.1", 0), app,
+                            handler_class=SendfileHandler, log=None)
+        server.start()
+        port = server.server_port
+        try:
+            files = sendfile_stats["files"]
+            (status, headers, body) = http_get(port, "/static/cover.jpg")
+            self.assertEqual(status, 200)
+            self.assertEqual(body, self.data)
+            self.assertEqual(headers["cache-control"], "no-cache")
+            self.assertEqual(sendfile_stats["files"], files + 1)
+
+            etag = headers["etag"]
+            (status, headers, body) = http_get(port, "/static/cover.jpg",
+                                               {"If-None-Match": etag})
+            self.assertEqual(status, 304)
+            self.assertEqual(body, b"")
+            self.assertEqual(sendfile_stats["files"], files + 1)
+
+            self.assertEqual(headers["etag"], etag)
+            self.assertEqual(headers["cache-control"], "no-cache")
+
+            (status, headers, body) = http_get(port, "/immutable/cover.jpg")
+            self.assertEqual(headers["etag"], '"v1"')
+            self.assertEqual(headers["cache-control"], IMMUTABLE)
+            (status, headers, body) = http_get(port, "/immutable/cover.jpg",
+                                               {"If-None-Match": '"v1"'})
+            self.assertEqual(status, 304)
+
+            # ranges are still sent by bottle
+            (status, headers, body) = http_get(port, "/static/cover.jpg",
+                                               {"Range": "bytes=10-19"})
+            self.assertEqual(status, 206)
+            self.assertEqual(body, self.data[10:20])
+
+            (status, headers, body) = http_get(port, "/static/missing.jpg")
+            self.assertEqual(status, 404)
+            (status, headers, body) = http_get(port, "/static/..%2fx")
+            self.assertIn(status, [403, 404])
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,9 +20,15 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import copy
+import json
+import threading
 import unittest
+from time import sleep, perf_counter
 
-from ac2.metadata import Metadata, enrich_metadata  
+from ac2.metadata import Metadata, enrich_metadata, EnrichmentExecutor, \
+    MetadataSnapshots, PROVIDER_WORKERS
+import ac2.data.artworkstore as artworkstore
 
 class MetaDataTest(unittest.TestCase):
 
@@ -139,7 +145,7 @@ class MetaDataTest(unittest.TestCase):
         # We should be able to get some metadata for this one
         md=Metadata("Bruce Springsteen","The River")
         self.md_updated = False
-        self.updates = None
+        self.updates = {}
         song_id = md.songId()
         self.song_id = None
         
@@ -150,7 +156,7 @@ class MetaDataTest(unittest.TestCase):
         
         self.assertIsNotNone(md.externalArtUrl)       
         self.assertIsNotNone(md.mbid)
-        self.assertIsNotNone(self.updates)
+        self.assertNotEqual(self.updates, {})
         self.assertIn("externalArtUrl", self.updates)
         self.assertIn("mbid",self.updates)
         self.assertIn("artistmbid",self.updates)
@@ -179,8 +185,250 @@ class MetaDataTest(unittest.TestCase):
         
         
     def update_metadata_attributes(self, updates, song_id):
-        self.updates = updates
+        # updates are sent incrementally
+        self.updates.update(updates)
         self.song_id = song_id
 
+class SlowSource():
+    """
+    Stand-in for an external metadata source that needs some time
+    for every HTTP request
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def enrich(self, metadata):
+        with self.lock:
+            self.requests += 1
+        sleep(self.delay)
+        metadata.mbid = "mbid"
+
+
+class FakeArtworkStore():
+    """
+    Artwork store with one stored cover, downloads take some time
+    """
+
+    def __init__(self, stored_url, delay):
+        self.stored_url = stored_url
+        self.delay = delay
+
+    def stored(self, url):
+        if url == self.stored_url:
+            return artworkstore.artwork_key(url)
+        return None
+
+    def add(self, url):
+        sleep(self.delay)
+        return artworkstore.artwork_key(url)
+
+
+class EnrichmentExecutorTest(unittest.TestCase):
+
+    def test_skips(self):
+        # 50 skips within 10 seconds, 10 times faster
+        source = SlowSource(0.05)
+        steps = [("source0", source.enrich, [])] + \
+            [("source{}".format(i), source.enrich, ["source{}".format(i - 1)])
+             for i in range(1, 5)]
+        executor = EnrichmentExecutor(workers=2, steps=steps)
+        updates = []
+        threads_before = threading.active_count()
+        max_threads = 0
+
+        class Callback():
+
+            def update_metadata_attributes(self, attributes, songId):
+                updates.append(songId)
+
+        for i in range(50):
+            executor.submit(Metadata("artist", "song {}".format(i)),
+                            Callback())
+            max_threads = max(max_threads, threading.active_count())
+            sleep(0.02)
+
+        for _i in range(100):
+            if executor.stats()["active"] == 0 and len(updates) > 0:
+                break
+            sleep(0.05)
+
+        stats = executor.stats()
+        self.assertLessEqual(max_threads - threads_before,
+                             2 + PROVIDER_WORKERS)
+        self.assertEqual(stats["workers"], 2)
+        # Without cancellation, this would be 250 requests
+        self.assertLess(source.requests, 60)
+        self.assertEqual(updates[-1], "artist/song 49")
+        self.assertEqual(stats["submitted"], 50)
+        self.assertEqual(stats["submitted"],
+                         stats["completed"] + stats["dropped"] +
+                         stats["cancelled"])
+        self.assertGreater(stats["dropped"], 0)
+        self.assertLessEqual(stats["max_queue_depth"], 2)
+
+
+    def test_parallel_sources(self):
+
+        def first(md):
+            sleep(0.2)
+            md.mbid = "first"
+            md.add_tag("tag1")
+
+        def second(md):
+            sleep(0.1)
+            md.mbid = "second"
+            md.albummbid = "album"
+            md.add_tag("tag2")
+
+        def dependent(md):
+            # runs when both sources are finished
+            md.wiki = "{} {}".format(md.mbid, md.albummbid)
+
+        steps = [("first", first, []),
+                 ("second", second, []),
+                 ("dependent", dependent, ["first", "second"])]
+        md = Metadata("artist", "song")
+
+        start = perf_counter()
+        self.assertTrue(enrich_metadata(md, steps=steps))
+        self.assertLess(perf_counter() - start, 0.29)
+        # the first source has priority
+        self.assertEqual(md.mbid, "first")
+        self.assertEqual(md.albummbid, "album")
+        self.assertEqual(md.tags, ["tag2", "tag1"])
+        self.assertEqual(md.wiki, "first album")
+
+
+    def test_progressive_updates(self):
+
+        def cover(md):
+            sleep(0.05)
+            md.externalArtUrl = "http://cover"
+
+        def tags(md):
+            sleep(0.06)
+            md.add_tag("rock")
+
+        def mbid(md):
+            sleep(0.07)
+            md.mbid = "mbid"
+
+        def slow(md):
+            sleep(0.5)
+            md.releaseDate = "2020-01-01"
+
+        updates = []
+        start = perf_counter()
+
+        class Callback():
+
+            def update_metadata_attributes(self, attributes, songId):
+                updates.append((perf_counter() - start, attributes))
+
+        steps = [("cover", cover, []),
+                 ("tags", tags, []),
+                 ("mbid", mbid, []),
+                 ("slow", slow, [])]
+        md = Metadata("artist", "song")
+        enrich_metadata(md, callback=Callback(), steps=steps,
+                        notify_interval=0.1)
+
+        # the cover doesn't wait for the slow source
+        (ts, attributes) = updates[0]
+        self.assertLess(ts, 0.2)
+        self.assertEqual(attributes["externalArtUrl"], "http://cover")
+        # updates of sources that finished at the same time are combined
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(updates[1][1], {"tags": ["rock"], "mbid": "mbid"})
+        self.assertEqual(updates[2][1], {"releaseDate": "2020-01-01"})
+
+    def test_artwork_updates(self):
+        stored = "http://stored"
+        new = "http://new"
+        cover_url = None
+
+        def cover(md):
+            sleep(0.05)
+            md.externalArtUrl = cover_url
+
+        def slow(md):
+            sleep(0.5)
+            md.releaseDate = "2020-01-01"
+
+        updates = []
+
+        class Callback():
+
+            def update_metadata_attributes(self, attributes, songId):
+                updates.append((perf_counter() - start, attributes))
+
+        steps = [("cover", cover, []),
+                 ("slow", slow, [])]
+        artworkstore.artwork_store = FakeArtworkStore(stored, 0.1)
+        try:
+            # stored cover: local URL together with the external one
+            cover_url = stored
+            start = perf_counter()
+            enrich_metadata(Metadata("artist", "song"), callback=Callback(),
+                            steps=steps, notify_interval=0.01)
+            (ts, attributes) = updates[0]
+            self.assertLess(ts, 0.2)
+            self.assertEqual(attributes["externalArtUrl"], stored)
+            self.assertEqual(attributes["localArtUrl"],
+                             artworkstore.local_url(
+                                 artworkstore.artwork_key(stored)))
+
+            # new cover: the download doesn't wait for the slow source
+            updates.clear()
+            cover_url = new
+            start = perf_counter()
+            enrich_metadata(Metadata("artist", "song"), callback=Callback(),
+                            steps=steps, notify_interval=0.01)
+            self.assertNotIn("localArtUrl", updates[0][1])
+            (ts, attributes) = updates[1]
+            self.assertLess(ts, 0.3)
+            self.assertEqual(attributes["localArtUrl"],
+                             artworkstore.local_url(
+                                 artworkstore.artwork_key(new)))
+        finally:
+            artworkstore.artwork_store = None
+
+
+
+class MetadataSnapshotsTest(unittest.TestCase):
+
+    def test_versions(self):
+        snapshots = MetadataSnapshots()
+        md = Metadata("artist", "song")
+
+        s1 = snapshots.update(md)
+        self.assertEqual(s1.version, 1)
+        self.assertEqual(json.loads(s1.json)["title"], "song")
+
+        # the same song again (e.g. notified by another display)
+        s2 = snapshots.update(copy.copy(md))
+        self.assertIs(s2, s1)
+
+        md.externalArtUrl = "http://cover"
+        s3 = snapshots.update(md)
+        self.assertEqual(s3.version, 2)
+        self.assertNotEqual(s3.etag, s1.etag)
+        self.assertEqual(json.loads(s3.json)["externalArtUrl"],
+                         "http://cover")
+        # the snapshot doesn't change with the metadata object
+        md.title = "other song"
+        self.assertEqual(json.loads(s3.json)["title"], "song")
+
+    def test_etag_epoch(self):
+        md = Metadata("artist", "song")
+        s1 = MetadataSnapshots().update(md)
+        s2 = MetadataSnapshots().update(md)
+        self.assertEqual(s1.version, s2.version)
+        self.assertNotEqual(s1.etag, s2.etag)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,254 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import subprocess
+import sys
+import threading
+import unittest
+from time import sleep, perf_counter
+
+from ac2.poller import PlayerPoller, PollTimeout, PollInterval
+
+SLOW = "slow"
+FAST = ["fast1", "fast2", "fast3", "fast4", "fast5"]
+
+
+class FakePlayers():
+    """
+    Players that answer immediately, except one that hangs
+    """
+
+    def __init__(self, hang=2):
+        self.hang = hang
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def poll(self, name):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if name == SLOW:
+                sleep(self.hang)
+            else:
+                sleep(0.01)
+            if name == "broken":
+                raise IOError("no connection")
+            return "playing"
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class TestPoller(unittest.TestCase):
+
+    def test_parallel(self):
+        players = FakePlayers()
+        poller = PlayerPoller(players.poll, max_workers=3, timeout=2)
+
+        start = perf_counter()
+        results = poller.poll(FAST)
+        duration = perf_counter() - start
+
+        for name in FAST:
+            self.assertEqual(results[name], ("playing", None))
+        # 5 players on 3 threads need 2 rounds
+        self.assertLess(duration, 0.1)
+        self.assertLessEqual(players.max_active, 3)
+        poller.shutdown()
+
+    def test_slow_player(self):
+        players = FakePlayers(hang=1.5)
+        poller = PlayerPoller(players.poll, max_workers=3, timeout=0.2)
+
+        latencies = []
+        for _i in range(5):
+            start = perf_counter()
+            results = poller.poll([SLOW] + FAST)
+            latencies.append(perf_counter() - start)
+
+            for name in FAST:
+                self.assertEqual(results[name], ("playing", None))
+            (result, error) = results[SLOW]
+            self.assertIsNone(result)
+            self.assertIsInstance(error, PollTimeout)
+
+        # Only the first round waits for the deadline, later rounds don't
+        # poll the hanging player again and aren't delayed
+        self.assertLess(latencies[0], 0.3)
+        for latency in latencies[1:]:
+            self.assertLess(latency, 0.1)
+        self.assertLessEqual(players.max_active, 3)
+
+        # The slow player will be polled again after it returned
+        sleep(1.5)
+        results = poller.poll([SLOW])
+        self.assertIsInstance(results[SLOW][1], PollTimeout)
+        poller.shutdown()
+
+    def test_exception(self):
+        players = FakePlayers()
+        poller = PlayerPoller(players.poll)
+
+        results = poller.poll(["broken", "fast1"])
+        self.assertIsInstance(results["broken"][1], IOError)
+        self.assertEqual(results["fast1"], ("playing", None))
+        poller.shutdown()
+
+
+class TestPollInterval(unittest.TestCase):
+
+    def test_interval(self):
+        interval = PollInterval(1, min_delay=0.2, max_delay=5,
+                                idle_after=0.1, fast_period=0.1)
+
+        self.assertEqual(interval.next_interval(True), 1)
+        # track ends in 2 seconds
+        self.assertEqual(interval.next_interval(True, 2), 0.2)
+        # wake up right before the end of the track
+        self.assertAlmostEqual(interval.next_interval(True, 3.5), 0.7)
+        self.assertEqual(interval.next_interval(False), 1)
+        sleep(0.15)
+        self.assertEqual(interval.next_interval(False), 5)
+
+        interval.wakeup("command")
+        self.assertEqual(interval.next_interval(False), 0.2)
+        sleep(0.15)
+        self.assertEqual(interval.next_interval(False), 5)
+
+        interval.wakeup("timer")
+        stats = interval.stats()
+        self.assertEqual(stats["interval"], 5)
+        self.assertEqual(stats["wakeups"],
+                         {"timer": 1, "signal": 0, "command": 1})
+
+
+# A player that blocks in C, like a hanging D-Bus call, while the
+# process is monkey patched by gevent
+GEVENT_POLL = r'''
+from gevent import monkey
+monkey.patch_all()
+
+from time import perf_counter, sleep
+
+from ac2.poller import PlayerPoller, PollTimeout
+
+blocking_sleep = monkey.get_original("time", "sleep")
+
+
+def poll(name):
+    if name == "slow":
+        blocking_sleep(2)
+    elif name == "hanging":
+        # a network player that doesn't answer
+        sleep(2)
+    return "playing"
+
+
+poller = PlayerPoller(poll, max_workers=3, timeout=0.3,
+                      blocking=lambda name: name == "slow")
+start = perf_counter()
+results = poller.poll(["slow", "hanging", "fast"])
+duration = perf_counter() - start
+assert duration < 1, duration
+assert results["fast"] == ("playing", None), results
+assert isinstance(results["slow"][1], PollTimeout), results
+assert isinstance(results["hanging"][1], PollTimeout), results
+print("ok")
+'''
+
+# MPD's connection is opened on the hub, polls must not use it from
+# another thread
+GEVENT_MPD = r'''
+from gevent import monkey
+monkey.patch_all()
+
+from gevent.server import StreamServer
+
+from ac2.constants import STATE_PLAYING
+from ac2.players.mpdcontrol import MPDControl
+from ac2.poller import PlayerPoller
+
+blocking_sleep = monkey.get_original("time", "sleep")
+connections = []
+
+
+def fake_mpd(sock, _address):
+    connections.append(sock)
+    reader = sock.makefile("rb")
+    sock.sendall(b"OK MPD 0.21.0\n")
+    for line in reader:
+        if line.startswith(b"status"):
+            sock.sendall(b"volume: 50\nstate: play\nOK\n")
+        elif line.startswith(b"currentsong"):
+            sock.sendall(b"file: a.flac\nArtist: Artist\nTitle: Title\nOK\n")
+        elif line.startswith(b"close"):
+            break
+        else:
+            sock.sendall(b"OK\n")
+
+
+server = StreamServer(("127.0.0.1", 0), fake_mpd)
+server.start()
+mpd = MPDControl({"port": server.server_port})
+
+
+def poll(name):
+    if name == "mpd":
+        return (mpd.get_state(), mpd.get_meta().title)
+    blocking_sleep(0.05)
+    return ("playing", None)
+
+
+poller = PlayerPoller(poll, max_workers=2, timeout=1,
+                      blocking=lambda name: name != "mpd")
+for _i in range(20):
+    results = poller.poll(["mpd", "dbus1", "dbus2"])
+    assert results["mpd"] == ((STATE_PLAYING, "Title"), None), results
+assert mpd.get_state() == STATE_PLAYING
+assert len(connections) == 1, len(connections)
+print("ok")
+'''
+
+
+class TestPollerGevent(unittest.TestCase):
+
+    def run_patched(self, script):
+        # needs its own process because of the monkey patching
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            [os.getcwd()] + [p for p in [env.get("PYTHONPATH")] if p])
+        result = subprocess.run([sys.executable, "-c", script],
+                                env=env, capture_output=True, timeout=30)
+        self.assertEqual(result.stdout.strip(), b"ok", result.stderr)
+
+    def test_blocking_player(self):
+        self.run_patched(GEVENT_POLL)
+
+    def test_mpd(self):
+        self.run_patched(GEVENT_MPD)
+
+
+if __name__ == "__main__":
+    unittest.main()
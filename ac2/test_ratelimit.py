@@ -0,0 +1,71 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import threading
+import unittest
+from time import sleep, monotonic
+
+from ac2.ratelimit import RateLimiter
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_rate(self):
+        limiter = RateLimiter(rate=20, burst=1)
+        start = monotonic()
+        for _i in range(5):
+            limiter.acquire()
+        # first token is available immediately
+        self.assertGreaterEqual(monotonic() - start, 0.19)
+        stats = limiter.stats()
+        self.assertEqual(stats["requests"], 5)
+        self.assertGreater(stats["wait_max"], 0.04)
+
+    def test_priority(self):
+        limiter = RateLimiter(rate=10, burst=1)
+        limiter.acquire()
+        order = []
+
+        def acquire(name, priority):
+            limiter.acquire(priority)
+            order.append(name)
+
+        threads = []
+        for i in range(3):
+            threads.append(threading.Thread(target=acquire,
+                                            args=("background", 1)))
+            threads[-1].start()
+        sleep(0.02)
+        threads.append(threading.Thread(target=acquire,
+                                        args=("playing", 0)))
+        threads[-1].start()
+        for t in threads:
+            t.join()
+
+        # a background request might already have been waiting for the
+        # next token, the playing one goes ahead of the others
+        self.assertIn(order.index("playing"), [0, 1])
+        self.assertEqual(limiter.stats()["queued"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
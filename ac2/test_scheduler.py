@@ -0,0 +1,68 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import unittest
+from time import monotonic
+
+from ac2.scheduler import Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_due(self):
+        scheduler = Scheduler()
+        scheduler.schedule("a", 0)
+        scheduler.schedule("b", 10)
+        scheduler.schedule("c", 0)
+
+        self.assertEqual(scheduler.due(), ["a", "c"])
+        self.assertEqual(scheduler.due(), [])
+        self.assertFalse(scheduler.scheduled("a"))
+        self.assertTrue(scheduler.scheduled("b"))
+        self.assertEqual(scheduler.due(monotonic() + 11), ["b"])
+        self.assertEqual(len(scheduler), 0)
+        self.assertIsNone(scheduler.next_deadline())
+
+    def test_reschedule(self):
+        scheduler = Scheduler()
+        scheduler.schedule("a", 0)
+        scheduler.schedule("a", 10)
+        scheduler.schedule("b", 0)
+        scheduler.cancel("b")
+
+        self.assertEqual(scheduler.due(), [])
+        self.assertGreater(scheduler.next_deadline(), 9)
+        self.assertEqual(len(scheduler.heap), 1)
+
+    def test_jitter(self):
+        scheduler = Scheduler()
+        for i in range(100):
+            scheduler.schedule(i, 100, jitter=0.1)
+
+        now = monotonic()
+        self.assertEqual(scheduler.due(now + 89), [])
+        self.assertEqual(len(scheduler.due(now + 111)), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
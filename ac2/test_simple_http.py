@@ -20,10 +20,15 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 
+import threading
 import unittest
 from datetime import datetime
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-from ac2.simple_http import retrieve_url, post_data, is_cached, is_negative_cached, clear_cache
+from ac2.simple_http import retrieve_url, post_data, is_cached, is_negative_cached, clear_cache, \
+    host_session, ByteLRU, CachedResponse, freshness, cache_info, \
+    CIRCUIT_OPEN, CIRCUIT_CLOSED
 
 GOOGLE = "https://google.com"
 NOT_EXISTING = "http://does-not-exist.nowhere.none"
@@ -31,14 +36,117 @@ BAD_CERT = "https://wrong.host.badssl.com"
 POST = "https://webhook.site/d6c0f2b6-c361-4952-bab5-d95bba6a0fc3"
 TIMEOUT = "http://2.2.2.2"
 
+
+class ConditionalHandler(BaseHTTPRequestHandler):
+    """
+    Answers with an ETag and sends 304 if the client has the current
+    version
+    """
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        ConditionalHandler.requests.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Cache-Control", "max-age=0")
+            self.end_headers()
+            return
+
+        body = b'{"version": 1}'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        if "fresh" in self.path:
+            self.send_header("Cache-Control", "max-age=600")
+        else:
+            self.send_header("Cache-Control", "public, max-age=0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """
+    A cacheable page and a page like google.com sends it: max-age=0
+    without ETag or Last-Modified, it can't be revalidated
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = "<html><body>{}</body></html>".format(self.path).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        if "private" in self.path:
+            self.send_header("Cache-Control", "private, max-age=0")
+        else:
+            self.send_header("Cache-Control", "max-age=600")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(testcase, handler):
+    """
+    Serves on a free port until the test case is finished, returns the
+    base URL
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # cleanups run in reverse order
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    return "http://127.0.0.1:{}".format(server.server_port)
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Fails or answers slowly on request
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    requests = 0
+    fail = False
+    delay = 0
+
+    def do_GET(self):
+        FlakyHandler.requests += 1
+        sleep(FlakyHandler.delay)
+        if FlakyHandler.fail:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
 class Test(unittest.TestCase):
 
 
     def test_retrieve(self):
-        res1 = retrieve_url(GOOGLE)
+        base = start_server(self, PageHandler)
+        res1 = retrieve_url(base + "/page")
         self.assertIsNotNone(res1)
         self.assertTrue("html" in res1.text)
-        res2 = retrieve_url(GOOGLE)
+        res2 = retrieve_url(base + "/page")
         self.assertEqual(res1, res2)
         res = retrieve_url(NOT_EXISTING)
         self.assertIsNone(res)
@@ -56,12 +164,29 @@ class Test(unittest.TestCase):
         self.assertIsNotNone(res)
         
     def test_cache(self):
-        retrieve_url(GOOGLE)
-        self.assertTrue(is_cached(GOOGLE))
-        self.assertFalse(is_negative_cached(GOOGLE))
+        base = start_server(self, PageHandler)
+        retrieve_url(base + "/page")
+        self.assertTrue(is_cached(base + "/page"))
+        self.assertFalse(is_negative_cached(base + "/page"))
+        # expires immediately and can't be revalidated
+        self.assertIsNotNone(retrieve_url(base + "/private"))
+        self.assertFalse(is_cached(base + "/private"))
+        self.assertFalse(is_negative_cached(base + "/private"))
         retrieve_url(NOT_EXISTING)
         self.assertFalse(is_cached(NOT_EXISTING))
         self.assertTrue(is_negative_cached(NOT_EXISTING))
+
+    def test_cache_params(self):
+        base = start_server(self, PageHandler)
+        res1 = retrieve_url(base + "/page", params={"stream": "a"})
+        res2 = retrieve_url(base + "/page", params={"stream": "b"})
+        self.assertTrue(is_cached(base + "/page", {"stream": "a"}))
+        self.assertTrue(is_cached(base + "/page", {"stream": "b"}))
+        self.assertFalse(is_cached(base + "/page"))
+        self.assertIn("stream=a", res1.text)
+        self.assertIn("stream=b", res2.text)
+        res3 = retrieve_url(base + "/page", params={"stream": "a"})
+        self.assertIs(res1, res3)
         
     def test_timeout(self):
         clear_cache()
@@ -77,6 +202,118 @@ class Test(unittest.TestCase):
         t2 = datetime.now()
         self.assertLess((t2-t1).total_seconds(),3)
 
+    def test_sessions(self):
+        s1 = host_session("https://musicbrainz.org/ws/2/recording")
+        s2 = host_session("https://musicbrainz.org/ws/2/release")
+        s3 = host_session("http://musicbrainz.org/ws/2/release")
+        s4 = host_session("https://coverartarchive.org/release/1")
+        self.assertIs(s1, s2)
+        self.assertIsNot(s1, s3)
+        self.assertIsNot(s1, s4)
+
+    def test_byte_lru(self):
+        lru = ByteLRU(max_bytes=1000, ttl=600)
+        for i in range(10):
+            lru.put("key{}".format(i),
+                    CachedResponse(200, "application/json", None,
+                                   b'{"data": "' + b"x" * 100 + b'"}'))
+        info = lru.info()
+        self.assertLessEqual(info["bytes"], 1000)
+        self.assertEqual(info["entries"], 4)
+        self.assertIsNone(lru.get("key0"))
+        self.assertEqual(lru.get("key9").json()["data"], "x" * 100)
+        self.assertEqual(lru.info()["hit_rate"], 0.5)
+
+        lru.ttl = -1
+        lru.put("expired", CachedResponse(200, None, None, b""))
+        self.assertNotIn("expired", lru)
+
+    def test_freshness(self):
+        self.assertEqual(freshness({}, 600), 600)
+        self.assertEqual(freshness({"Cache-Control": "max-age=30"}, 600), 30)
+        self.assertEqual(freshness({"Cache-Control": "public, MAX-AGE=5"},
+                                   600), 5)
+        self.assertEqual(freshness({"Cache-Control": "no-cache"}, 600), 0)
+        self.assertIsNone(freshness({"Cache-Control": "no-store"}, 600))
+
+    def test_revalidation(self):
+        base = start_server(self, ConditionalHandler)
+        ConditionalHandler.requests = []
+        not_modified = cache_info()["not_modified"]
+
+        try:
+            # max-age=0: every request is revalidated
+            res1 = retrieve_url(base + "/stale")
+            res2 = retrieve_url(base + "/stale")
+            self.assertIs(res1, res2)
+            self.assertEqual(res2.json(), {"version": 1})
+            self.assertEqual(ConditionalHandler.requests, [None, '"v1"'])
+            self.assertEqual(cache_info()["not_modified"], not_modified + 1)
+
+            # max-age=600: no request needed
+            retrieve_url(base + "/fresh")
+            retrieve_url(base + "/fresh")
+            self.assertEqual(len(ConditionalHandler.requests), 3)
+        finally:
+            clear_cache()
+
+    def test_circuit_breaker(self):
+        base = start_server(self, FlakyHandler)
+        health = host_session(base).health
+        health.cooldown = 0.5
+        FlakyHandler.requests = 0
+        FlakyHandler.fail = True
+
+        try:
+            for i in range(5):
+                res = retrieve_url("{}/error/{}".format(base, i))
+                self.assertEqual(res.status_code, 503)
+            self.assertEqual(health.state, CIRCUIT_OPEN)
+
+            # the host isn't contacted while the circuit is open
+            t1 = datetime.now()
+            for i in range(10):
+                self.assertIsNone(retrieve_url("{}/skip/{}".format(base, i)))
+            self.assertLess((datetime.now() - t1).total_seconds(), 0.1)
+            self.assertEqual(FlakyHandler.requests, 5)
+            self.assertEqual(health.stats()["skipped"], 10)
+
+            # after the cooldown, a single request checks the host
+            FlakyHandler.fail = False
+            sleep(0.5)
+            self.assertEqual(retrieve_url(base + "/ok").status_code, 200)
+            self.assertEqual(health.state, CIRCUIT_CLOSED)
+        finally:
+            clear_cache()
+
+    def test_adaptive_timeout(self):
+        base = start_server(self, FlakyHandler)
+        health = host_session(base).health
+        FlakyHandler.fail = False
+        FlakyHandler.delay = 0
+
+        try:
+            self.assertEqual(health.timeout(10), 10)
+            for i in range(10):
+                self.assertIsNotNone(retrieve_url("{}/{}".format(base, i)))
+            # fast host: minimal timeout
+            self.assertEqual(health.timeout(10), 1)
+
+            FlakyHandler.delay = 2
+            t1 = datetime.now()
+            self.assertIsNone(retrieve_url(base + "/slow"))
+            self.assertLess((datetime.now() - t1).total_seconds(), 1.5)
+            self.assertEqual(health.stats()["error_rate"], 1 / 11)
+        finally:
+            FlakyHandler.delay = 0
+            clear_cache()
+
+    def test_cached_response(self):
+        res = CachedResponse(200, "text/plain; charset=ISO-8859-1",
+                             "ISO-8859-1", "Motörhead".encode("ISO-8859-1"))
+        self.assertEqual(res.text, "Motörhead")
+        self.assertFalse(hasattr(res, "__dict__"))
+
 
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
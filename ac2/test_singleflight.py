@@ -0,0 +1,154 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import threading
+import unittest
+from time import sleep
+from unittest.mock import patch
+
+from ac2.singleflight import SingleFlight
+from ac2.metadata import Metadata
+from ac2 import simple_http
+import ac2.data.musicbrainz as musicbrainz
+import ac2.data.lastfm as lastfm
+
+CONCURRENT = 8
+
+
+class Upstream():
+    """
+    Counts calls per endpoint, every call needs some time
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        sleep(0.2)
+
+    def get(self, url, **kwargs):
+        self.count(url)
+        return FakeResponse()
+
+    def search_recordings(self, **kwargs):
+        self.count("search_recordings")
+        return {"recording-list": [{"id": "mbid",
+                                    "artist-credit": [
+                                        {"artist": {"id": "artistmbid"}}]}]}
+
+    def search_releases(self, **kwargs):
+        self.count("search_releases")
+        return {"release-list": [{"id": "albummbid"}]}
+
+
+class FakeResponse():
+    status_code = 200
+    headers = {}
+    encoding = None
+    content = b'{}'
+
+
+def run_concurrently(function, count=CONCURRENT):
+    barrier = threading.Barrier(count)
+
+    def run():
+        barrier.wait()
+        function()
+
+    threads = [threading.Thread(target=run) for _i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_shared_result(self):
+        flight = SingleFlight()
+        calls = []
+        results = []
+
+        def slow(value):
+            calls.append(value)
+            sleep(0.2)
+            return value * 2
+
+        run_concurrently(lambda: results.append(flight.do("key", slow, 21)))
+
+        self.assertEqual(calls, [21])
+        self.assertEqual(results, [42] * CONCURRENT)
+        self.assertEqual(flight.stats(), {"executed": 1,
+                                          "shared": CONCURRENT - 1,
+                                          "running": 0})
+
+        # the call is done, the next one runs again
+        flight.do("key", slow, 1)
+        self.assertEqual(calls, [21, 1])
+
+    def test_shared_exception(self):
+        flight = SingleFlight()
+        errors = []
+
+        def failing():
+            sleep(0.2)
+            raise IOError("no connection")
+
+        def call():
+            try:
+                flight.do("key", failing)
+            except IOError as e:
+                errors.append(e)
+
+        run_concurrently(call)
+        self.assertEqual(len(errors), CONCURRENT)
+        self.assertEqual(flight.stats()["executed"], 1)
+
+    def test_concurrent_enrichment(self):
+        upstream = Upstream()
+        simple_http.clear_cache()
+
+        def enrich():
+            md = Metadata("artist", "title", albumTitle="album")
+            musicbrainz.enrich_metadata(md)
+            lastfm.enrich_metadata(md)
+
+        with patch("ac2.simple_http.host_session",
+                   return_value=upstream), \
+            patch("musicbrainzngs.search_recordings",
+                  upstream.search_recordings), \
+            patch("musicbrainzngs.search_releases",
+                  upstream.search_releases):
+            run_concurrently(enrich)
+
+        simple_http.clear_cache()
+        self.assertGreaterEqual(len(upstream.calls), 4)
+        for (endpoint, calls) in upstream.calls.items():
+            self.assertEqual(calls, 1, endpoint)
+
+
+if __name__ == "__main__":
+    unittest.main()
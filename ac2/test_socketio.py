@@ -0,0 +1,85 @@
+'''
+Copyright (c) 2020 Modul 9/HiFiBerry
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import copy
+import json
+import unittest
+
+from ac2.metadata import Metadata, MetadataSnapshots, web_snapshots, \
+    update_web_snapshot
+from ac2.socketio import SnapshotJSON, VersionedSnapshot, MetadataHandler, \
+    metadata_delta
+
+
+class TestMetadataDelta(unittest.TestCase):
+
+    def test_delta(self):
+        snapshots = MetadataSnapshots()
+        md = Metadata("artist", "song")
+        previous = snapshots.update(md)
+        md.tags = ["rock"]
+        md.wiki = "text"
+        snapshot = snapshots.update(md)
+
+        delta = metadata_delta(previous, snapshot)
+        self.assertEqual(delta, {"version": 2,
+                                 "base": 1,
+                                 "changes": {"tags": ["rock"],
+                                             "wiki": "text"}})
+
+        # applying the delta results in the full metadata
+        values = json.loads(previous.json)
+        values.update(delta["changes"])
+        self.assertEqual(values, json.loads(snapshot.json))
+
+    def test_encoding(self):
+        snapshot = MetadataSnapshots().update(Metadata("artist", "song"))
+
+        data = json.loads(SnapshotJSON.dumps(["update", snapshot]))
+        self.assertEqual(data, ["update", snapshot.values])
+
+        data = json.loads(SnapshotJSON.dumps(
+            [VersionedSnapshot(snapshot)]))
+        self.assertEqual(data, [{"version": 1,
+                                 "metadata": snapshot.values}])
+
+        data = json.loads(SnapshotJSON.dumps(["delta", {"version": 2}]))
+        self.assertEqual(data, ["delta", {"version": 2}])
+
+    def test_shared_snapshot(self):
+        handler = MetadataHandler()
+        md = Metadata("artist", "song")
+        md.localArtUrl = "artwork/cache/1234"
+        snapshot = update_web_snapshot(md)
+        self.assertEqual(snapshot.values["externalArtUrl"],
+                         "artwork/cache/1234")
+
+        # every display gets its own copy, the version doesn't change
+        handler.notify(copy.copy(md))
+        handler.notify(copy.copy(md))
+        self.assertIs(handler.snapshot, snapshot)
+        self.assertIs(web_snapshots.current, snapshot)
+        self.assertEqual(handler.versioned.version, snapshot.version)
+
+
+if __name__ == "__main__":
+    unittest.main()
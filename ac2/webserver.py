@@ -20,9 +20,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
 from gevent import monkey; monkey.patch_all()
-from geventwebsocket.handler import WebSocketHandler
 
-import copy
 import json
 import logging
 import os
@@ -33,14 +31,18 @@ import time
 
 import socketio
 
-from bottle import Bottle, request, response, run, static_file
+from bottle import Bottle, request, response, run
 from expiringdict import ExpiringDict
 
-from ac2.metadata import Metadata
+from ac2.metadata import Metadata, web_snapshots, update_web_snapshot
+from ac2.events import EventBroker, SSEStream, LONGPOLL_TIMEOUT
+from ac2 import stats
+import ac2.data.artworkstore as artworkstore
 from ac2.plugins.metadata import MetadataDisplay
 from ac2.socketio import sio
 from ac2.ostools import is_alsa_playing, kill_kill_player, kill_player, active_player
 from ac2.processmapper import ProcessMapper
+from ac2.fileserver import serve_file, SendfileHandler, IMMUTABLE
 
 
 class SystemControl():
@@ -103,8 +105,11 @@ class AudioControlWebserver(MetadataDisplay):
         self.artwork = ExpiringDict(max_len=100, max_age_seconds=36000000)
         self.socketio_api = None
         self.process_mapper = ProcessMapper()
+        self.events = EventBroker()
 
-        self.notify(Metadata("Artist", "Title", "Album"))
+        placeholder = Metadata("Artist", "Title", "Album")
+        update_web_snapshot(placeholder)
+        self.notify(placeholder)
 
         # Last.FM API to access additional track data
 
@@ -123,6 +128,9 @@ class AudioControlWebserver(MetadataDisplay):
         self.bottle.route('/artwork/<filename>',
                           method="GET",
                           callback=self.artwork_handler)
+        self.bottle.route('/artwork/cache/<key>',
+                          method="GET",
+                          callback=self.artwork_cache_handler)
         self.bottle.route('/api/player/status',
                           method="GET",
                           callback=self.playerstatus_handler)
@@ -150,6 +158,9 @@ class AudioControlWebserver(MetadataDisplay):
         self.bottle.route('/api/player/<command>/<ignore>',
                           method="POST",
                           callback=self.playercontrol_ignore_handler)
+        self.bottle.route('/api/events',
+                          method="GET",
+                          callback=self.events_handler)
         self.bottle.route('/api/track/metadata',
                           method="GET",
                           callback=self.metadata_handler)
@@ -165,6 +176,9 @@ class AudioControlWebserver(MetadataDisplay):
         self.bottle.route('/api/volume/<command>',
                           method="POST",
                           callback=self.volume_mute_handler)
+        self.bottle.route('/api/stats',
+                          method="GET",
+                          callback=self.stats_handler)
         self.bottle.route('/api/system/info',
                           method="GET",
                           callback=self.system_info_handler)
@@ -178,9 +192,13 @@ class AudioControlWebserver(MetadataDisplay):
             logging.info("start server 2")
             if self.socketio_api is None:
                 logging.info("starting Bottle web server")
+                # event streams and long-polls need a server that
+                # handles requests concurrently
                 self.bottle.run(port=self.port,
                                 host=self.host,
                                 debug=self.debug,
+                                server="gevent",
+                                handler_class=SendfileHandler
                                 )
             else:
                 logging.info("starting SocketIO web server")
@@ -189,7 +207,7 @@ class AudioControlWebserver(MetadataDisplay):
                     port=self.port,
                     debug=self.debug,
                     server="gevent",
-                    handler_class=WebSocketHandler
+                    handler_class=SendfileHandler
                     )
 
         except Exception as e:
@@ -344,9 +362,52 @@ class AudioControlWebserver(MetadataDisplay):
             "rpi serial": self.system_control.getserial()
         })
 
+    def stats_handler(self):
+        result = stats.collect(self.player_control)
+        result["events"] = self.events.stats()
+        return result
+
     def metadata_handler(self):
-        print(self.metadata)
-        return json.dumps(self.metadata.__dict__, skipkeys=True)
+        since = request.query.get("since")
+        if since is not None:
+            # long-poll: wait until the version changes
+            try:
+                since = int(since)
+            except ValueError:
+                response.status = 400
+                return "since has to be a metadata version"
+            self.events.wait_for(lambda: self.snapshot.version != since,
+                                 LONGPOLL_TIMEOUT)
+
+        snapshot = self.snapshot
+        response.set_header("ETag", snapshot.etag)
+        response.set_header("X-Metadata-Version", str(snapshot.version))
+        response.set_header("Cache-Control", "no-cache")
+        if request.headers.get("If-None-Match") == snapshot.etag or \
+                since == snapshot.version:
+            response.status = 304
+            return ""
+
+        response.content_type = "application/json"
+        return snapshot.json
+
+    def events_handler(self):
+        """
+        Server-Sent Events stream of metadata, state and volume changes.
+        A client that reconnects with Last-Event-ID gets the events it
+        missed.
+        """
+        last_id = request.headers.get("Last-Event-ID")
+        try:
+            last_id = int(last_id)
+        except (TypeError, ValueError):
+            last_id = None
+
+        response.content_type = "text/event-stream"
+        response.set_header("Cache-Control", "no-cache")
+        # don't let proxies buffer the stream
+        response.set_header("X-Accel-Buffering", "no")
+        return SSEStream(self.events, last_id)
 
     def track_handler(self, command):
         if (command in ["love", "unlove"]):
@@ -418,18 +479,44 @@ class AudioControlWebserver(MetadataDisplay):
             return "not connected to a player control"
 
     def static_handler(self, filename):
-        return static_file(filename, root='static')
+        return serve_file(filename, root='static')
 
     def artwork_handler(self, filename):
-        logging.info("artwork filename=%s", filename)
+        logging.debug("artwork filename=%s", filename)
         realfile = self.artwork.get(filename)
         if realfile is None:
             logging.warning("%s does not exist in cache", filename)
+            response.status = 404
+            return "{} does not exist".format(filename)
+
+        # the file might be replaced, clients have to revalidate
+        return serve_file(realfile, root='/')
 
-        if not(pathlib.Path(realfile).exists()):
-            logging.warning("%s does not exist", realfile)
+    def artwork_cache_handler(self, key):
+        store = artworkstore.artwork_store
+        if store is None:
+            response.status = 404
+            return "no artwork store"
 
-        return static_file(realfile, root='/')
+        width = None
+        try:
+            if request.query.get("size"):
+                width = int(request.query.get("size"))
+        except ValueError:
+            response.status = 400
+            return "invalid size {}".format(request.query.get("size"))
+
+        artwork = store.get(key, width)
+        if artwork is None:
+            response.status = 404
+            return "{} does not exist in cache".format(key)
+
+        # the content of a key never changes
+        return serve_file(artwork.filename,
+                          root=store.path,
+                          mimetype=artwork.content_type,
+                          etag='"{}"'.format(artwork.etag),
+                          cache_control=IMMUTABLE)
 
     # ##
     # ## end URL handlers
@@ -489,12 +576,23 @@ class AudioControlWebserver(MetadataDisplay):
     # ## metadata functions
     # ##
     def notify(self, metadata):
-        # Create a copy, because we might need to modify the artUrl
-        metadata = copy.copy(metadata)
+        # The snapshot has been created by the controller
         self.metadata = metadata
+        self.snapshot = web_snapshots.current
+        self.events.publish("metadata", self.snapshot.json)
 
     def notify_volume(self, vol):
         self.volume = vol
+        self.events.publish("volume", {"percent": vol})
+
+    def update_playback_state(self, state):
+        players = []
+        if self.player_control is not None:
+            try:
+                players = self.player_control.states()["players"]
+            except Exception as e:
+                logging.warning("couldn't retrieve player states: %s", e)
+        self.events.publish("state", {"state": state, "players": players})
 
     def send_metadata_update(self, updates, song_id=None):
         if song_id is None and self.metadata is not None: